@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tüm koleksiyonları Parquet olarak dışa aktarır (artımlı, gün bazlı bölümler).
+
+Kullanım:
+    python export_parquet.py                 # Son export'tan bu yana
+    python export_parquet.py --full          # Hepsini baştan yaz
+    python export_parquet.py --out /data/sar shipments manufacturing_records
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from server import client, export_parquet_all, export_parquet_dataset, parquet_dataset_names
+
+
+async def main(args):
+    out_dir = Path(args.out) if args.out else None
+    if args.datasets:
+        results = [await export_parquet_dataset(name, full=args.full, out_dir=out_dir) for name in args.datasets]
+    else:
+        results = await export_parquet_all(full=args.full, out_dir=out_dir)
+    
+    failed = False
+    for result in results:
+        if 'error' in result:
+            failed = True
+            print(f"  ✗ {result['dataset']}: {result['error']}")
+        else:
+            print(f"  ✓ {result['dataset']}: {result['rows']} kayıt, {result['partitions']} bölüm ({result['duration_ms']} ms)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Koleksiyonları Parquet olarak dışa aktar")
+    parser.add_argument('datasets', nargs='*', help=f"Koleksiyonlar (varsayılan: hepsi) - {', '.join(parquet_dataset_names())}")
+    parser.add_argument('--full', action='store_true', help="Artımlı değil, tamamını yeniden yaz")
+    parser.add_argument('--out', help="Hedef dizin (varsayılan: PARQUET_EXPORT_DIR)")
+    args = parser.parse_args()
+    
+    unknown = set(args.datasets) - set(parquet_dataset_names())
+    if unknown:
+        parser.error(f"Bilinmeyen koleksiyon: {', '.join(sorted(unknown))}")
+    
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Stok olay kaydını tek geçişte katlayarak bakiyeleri yeniden hesaplar.
+
+Kullanım:
+    python rebuild_inventory.py              # Sadece fark raporu
+    python rebuild_inventory.py --apply      # products current_stock değerlerini düzelt
+                                             # (hammadde farkları raporlanır, düzeltme mutabakatla yapılır)
+"""
+
+import argparse
+import asyncio
+import sys
+
+from server import client, rebuild_inventory, seed_inventory_events
+
+
+async def main(args):
+    await seed_inventory_events()
+    report = await rebuild_inventory(apply=args.apply)
+
+    print(f"{report['events_folded']} olay katlandı ({report['duration_ms']} ms)")
+    if report['pending_events']:
+        print(f"  ! {report['pending_events']} tamamlanmamış (pending) hareket katlanmadı, kontrol edin")
+    for item in report['discrepancies']:
+        label = item['name'] or item['item_id']
+        print(f"  ✗ {item['kind']} {label}: kayıtlı {item['stored']}, olaylardan {item['rebuilt']}")
+    if args.apply:
+        print(f"{report['corrected']} ürün bakiyesi düzeltildi")
+        if any(item['kind'] == 'raw_material' for item in report['discrepancies']):
+            print("  Hammadde farkları düzeltilmedi; düzeltme reconcile_material_stock ile yapılır "
+                  "(POST /api/admin/stock-reconciliation?apply=true)")
+    elif not report['discrepancies']:
+        print("  ✓ Tüm bakiyeler olay kaydıyla uyumlu")
+    # --apply hammadde farklarını gidermez; kalan fark varsa başarısız dön
+    unresolved = [item for item in report['discrepancies'] if not args.apply or item['kind'] == 'raw_material']
+    return 1 if unresolved else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stokları olay kaydından yeniden oluştur")
+    parser.add_argument('--apply', action='store_true', help="Ürün (products) farklarını yaz; hammadde farkları yalnızca raporlanır")
+    args = parser.parse_args()
+
+    try:
+        sys.exit(asyncio.run(main(args)))
+    finally:
+        client.close()
@@ -1,27 +1,477 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.responses import Response, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from bson import ObjectId
+from gridfs.errors import NoFile
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import monitoring
+from pymongo import ReturnDocument, DeleteOne, ReplaceOne, UpdateOne, timeout as mongo_timeout
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import SecondaryPreferred
 import os
 import logging
+import asyncio
+import json
+import re
+import random
+import threading
+import io
+import hashlib
+import shutil
+import zlib
+import time
+import math
+import socket
+from collections import OrderedDict
+from contextvars import Context, ContextVar
+from functools import lru_cache
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter, create_model
+from typing import Dict, List, Optional, Union, get_args, get_origin
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
+import numpy as np
 from jose import jwt
 from enum import Enum
 
+try:
+    import brotli
+except ImportError:  # Brotli yoksa yalnızca gzip kullanılır
+    brotli = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Slow Query Log Settings
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', '1.0'))  # 0-1 arası örnekleme oranı
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', '300'))  # Aynı sorgu şekli için saniye
+SLOW_QUERY_LOG_BYTES = int(os.environ.get('SLOW_QUERY_LOG_BYTES', str(16 * 1024 * 1024)))
+SLOW_QUERY_EXPLAIN_SHAPES = int(os.environ.get('SLOW_QUERY_EXPLAIN_SHAPES', '1000'))  # Son explain zamanı tutulan en fazla sorgu şekli
+STOCK_ALERT_LOG_BYTES = int(os.environ.get('STOCK_ALERT_LOG_BYTES', str(4 * 1024 * 1024)))
+STOCK_ALERT_POLL_S = float(os.environ.get('STOCK_ALERT_POLL_S', '1'))
+
+# Komut adı -> sorgu şeklinin bulunduğu alan
+SLOW_QUERY_COMMANDS = {
+    'find': 'filter',
+    'aggregate': 'pipeline',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'update': 'updates',
+    'delete': 'deletes',
+}
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct'}
+
+# Aktif isteğin ASGI scope'u (rota bilgisi için)
+request_scope: ContextVar[Optional[dict]] = ContextVar('request_scope', default=None)
+
+_background_tasks = set()
+
+def spawn_background(coro):
+    """Arka plan görevi başlat ve referansını tut (isteğin bağlamı ve Mongo süre bütçesi devralınmaz)"""
+    task = asyncio.get_running_loop().create_task(coro, context=Context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+class Metrics:
+    """Süreç içi basit metrik kaydı (sayaçlar ve süre özetleri)"""
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+
+    def incr(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value_ms: float):
+        stats = self.timings.setdefault(name, {'count': 0, 'sum_ms': 0.0, 'max_ms': 0.0})
+        stats['count'] += 1
+        stats['sum_ms'] += value_ms
+        stats['max_ms'] = max(stats['max_ms'], value_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            'counters': dict(self.counters),
+            'timings': {
+                name: {**stats, 'avg_ms': stats['sum_ms'] / stats['count']}
+                for name, stats in self.timings.items()
+            }
+        }
+
+metrics = Metrics()
+
+# Request Coalescing (Eş zamanlı özdeş GET istekleri tek hesaplamayı bekler)
+COALESCE_ROUTES = {
+    name.strip() for name in os.environ.get(
+        'COALESCE_ROUTES', 'dashboard_stats,stock,cost_analysis,production_cost_analysis'
+    ).split(',') if name.strip()
+}
+
+class SingleFlight:
+    """Aynı anahtarla devam eden hesaplama varsa yenisini başlatmadan onun sonucunu paylaşır"""
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, route: str, key, loader):
+        if route not in COALESCE_ROUTES:
+            return await loader()
+        flight_key = (route, key)
+        future = self._inflight.get(flight_key)
+        if future is None:
+            # Ayrı görev: ilk istek iptal edilse de bekleyenler sonucu alır
+            future = asyncio.ensure_future(loader())
+            self._inflight[flight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(flight_key, None))
+            metrics.incr(f"coalesce_leaders.{route}")
+        else:
+            metrics.incr('coalesced_requests')
+            metrics.incr(f"coalesced_requests.{route}")
+        return await asyncio.shield(future)
+
+single_flight = SingleFlight()
+
+def redact_query_shape(value):
+    """Sorgu değerlerini gizleyip sadece yapıyı bırak"""
+    if isinstance(value, dict):
+        return {key: redact_query_shape(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [redact_query_shape(val) for val in value]
+        if all(item == '?' for item in items):
+            return ['?'] if items else []
+        return items
+    return '?'
+
+def query_shape(command_name: str, command: dict):
+    """Komuttan filtre veya pipeline şeklini çıkar"""
+    shape = command.get(SLOW_QUERY_COMMANDS[command_name])
+    if command_name in ('update', 'delete'):
+        # Toplu yazma komutlarında sadece ilk ifadenin filtresi
+        statements = shape or []
+        shape = statements[0].get('q') if statements else None
+    return redact_query_shape(shape or {})
+
+def _plan_stages(plan: dict) -> str:
+    """Kazanan planı 'FETCH > IXSCAN' biçiminde özetle"""
+    stages = []
+    while plan:
+        plan = plan.get('queryPlan', plan)
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return ' > '.join(stages)
+
+def summarize_explain(result: dict) -> dict:
+    """explain("executionStats") çıktısından özet istatistikler"""
+    if 'stages' in result:  # aggregate
+        cursor_stage = result['stages'][0].get('$cursor', {})
+        stats = cursor_stage.get('executionStats', {})
+        planner = cursor_stage.get('queryPlanner', {})
+    else:
+        stats = result.get('executionStats', {})
+        planner = result.get('queryPlanner', {})
+    return {
+        'docs_examined': stats.get('totalDocsExamined'),
+        'keys_examined': stats.get('totalKeysExamined'),
+        'n_returned': stats.get('nReturned'),
+        'plan': _plan_stages(planner.get('winningPlan', {})) or None,
+    }
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Eşik değerini aşan Mongo komutlarını yakalar"""
+
+    def __init__(self):
+        self.loop = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_explained = OrderedDict()  # LRU: en eski şekil atılır
+
+    def started(self, event):
+        if self.loop is None or event.command_name not in SLOW_QUERY_COMMANDS:
+            return
+        if event.command.get(event.command_name) == 'slow_queries':
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (dict(event.command), request_scope.get())
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < SLOW_QUERY_MS:
+            return
+        command, scope = pending
+        self.loop.call_soon_threadsafe(
+            self._record, event.command_name, command, scope, duration_ms, event.database_name
+        )
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop((event.connection_id, event.request_id), None)
+
+    def _should_explain(self, command_name: str, shape_key: str) -> bool:
+        if command_name not in EXPLAINABLE_COMMANDS or random.random() >= SLOW_QUERY_EXPLAIN_SAMPLE:
+            return False
+        now = time.monotonic()
+        if now - self._last_explained.get(shape_key, float('-inf')) < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        self._last_explained[shape_key] = now
+        self._last_explained.move_to_end(shape_key)
+        while len(self._last_explained) > SLOW_QUERY_EXPLAIN_SHAPES:
+            self._last_explained.popitem(last=False)
+        return True
+
+    def _record(self, command_name, command, scope, duration_ms, database_name):
+        route = None
+        method = None
+        if scope is not None:
+            api_route = scope.get('route')
+            route = api_route.path if api_route is not None else scope.get('path')
+            method = scope.get('method')
+        collection = command.get(command_name)
+        shape = json.dumps(query_shape(command_name, command), sort_keys=True, default=str)
+        entry = {
+            "id": str(uuid.uuid4()),
+            "route": route,
+            "method": method,
+            "command": command_name,
+            "collection": collection,
+            "shape": shape,
+            "duration_ms": round(duration_ms, 1),
+            "docs_examined": None,
+            "keys_examined": None,
+            "n_returned": None,
+            "plan": None,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        explain = self._should_explain(command_name, f"{collection}|{command_name}|{shape}")
+        spawn_background(record_slow_query(entry, command if explain else None, database_name))
+
+async def record_slow_query(entry: dict, command: Optional[dict], database_name: str):
+    """Yavaş sorguyu (örneklenmişse explain ile) slow_queries koleksiyonuna yaz"""
+    if command is not None:
+        explain_cmd = {
+            key: value for key, value in command.items()
+            if not key.startswith('$') and key not in ('lsid', 'txnNumber', 'autocommit', 'startTransaction')
+        }
+        try:
+            result = await client[database_name].command(
+                {"explain": explain_cmd, "verbosity": "executionStats"}
+            )
+            entry.update(summarize_explain(result))
+        except Exception as e:
+            logger.warning(f"Slow query explain failed: {e}")
+    try:
+        await db.slow_queries.insert_one(entry)
+    except Exception as e:
+        logger.warning(f"Slow query log write failed: {e}")
+
+slow_query_listener = SlowQueryListener()
+
+class WriteVersionListener(monitoring.CommandListener):
+    """Bu worker'dan geçen her yazma komutu bittiğinde veri sürümünü artırır"""
+
+    WRITE_COMMANDS = {'insert', 'update', 'delete', 'findAndModify'}
+    IGNORED_COLLECTIONS = {'slow_queries', 'idempotency_keys'}
+
+    def __init__(self):
+        self.version = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in self.WRITE_COMMANDS and event.command.get(event.command_name) not in self.IGNORED_COLLECTIONS:
+            with self._lock:
+                self._pending.add((event.connection_id, event.request_id))
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        # Yazma görünür olduktan sonra artır; öncesinde başlayan hesaplamaya yeni istek katılmasın
+        with self._lock:
+            key = (event.connection_id, event.request_id)
+            if key in self._pending:
+                self._pending.discard(key)
+                self.version += 1
+
+write_version = WriteVersionListener()
+
+def coalesce_key(**params) -> tuple:
+    """Parametreler ve veri sürümünden single-flight anahtarı"""
+    return (write_version.version,) + tuple(sorted(params.items()))
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    maxIdleTimeMS=int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000')),
+    waitQueueTimeoutMS=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000')),
+    connectTimeoutMS=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '10000')),
+    serverSelectionTimeoutMS=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000')),
+    socketTimeoutMS=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '60000')),
+    # zlib standart kütüphanede; zstd/snappy için zstandard/python-snappy kurulup MONGO_COMPRESSORS ile açılır
+    compressors=os.environ.get('MONGO_COMPRESSORS', 'zlib'),
+    event_listeners=[slow_query_listener, write_version]
+)
 db = client[os.environ['DB_NAME']]
 
+# Ağır rapor sorguları için ikincil (secondary) okuma bağlantısı
+# Tek sunucuda (standalone) secondaryPreferred otomatik olarak primary'den okur
+ANALYTICS_MAX_STALENESS_S = int(os.environ.get('ANALYTICS_MAX_STALENESS_S', '120'))  # En az 90 sn, -1 = sınırsız
+analytics_db = client.get_database(
+    os.environ['DB_NAME'],
+    read_preference=SecondaryPreferred(max_staleness=ANALYTICS_MAX_STALENESS_S)
+)
+
+# Lease kayıtları (işler, zamanlanmış görevler) için bu sürecin kimliği
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+async def hold_scheduler_lease(name: str, ttl_s: float) -> bool:
+    """Zamanlanmış görevi tek worker çalıştırsın: lease bizdeyse yenile, süresi dolmuşsa devral"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.scheduler_leases.update_one(
+            {"_id": name, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ttl_s)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # Lease başka bir canlı worker'da
+        return False
+
+# Cache Invalidation Settings
+CACHE_POLL_INTERVAL_S = float(os.environ.get('CACHE_POLL_INTERVAL_S', '2'))  # Polling modunda en fazla gecikme
+CACHE_USE_CHANGE_STREAMS = os.environ.get('CACHE_USE_CHANGE_STREAMS', 'true').lower() == 'true'
+
+class LocalCache:
+    """Worker içi önbellek; geçerliliği cache_versions koleksiyonundaki sürüme bağlıdır"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.version = None
+        self._entries = {}
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_load(self, key, loader):
+        if key in self._entries:
+            return self._entries[key]
+        version = self.version
+        value = await loader()
+        # Yükleme sırasında geçersiz kılındıysa eski veriyi saklama
+        if self.version == version:
+            self._entries[key] = value
+        return value
+
+class CacheBus:
+    """Tüm worker'larda önbellekleri geçersiz kılan veri yolu (change stream veya polling)"""
+
+    def __init__(self):
+        self.caches = {}
+
+    def register(self, name: str) -> LocalCache:
+        cache = LocalCache(name)
+        self.caches[name] = cache
+        return cache
+
+    async def invalidate(self, *names: str):
+        """Sürümü artır; diğer worker'lar değişikliği cache_versions üzerinden görür"""
+        for name in names:
+            result = await db.cache_versions.find_one_and_update(
+                {"_id": name},
+                {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            self._apply(name, result['version'])
+
+    def _apply(self, name: str, version: int):
+        cache = self.caches.get(name)
+        if cache is not None and cache.version != version:
+            cache.clear()
+            cache.version = version
+
+    async def _sync(self):
+        async for doc in db.cache_versions.find({}):
+            self._apply(doc['_id'], doc['version'])
+
+    async def _watch(self):
+        async with db.cache_versions.watch(full_document='updateLookup') as stream:
+            # Akış açıldıktan sonra senkronize et, aradaki değişiklik kaçmasın
+            await self._sync()
+            async for change in stream:
+                doc = change.get('fullDocument')
+                if doc:
+                    self._apply(doc['_id'], doc['version'])
+
+    async def run(self):
+        use_change_streams = CACHE_USE_CHANGE_STREAMS
+        while True:
+            try:
+                if use_change_streams:
+                    await self._watch()
+                else:
+                    await self._sync()
+                    await asyncio.sleep(CACHE_POLL_INTERVAL_S)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # Standalone sunucu change stream desteklemez, polling'e geç
+                if use_change_streams:
+                    logger.info(f"Change streams unavailable, polling cache_versions instead: {e}")
+                    use_change_streams = False
+                else:
+                    logger.warning(f"Cache version sync failed: {e}")
+                    await asyncio.sleep(CACHE_POLL_INTERVAL_S)
+            except Exception as e:
+                logger.warning(f"Cache version sync failed: {e}")
+                await asyncio.sleep(CACHE_POLL_INTERVAL_S)
+
+cache_bus = CacheBus()
+material_catalog_cache = cache_bus.register('material_catalog')
+exchange_rates_cache = cache_bus.register('exchange_rates')
+material_prices_cache = cache_bus.register('material_prices')
+
+DEFAULT_EXCHANGE_RATES = {'USD': 32.50, 'EUR': 35.00}
+
+async def get_material_catalog() -> dict:
+    """Hammadde kataloğu (id -> kayıt); stok alanı hariç, önbellekten"""
+    async def load():
+        materials = await db.raw_materials.find({}, {"_id": 0, "current_stock": 0}).to_list(1000)
+        return {m['id']: m for m in materials}
+    return await material_catalog_cache.get_or_load('by_id', load)
+
+async def find_catalog_material(material_id: Optional[str] = None, name: Optional[str] = None) -> Optional[dict]:
+    catalog = await get_material_catalog()
+    if material_id is not None:
+        return catalog.get(material_id)
+    return next((m for m in catalog.values() if m['name'] == name), None)
+
+async def get_exchange_rate_map() -> dict:
+    """Güncel döviz kurları (currency -> rate), varsayılanlarla birlikte, önbellekten"""
+    async def load():
+        rates = dict(DEFAULT_EXCHANGE_RATES)
+        async for rate in db.exchange_rates.find({}, {"_id": 0, "currency": 1, "rate": 1}):
+            rates[rate['currency']] = rate['rate']
+        return rates
+    return await exchange_rates_cache.get_or_load('rates', load)
+
 # JWT Settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
@@ -59,6 +509,7 @@ class User(BaseModel):
     username: str
     email: Optional[str] = None
     role: UserRole
+    version: int = 1
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class UserCreate(BaseModel):
@@ -103,6 +554,7 @@ class RawMaterial(BaseModel):
     unit_price: float
     current_stock: float = 0
     min_stock_level: float = 0
+    below_min: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class RawMaterialCreate(BaseModel):
@@ -173,6 +625,8 @@ class ManufacturingRecord(BaseModel):
     color_name: Optional[str] = None  # Renk adı
     model: str  # Model açıklaması
     gas_consumption_kg: float  # Gaz Payı (kg)
+    sku: Optional[str] = None  # Kanonik ürün anahtarı (kalınlık|en|boy|renk)
+    version: int = 1  # Optimistic concurrency (ETag / If-Match)
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -268,6 +722,7 @@ class MaterialEntry(BaseModel):
     total_amount: float
     supplier: Optional[str] = None
     invoice_number: Optional[str] = None
+    version: int = 1
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -300,6 +755,8 @@ class CutProductionRecord(BaseModel):
     total_cut_pieces: int  # Toplam kesilmiş adet
     cut_square_meters: float  # Kesilmiş ürün m²
     color: Optional[str] = None
+    sku: Optional[str] = None  # Kesilmiş ürünün kanonik anahtarı
+    output_record_id: Optional[str] = None  # Kesilmiş ürün için oluşturulan üretim kaydı
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -326,6 +783,7 @@ class Shipment(BaseModel):
     invoice_number: str  # İrsaliye Numarası
     vehicle_plate: str  # Araç Plakası
     driver_name: str  # Şoför Bilgisi
+    sku: Optional[str] = None  # Kanonik ürün anahtarı (kalınlık|en|boy|renk)
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -412,6 +870,519 @@ def is_admin(user):
     """Kullanıcının admin olup olmadığını kontrol et"""
     return user.get('role') == 'admin'
 
+# Optimistic concurrency: belge sürümü ETag olarak döner, güncellemede If-Match ile geri gönderilir
+def etag(doc: dict) -> str:
+    return f'"{doc.get("version", 1)}"'
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """If-Match başlığındaki sürüm ("3" veya W/"3"); başlık yoksa veya * ise None"""
+    if not if_match or if_match.strip() == '*':
+        return None
+    try:
+        return int(if_match.strip().removeprefix('W/').strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header, expected a version ETag")
+
+def versioned_filter(record_id: str, version: Optional[int]) -> dict:
+    """Sürüm alanı olmayan eski belgeler 1. sürüm sayılır"""
+    match = {"id": record_id}
+    if version is not None:
+        match['version'] = {"$in": [1, None]} if version == 1 else version
+    return match
+
+# Bu koleksiyonlara yapılan her yazma sürümü artırmalı, yoksa eski ETag ile gelen güncelleme başarılı olur
+VERSIONED_COLLECTIONS = ('users', 'material_entries', 'manufacturing_records')
+VERSION_BUMP = {"version": {"$add": [{"$ifNull": ["$version", 1]}, 1]}}
+
+def versioned_update(fields: dict) -> list:
+    """Alanları yaz ve sürümü artır (tek pipeline güncellemesi)"""
+    return [{"$set": {
+        **{key: {"$literal": value} for key, value in fields.items()},
+        **VERSION_BUMP
+    }}]
+
+def set_fields(name: str, fields: dict):
+    """$set güncellemesi; sürümlü koleksiyonlarda sürüm de artar"""
+    return versioned_update(fields) if name in VERSIONED_COLLECTIONS else {"$set": fields}
+
+async def raise_update_failure(collection, record_id: str, not_found: str):
+    """Koşullu güncelleme eşleşmediyse 404 mü 409 mu ayır (okuma yalnızca hata yolunda)"""
+    current = await collection.find_one({"id": record_id}, {"_id": 0, "version": 1})
+    if current is None:
+        await raise_not_found(collection.name, record_id, not_found)
+    raise HTTPException(
+        status_code=409,
+        detail="Record was modified by someone else, reload and try again",
+        headers={"ETag": etag(current)}
+    )
+
+def date_range_filter(field: str, start: Optional[str] = None, end: Optional[str] = None, as_datetime: bool = False) -> dict:
+    """Tarih alanı için aralık filtresi (YYYY-MM-DD, bitiş günü dahil)
+    
+    Alan ISO string olarak saklanıyorsa string, BSON tarih ise (as_datetime) UTC datetime sınırları üretir.
+    """
+    bounds = {}
+    try:
+        if start:
+            bounds['$gte'] = datetime.fromisoformat(start[:10]).replace(tzinfo=timezone.utc)
+        if end:
+            bounds['$lt'] = datetime.fromisoformat(end[:10]).replace(tzinfo=timezone.utc) + timedelta(days=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    if not as_datetime:
+        bounds = {op: value.strftime('%Y-%m-%d') for op, value in bounds.items()}
+    return {field: bounds} if bounds else {}
+
+# Sparse Field Selection (?fields=a,b,c)
+def parse_fields(fields: Optional[str], model) -> Optional[tuple]:
+    """?fields= parametresini modele göre doğrula; verilmemişse None (tam yanıt)"""
+    if not fields:
+        return None
+    names = tuple(sorted({name.strip() for name in fields.split(',') if name.strip()}))
+    unknown = [name for name in names if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names or None
+
+def field_projection(names: Optional[tuple], *required: str) -> dict:
+    """Seçilen alanlar için Mongo projection; required alanlar sunucu tarafı işlemler içindir, yanıta girmez"""
+    if not names:
+        return {"_id": 0}
+    return {"_id": 0, **{name: 1 for name in (*names, *required)}}
+
+@lru_cache(maxsize=256)
+def partial_adapter(model, names: tuple, many: bool) -> TypeAdapter:
+    """Seçilen alanlardan oluşan kısmi yanıt modeli (model + alan kümesi başına bir kez oluşturulur)"""
+    partial = create_model(
+        f"{model.__name__}Partial",
+        __config__=ConfigDict(extra="ignore"),
+        **{name: (Optional[model.model_fields[name].annotation], None) for name in names}
+    )
+    return TypeAdapter(List[partial] if many else partial)
+
+def sparse_response(model, names: tuple, data) -> Response:
+    adapter = partial_adapter(model, names, isinstance(data, list))
+    return Response(adapter.dump_json(adapter.validate_python(data)), media_type="application/json")
+
+# Hot/Cold Archival (Kapanmış aylar archive_<koleksiyon> koleksiyonlarına taşınır)
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', '0'))  # 0 = arşivleme kapalı (varsayılan); örn. 24 ile açılır
+ARCHIVE_INTERVAL_S = int(os.environ.get('ARCHIVE_INTERVAL_S', '86400'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+
+# Koleksiyon -> ayın belirlendiği tarih alanı
+ARCHIVED_COLLECTIONS = {
+    'manufacturing_records': 'production_date',
+    'shipments': 'shipment_date',
+    'consumptions': 'created_at',
+    'stock_transactions': 'created_at',
+}
+archive_state_cache = cache_bus.register('archive_state')
+
+async def archived_before(name: str) -> Optional[str]:
+    """Bu tarihten (YYYY-MM-01) önceki kayıtlar arşiv koleksiyonunda"""
+    async def load():
+        return {doc['_id']: doc['archived_before'] async for doc in db.archive_state.find({})}
+    return (await archive_state_cache.get_or_load('all', load)).get(name)
+
+async def reaches_archive(name: str, start: Optional[str]) -> bool:
+    cutoff = await archived_before(name)
+    return cutoff is not None and (start is None or start[:10] < cutoff)
+
+async def history_match_stages(name: str, match: dict, start: Optional[str] = None, end: Optional[str] = None) -> list:
+    """$match aşaması; tarih aralığı arşive uzanıyorsa arşiv koleksiyonunu $unionWith ile ekler"""
+    combined = {**match, **date_range_filter(ARCHIVED_COLLECTIONS[name], start, end)}
+    stages = [{"$match": combined}]
+    if await reaches_archive(name, start):
+        stages.append({"$unionWith": {"coll": f"archive_{name}", "pipeline": [{"$match": combined}]}})
+    return stages
+
+def bson_sort_key(value) -> tuple:
+    """Mongo'nun tür sırasına yakın sıralama anahtarı (null < sayı < metin < diğer < bool < tarih)"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (4, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (5, value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+    return (3, str(value))
+
+async def history_find(database, name: str, match: Optional[dict] = None, start: Optional[str] = None,
+                       end: Optional[str] = None, sort: Optional[list] = None, limit: Optional[int] = None,
+                       projection: Optional[dict] = None) -> list:
+    """Sıcak koleksiyondan oku; arşive yalnızca aralık oraya uzanıyor ve sonuç eksik kalıyorsa in"""
+    date_field = ARCHIVED_COLLECTIONS[name]
+    combined = {**(match or {}), **date_range_filter(date_field, start, end)}
+    projection = projection or {"_id": 0}
+    if any(value == 1 for value in projection.values()):
+        # Arşiv birleştirmesi sıralama alanlarına ihtiyaç duyar
+        projection = {**projection, date_field: 1, **{field: 1 for field, _ in sort or []}}
+    
+    cursor = database[name].find(combined, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    docs = await cursor.to_list(limit)
+    if not await reaches_archive(name, start):
+        return docs
+    
+    newest_first = bool(sort) and tuple(sort[0]) == (date_field, -1)
+    if newest_first and limit is not None and len(docs) >= limit:
+        # Arşivdeki kayıtların hepsi sıcak koleksiyondakilerden eski
+        return docs
+    
+    archive_cursor = database[f"archive_{name}"].find(combined, projection)
+    if sort:
+        archive_cursor = archive_cursor.sort(sort)
+    if limit is not None:
+        archive_cursor = archive_cursor.limit(limit - len(docs) if newest_first else limit)
+    archived = await archive_cursor.to_list(None)
+    if newest_first:
+        return docs + archived
+    
+    docs += archived
+    for field, direction in reversed(sort or []):
+        docs.sort(key=lambda d: bson_sort_key(d.get(field)), reverse=direction == -1)
+    return docs[:limit] if limit is not None else docs
+
+async def raise_not_found(name: str, record_id: str, detail: str):
+    """Sıcak koleksiyonda yoksa: arşivdeyse kapanmış dönem salt okunurdur (409), değilse 404"""
+    if name in ARCHIVED_COLLECTIONS and await db[f"archive_{name}"].find_one({"id": record_id}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="Record belongs to an archived (closed) period and is read-only")
+    raise HTTPException(status_code=404, detail=detail)
+
+def archive_cutoff_month(now: Optional[datetime] = None) -> str:
+    """ARCHIVE_AFTER_MONTHS ay önceki ayın ilk günü"""
+    now = now or datetime.now(timezone.utc)
+    month_index = now.year * 12 + (now.month - 1) - ARCHIVE_AFTER_MONTHS
+    return f"{month_index // 12:04d}-{month_index % 12 + 1:02d}-01"
+
+async def archive_closed_months(name: str) -> int:
+    """Kesim tarihinden önceki kayıtları arşive taşı (tekrar çalıştırılabilir)"""
+    date_field = ARCHIVED_COLLECTIONS[name]
+    cutoff = archive_cutoff_month()
+    current = await archived_before(name)
+    if current is None or current < cutoff:
+        # Okuyucular taşıma sırasında da arşivi birleştirsin diye durum önce güncellenir
+        await db.archive_state.update_one(
+            {"_id": name},
+            {"$set": {"archived_before": cutoff, "updated_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        await cache_bus.invalidate('archive_state')
+    
+    moved = 0
+    archive = db[f"archive_{name}"]
+    while True:
+        batch = await db[name].find({date_field: {"$lt": cutoff}}).limit(ARCHIVE_BATCH_SIZE).to_list(None)
+        if not batch:
+            break
+        await archive.bulk_write([ReplaceOne({"id": doc['id']}, doc, upsert=True) for doc in batch], ordered=False)
+        # Yalnızca kopyalandığı haliyle duran belgeleri sil; arada güncellenen belge sıcakta kalır,
+        # sonraki turda güncel haliyle yeniden kopyalanır (güncelleme kaybolmaz)
+        result = await db[name].bulk_write([
+            DeleteOne({"_id": doc['_id'], "$expr": {"$eq": ["$$ROOT", {"$literal": doc}]}})
+            for doc in batch
+        ], ordered=False)
+        moved += result.deleted_count
+    return moved
+
+async def run_archive_scheduler():
+    while ARCHIVE_AFTER_MONTHS > 0:
+        for name in ARCHIVED_COLLECTIONS:
+            try:
+                moved = await archive_closed_months(name)
+                if moved:
+                    logger.info(f"Archived {moved} {name} records")
+            except Exception as e:
+                logger.warning(f"Archiving {name} failed: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_S)
+
+# Low Stock Alerts
+# Dashboard ile aynı tanım: current_stock <= min_stock_level
+BELOW_MIN_STAGE = {"$set": {"below_min": {"$lte": [
+    {"$ifNull": ["$current_stock", 0]}, {"$ifNull": ["$min_stock_level", 0]}
+]}}}
+
+async def publish_stock_alert(material: dict):
+    """Min seviye eşiği geçildiğinde uyarı yaz (SSE akışı stock_alerts'ten okur)"""
+    await db.stock_alerts.insert_one({
+        "type": 'low_stock' if material['below_min'] else 'restocked',
+        "material_id": material['id'],
+        "name": material.get('name'),
+        "current_stock": material.get('current_stock', 0),
+        "min_stock_level": material.get('min_stock_level', 0),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    })
+    metrics.incr('stock_alerts')
+
+async def backfill_below_min():
+    """below_min alanı olmayan eski hammaddeleri işaretle (tek seferlik)"""
+    if await db.migrations.find_one({"_id": "below_min"}):
+        return
+    result = await db.raw_materials.update_many({}, [BELOW_MIN_STAGE])
+    await db.migrations.update_one(
+        {"_id": "below_min"},
+        {"$set": {"updated": result.modified_count, "finished_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+
+# Inventory Event Log
+INVENTORY_TOLERANCE = float(os.environ.get('INVENTORY_TOLERANCE', '1e-6'))
+
+class InventoryEvent(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str  # raw_material | product | finished_good
+    item_id: str  # Hammadde/ürün id'si veya SKU
+    name: Optional[str] = None
+    delta: float
+    delta_sqm: Optional[float] = None
+    balance_after: Optional[float] = None
+    reason: str
+    source_collection: Optional[str] = None
+    source_id: Optional[str] = None
+    occurred_at: Optional[str] = None
+    created_by: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+def inventory_event_doc(kind: str, item_id: str, delta: float, reason: str,
+                        source: Optional[tuple] = None, occurred_at=None,
+                        user: Optional[str] = None, **extra) -> dict:
+    if isinstance(occurred_at, datetime):
+        occurred_at = occurred_at.isoformat()
+    event = InventoryEvent(
+        kind=kind, item_id=item_id, delta=delta, reason=reason,
+        source_collection=source[0] if source else None,
+        source_id=source[1] if source else None,
+        occurred_at=occurred_at, created_by=user, **extra
+    )
+    doc = event.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    return doc
+
+async def append_inventory_event(kind: str, item_id: str, delta: float, reason: str,
+                                 source: Optional[tuple] = None, occurred_at=None,
+                                 user: Optional[str] = None, **extra):
+    """Değiştirilemez stok hareketi ekle (yalnızca insert, güncelleme yok)"""
+    doc = inventory_event_doc(kind, item_id, delta, reason, source, occurred_at, user, **extra)
+    await db.inventory_events.insert_one(doc)
+    metrics.incr('inventory_events')
+    return doc
+
+async def adjust_material_stock(match: dict, delta: float, reason: str, source: Optional[tuple] = None,
+                                occurred_at=None, user: Optional[str] = None,
+                                collection: str = 'raw_materials') -> Optional[dict]:
+    """current_stock'u değiştir ve hareketi olay kaydına yaz
+    
+    Replica set'te ikisi tek transaction'dır. Tek sunucuda olay önce pending olarak yazılır, stok
+    güncellenince pending kaldırılır; arada çökülürse kalan pending olay belirsiz hareketi gösterir
+    (rebuild_inventory bunları katlamaz, ayrıca raporlar).
+    """
+    if not delta:
+        return None
+    if collection == 'raw_materials':
+        # below_min aynı güncellemede yeniden hesaplanır
+        update = [{"$set": {"current_stock": {"$add": [{"$ifNull": ["$current_stock", 0]}, delta]}}}, BELOW_MIN_STAGE]
+    else:
+        update = {"$inc": {"current_stock": delta}}
+    kind = 'raw_material' if collection == 'raw_materials' else 'product'
+    projection = {"_id": 0, "id": 1, "name": 1, "current_stock": 1, "min_stock_level": 1, "below_min": 1}
+    
+    if transactions_supported():
+        async def operations(session):
+            item = await db[collection].find_one_and_update(
+                match, update, projection=projection, return_document=ReturnDocument.AFTER, session=session
+            )
+            if item:
+                await db.inventory_events.insert_one(inventory_event_doc(
+                    kind, item['id'], delta, reason, source, occurred_at, user,
+                    name=item.get('name'), balance_after=item.get('current_stock')
+                ), session=session)
+            return item
+        item = await run_in_transaction(operations)
+    else:
+        target = await db[collection].find_one(match, {"_id": 0, "id": 1, "name": 1})
+        if not target:
+            return None
+        event = inventory_event_doc(kind, target['id'], delta, reason, source, occurred_at, user, name=target.get('name'))
+        event['pending'] = True
+        await db.inventory_events.insert_one(event)
+        item = await db[collection].find_one_and_update(
+            {**match, "id": target['id']}, update, projection=projection, return_document=ReturnDocument.AFTER
+        )
+        if item:
+            await db.inventory_events.update_one(
+                {"id": event['id']}, {"$set": {"balance_after": item.get('current_stock')}, "$unset": {"pending": ""}}
+            )
+        else:
+            # Koşul artık sağlanmıyor (ör. stok yetersiz): hareket olmadı
+            await db.inventory_events.delete_one({"id": event['id']})
+    if not item:
+        return None
+    metrics.incr('inventory_events')
+    if 'below_min' in item and item['below_min'] != (item['current_stock'] - delta <= item.get('min_stock_level', 0)):
+        await publish_stock_alert(item)
+    return item
+
+def finished_goods_events(before: Optional[dict], after: Optional[dict], reason: str,
+                          source: Optional[tuple] = None, user: Optional[str] = None,
+                          sign: int = 1, date_field: str = 'production_date') -> List[dict]:
+    """Kayıt öncesi/sonrası farkından SKU bazında mamul stok hareketleri"""
+    deltas = {}
+    for doc, factor in ((before, -sign), (after, sign)):
+        if doc:
+            entry = deltas.setdefault(sku_of(doc), [0, 0.0])
+            entry[0] += factor * doc.get('quantity', 0)
+            entry[1] += factor * doc.get('square_meters', 0)
+    occurred_at = (after or before or {}).get(date_field)
+    return [
+        inventory_event_doc('finished_good', sku, quantity, reason, source, occurred_at, user, delta_sqm=round(square_meters, 6))
+        for sku, (quantity, square_meters) in deltas.items()
+        if quantity or abs(square_meters) > INVENTORY_TOLERANCE
+    ]
+
+async def record_finished_goods_change(before: Optional[dict], after: Optional[dict], reason: str,
+                                       source: Optional[tuple] = None, user: Optional[str] = None,
+                                       sign: int = 1, date_field: str = 'production_date'):
+    """Kayıt öncesi/sonrası farkını SKU bazında mamul stok hareketi olarak yaz"""
+    events = finished_goods_events(before, after, reason, source, user, sign, date_field)
+    if events:
+        await db.inventory_events.insert_many(events)
+        metrics.incr('inventory_events', len(events))
+
+INVENTORY_SEED_LEASE_S = int(os.environ.get('INVENTORY_SEED_LEASE_S', '600'))
+
+async def seed_inventory_events():
+    """Mevcut stokları açılış bakiyesi olarak olay kaydına yaz (tek seferlik)
+    
+    Birden çok worker aynı anda başladığında migrations kaydını yalnızca biri alır; yarıda kalan
+    bir deneme INVENTORY_SEED_LEASE_S sonra devralınır. Olay id'leri kalem başına sabit olduğundan
+    devralan worker daha önce yazılmış açılış bakiyelerini tekrar eklemez.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.migrations.insert_one({"_id": "inventory_events", "status": "seeding", "started_at": now})
+    except DuplicateKeyError:
+        stale = (datetime.now(timezone.utc) - timedelta(seconds=INVENTORY_SEED_LEASE_S)).isoformat()
+        taken = await db.migrations.update_one(
+            {"_id": "inventory_events", "status": "seeding", "started_at": {"$lt": stale}},
+            {"$set": {"started_at": now}}
+        )
+        if not taken.modified_count:
+            return
+    
+    def opening(kind, item_id, delta, name=None, delta_sqm=None):
+        return InventoryEvent(
+            id=f"opening:{kind}:{item_id}",
+            kind=kind, item_id=item_id, name=name, delta=delta, delta_sqm=delta_sqm,
+            balance_after=delta, reason='opening_balance', occurred_at=now
+        ).model_dump() | {"created_at": now}
+    
+    events = []
+    for collection, kind in (('raw_materials', 'raw_material'), ('products', 'product')):
+        async for item in db[collection].find({}, {"_id": 0, "id": 1, "name": 1, "current_stock": 1}):
+            if item.get('current_stock'):
+                events.append(opening(kind, item['id'], item['current_stock'], item.get('name')))
+    
+    stock_dict = accumulate_stock(
+        {},
+        await history_find(db, 'manufacturing_records'),
+        await history_find(db, 'shipments')
+    )
+    for sku, item in stock_dict.items():
+        if item['total_quantity'] or item['total_square_meters']:
+            events.append(opening('finished_good', sku, item['total_quantity'],
+                                  delta_sqm=round(item['total_square_meters'], 6)))
+    
+    for i in range(0, len(events), 1000):
+        await db.inventory_events.bulk_write(
+            [UpdateOne({"id": e['id']}, {"$setOnInsert": e}, upsert=True) for e in events[i:i + 1000]],
+            ordered=False
+        )
+    await db.migrations.update_one(
+        {"_id": "inventory_events"},
+        {"$set": {"status": "done", "seeded": len(events), "finished_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    logger.info(f"Inventory event log seeded with {len(events)} opening balances")
+
+async def rebuild_inventory(apply: bool = False) -> dict:
+    """Olayları tek geçişte katla, saklanan bakiyelerle karşılaştır; apply ise ürün bakiyelerini düzelt
+    
+    Hammadde stoğunun tek düzelticisi kaynak kayıtlardan çalışan mutabakattır (reconcile_material_stock);
+    burada hammadde farkları yalnızca raporlanır, iki mekanizma aynı bakiyeyi farklı yönlere çekmesin.
+    """
+    started = time.perf_counter()
+    folded = {}
+    events = 0
+    # Tamamlanmamış (pending) hareketler katlanmaz; ayrıca raporlanır
+    pipeline = [{"$match": {"pending": {"$ne": True}}}, {"$group": {
+        "_id": {"kind": "$kind", "item_id": "$item_id"},
+        "quantity": {"$sum": "$delta"},
+        "square_meters": {"$sum": {"$ifNull": ["$delta_sqm", 0]}},
+        "events": {"$sum": 1}
+    }}]
+    async for row in db.inventory_events.aggregate(pipeline, allowDiskUse=True):
+        folded[(row['_id']['kind'], row['_id']['item_id'])] = row
+        events += row['events']
+    
+    discrepancies = []
+    corrected = 0
+    for collection, kind in (('raw_materials', 'raw_material'), ('products', 'product')):
+        async for item in db[collection].find({}, {"_id": 0, "id": 1, "name": 1, "current_stock": 1}):
+            expected = folded.pop((kind, item['id']), {}).get('quantity', 0)
+            stored = item.get('current_stock') or 0
+            if abs(expected - stored) > INVENTORY_TOLERANCE:
+                discrepancies.append({
+                    "kind": kind, "item_id": item['id'], "name": item.get('name'),
+                    "stored": stored, "rebuilt": round(expected, 6), "difference": round(expected - stored, 6)
+                })
+                if apply and collection == 'products':
+                    await db.products.update_one({"id": item['id']}, {"$set": {"current_stock": expected}})
+                    corrected += 1
+    
+    # Mamul bakiyeleri kayıtlardan hesaplanır; olaylarla uyuşmayan SKU'lar raporlanır
+    stock_dict = accumulate_stock(
+        {},
+        await history_find(db, 'manufacturing_records'),
+        await history_find(db, 'shipments')
+    )
+    finished_goods = []
+    for sku in sorted(set(stock_dict) | {item_id for kind, item_id in folded if kind == 'finished_good'}):
+        row = folded.pop(('finished_good', sku), {})
+        rebuilt_qty, rebuilt_sqm = row.get('quantity', 0), row.get('square_meters', 0)
+        finished_goods.append({"sku": sku, "quantity": rebuilt_qty, "square_meters": round(rebuilt_sqm, 2)})
+        stored = stock_dict.get(sku, {'total_quantity': 0, 'total_square_meters': 0})
+        if abs(rebuilt_qty - stored['total_quantity']) > INVENTORY_TOLERANCE \
+                or abs(rebuilt_sqm - stored['total_square_meters']) > 0.01:
+            discrepancies.append({
+                "kind": 'finished_good', "item_id": sku, "name": None,
+                "stored": stored['total_quantity'], "rebuilt": rebuilt_qty,
+                "difference": rebuilt_qty - stored['total_quantity']
+            })
+    
+    # Silinmiş hammadde/ürünlere ait olaylar
+    for (kind, item_id), row in folded.items():
+        if abs(row['quantity']) > INVENTORY_TOLERANCE:
+            discrepancies.append({
+                "kind": kind, "item_id": item_id, "name": None,
+                "stored": None, "rebuilt": round(row['quantity'], 6), "difference": None
+            })
+    
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    metrics.observe('inventory_rebuild_ms', duration_ms)
+    return {
+        "events_folded": events,
+        "pending_events": await db.inventory_events.count_documents({"pending": True}),
+        "discrepancies": discrepancies,
+        "corrected": corrected,
+        "applied": apply,
+        "finished_goods": finished_goods,
+        "duration_ms": duration_ms
+    }
+
 # Auth Routes
 @api_router.post("/auth/register", response_model=User)
 async def register(user_data: UserCreate):
@@ -497,16 +1468,13 @@ async def create_user(user_data: UserCreate, admin_user = Depends(get_admin_user
     return user_obj
 
 @api_router.put("/users/{user_id}", response_model=User)
-async def update_user(user_id: str, user_data: UserUpdate, admin_user = Depends(get_admin_user)):
-    """Kullanıcı bilgilerini güncelle (Sadece Admin)"""
-    existing_user = await db.users.find_one({"id": user_id})
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
-    
+async def update_user(user_id: str, user_data: UserUpdate, response: Response, if_match: Optional[str] = Header(None),
+                      admin_user = Depends(get_admin_user)):
+    """Kullanıcı bilgilerini güncelle (Sadece Admin, If-Match ile eşzamanlı düzenleme korumalı)"""
     update_data = {}
     if user_data.username:
-        # Check if username already exists
-        duplicate = await db.users.find_one({"username": user_data.username, "id": {"$ne": user_id}})
+        # Asıl koruma unique index; index kurulamadıysa (eski çift kayıtlar) bu kontrol devrede kalır
+        duplicate = await db.users.find_one({"username": user_data.username, "id": {"$ne": user_id}}, {"_id": 1})
         if duplicate:
             raise HTTPException(status_code=400, detail="Kullanıcı adı zaten kullanılıyor")
         update_data['username'] = user_data.username
@@ -520,14 +1488,26 @@ async def update_user(user_id: str, user_data: UserUpdate, admin_user = Depends(
     if user_data.role:
         update_data['role'] = user_data.role
     
+    match = versioned_filter(user_id, parse_if_match(if_match))
+    try:
+        if update_data:
+            updated_user = await db.users.find_one_and_update(
+                match, versioned_update(update_data),
+                projection={"_id": 0, "password_hash": 0},
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            updated_user = await db.users.find_one(match, {"_id": 0, "password_hash": 0})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Kullanıcı adı zaten kullanılıyor")
+    if updated_user is None:
+        await raise_update_failure(db.users, user_id, "Kullanıcı bulunamadı")
     if update_data:
-        await db.users.update_one({"id": user_id}, {"$set": update_data})
         logger.info(f"Admin {admin_user['username']} updated user: {user_id}")
-    
-    updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
     if isinstance(updated_user.get('created_at'), str):
         updated_user['created_at'] = datetime.fromisoformat(updated_user['created_at'])
     
+    response.headers['ETag'] = etag(updated_user)
     return updated_user
 
 @api_router.delete("/users/{user_id}")
@@ -565,7 +1545,7 @@ async def update_profile(profile_data: ProfileUpdate, current_user = Depends(get
         update_data['password_hash'] = hash_password(profile_data.password)
     
     if update_data:
-        await db.users.update_one({"id": user_id}, {"$set": update_data})
+        await db.users.update_one({"id": user_id}, versioned_update(update_data))
         logger.info(f"User {current_user['username']} updated their profile")
     
     updated_user = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
@@ -585,25 +1565,64 @@ async def create_raw_material(material_data: RawMaterialCreate, current_user = D
         raise HTTPException(status_code=400, detail="Material code already exists")
     
     material_obj = RawMaterial(**material_data.model_dump())
-    doc = material_obj.model_dump()
+    material_obj.below_min = material_obj.current_stock <= material_obj.min_stock_level
+    doc = set_search_keys('raw_materials', material_obj.model_dump())
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.raw_materials.insert_one(doc)
+    await cache_bus.invalidate('material_catalog', 'material_prices')
     return material_obj
 
 @api_router.get("/raw-materials", response_model=List[RawMaterial])
-async def get_raw_materials(current_user = Depends(get_current_user)):
-    materials = await db.raw_materials.find({}, {"_id": 0}).to_list(1000)
+async def get_raw_materials(fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, RawMaterial)
+    materials = await db.raw_materials.find({}, field_projection(names)).to_list(1000)
+    if names:
+        return sparse_response(RawMaterial, names, materials)
     for mat in materials:
         if isinstance(mat['created_at'], str):
             mat['created_at'] = datetime.fromisoformat(mat['created_at'])
     return materials
 
+@api_router.get("/raw-materials/low-stock", response_model=List[RawMaterial])
+async def get_low_stock_materials(current_user = Depends(get_current_user)):
+    """Min stok seviyesinin altındaki hammaddeler (below_min kısmi index'i)"""
+    materials = await db.raw_materials.find({"below_min": True}, {"_id": 0}).to_list(1000)
+    for mat in materials:
+        if isinstance(mat['created_at'], str):
+            mat['created_at'] = datetime.fromisoformat(mat['created_at'])
+    return materials
+
+@api_router.get("/raw-materials/low-stock/events")
+async def stream_stock_alerts(current_user = Depends(get_current_user)):
+    """Min seviye uyarılarını Server-Sent Events olarak akıt (low_stock / restocked)"""
+    async def events():
+        latest = await db.stock_alerts.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        last_id = latest['_id'] if latest else None
+        idle = 0
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id else {}
+            alerts = await db.stock_alerts.find(query).sort("_id", 1).to_list(100)
+            for alert in alerts:
+                last_id = alert.pop('_id')
+                yield f"event: {alert['type']}\ndata: {json.dumps(alert)}\n\n"
+            idle = 0 if alerts else idle + 1
+            if idle * STOCK_ALERT_POLL_S >= 15:
+                # Proxy'ler boştaki bağlantıyı kapatmasın
+                idle = 0
+                yield ": keepalive\n\n"
+            await asyncio.sleep(STOCK_ALERT_POLL_S)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @api_router.get("/raw-materials/{material_id}", response_model=RawMaterial)
-async def get_raw_material(material_id: str, current_user = Depends(get_current_user)):
-    material = await db.raw_materials.find_one({"id": material_id}, {"_id": 0})
+async def get_raw_material(material_id: str, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, RawMaterial)
+    material = await db.raw_materials.find_one({"id": material_id}, field_projection(names))
     if not material:
         raise HTTPException(status_code=404, detail="Material not found")
+    if names:
+        return sparse_response(RawMaterial, names, material)
     if isinstance(material['created_at'], str):
         material['created_at'] = datetime.fromisoformat(material['created_at'])
     return RawMaterial(**material)
@@ -617,16 +1636,20 @@ async def update_raw_material(material_id: str, material_data: RawMaterialCreate
     if not existing:
         raise HTTPException(status_code=404, detail="Material not found")
     
-    # Güncelleme verisi
-    update_data = material_data.model_dump()
+    # Güncelleme verisi (min seviye değişirse below_min de güncellenir)
+    update_data = set_search_keys('raw_materials', material_data.model_dump())
+    update_data = {key: {"$literal": value} for key, value in update_data.items()}
     
     await db.raw_materials.update_one(
         {"id": material_id},
-        {"$set": update_data}
+        [{"$set": update_data}, BELOW_MIN_STAGE]
     )
+    await cache_bus.invalidate('material_catalog', 'material_prices')
     
     # Güncellenmiş kaydı döndür
     updated_material = await db.raw_materials.find_one({"id": material_id}, {"_id": 0})
+    if updated_material.get('below_min') != existing.get('below_min', updated_material.get('below_min')):
+        await publish_stock_alert(updated_material)
     
     if isinstance(updated_material['created_at'], str):
         updated_material['created_at'] = datetime.fromisoformat(updated_material['created_at'])
@@ -641,6 +1664,7 @@ async def delete_raw_material(material_id: str, current_user = Depends(get_curre
     result = await db.raw_materials.delete_one({"id": material_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Material not found")
+    await cache_bus.invalidate('material_catalog', 'material_prices')
     
     return {"message": "Material deleted successfully"}
 
@@ -664,22 +1688,20 @@ async def create_stock_transaction(transaction_data: StockTransactionCreate, cur
     await db.stock_transactions.insert_one(doc)
     
     # Update material stock
-    new_stock = material['current_stock']
-    if transaction_data.transaction_type == TransactionType.IN:
-        new_stock += transaction_data.quantity
-    else:
-        new_stock -= transaction_data.quantity
-    
-    await db.raw_materials.update_one(
-        {"id": transaction_data.material_id},
-        {"$set": {"current_stock": new_stock}}
+    delta = transaction_data.quantity if transaction_data.transaction_type == TransactionType.IN else -transaction_data.quantity
+    await adjust_material_stock(
+        {"id": transaction_data.material_id}, delta, 'stock_transaction',
+        source=('stock_transactions', doc['id']), occurred_at=doc['created_at'], user=current_user['username']
     )
     
     return transaction_obj
 
 @api_router.get("/stock-transactions", response_model=List[StockTransaction])
-async def get_stock_transactions(current_user = Depends(get_current_user)):
-    transactions = await db.stock_transactions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_stock_transactions(start: Optional[str] = None, end: Optional[str] = None, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, StockTransaction)
+    transactions = await history_find(db, 'stock_transactions', start=start, end=end, sort=[("created_at", -1)], limit=1000, projection=field_projection(names))
+    if names:
+        return sparse_response(StockTransaction, names, transactions)
     for trans in transactions:
         if isinstance(trans['created_at'], str):
             trans['created_at'] = datetime.fromisoformat(trans['created_at'])
@@ -703,8 +1725,11 @@ async def create_product(product_data: ProductCreate, current_user = Depends(get
     return product_obj
 
 @api_router.get("/products", response_model=List[Product])
-async def get_products(current_user = Depends(get_current_user)):
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
+async def get_products(fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, Product)
+    products = await db.products.find({}, field_projection(names)).to_list(1000)
+    if names:
+        return sparse_response(Product, names, products)
     for prod in products:
         if isinstance(prod['created_at'], str):
             prod['created_at'] = datetime.fromisoformat(prod['created_at'])
@@ -742,8 +1767,11 @@ async def create_production_order(order_data: ProductionOrderCreate, current_use
     return order_obj
 
 @api_router.get("/production-orders", response_model=List[ProductionOrder])
-async def get_production_orders(current_user = Depends(get_current_user)):
-    orders = await db.production_orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_production_orders(fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, ProductionOrder)
+    orders = await db.production_orders.find({}, field_projection(names)).sort("created_at", -1).to_list(1000)
+    if names:
+        return sparse_response(ProductionOrder, names, orders)
     for order in orders:
         if isinstance(order['created_at'], str):
             order['created_at'] = datetime.fromisoformat(order['created_at'])
@@ -766,9 +1794,9 @@ async def update_production_status(order_id: str, status: ProductionStatus, curr
     if status == ProductionStatus.COMPLETED:
         update_data['completed_date'] = datetime.now(timezone.utc).isoformat()
         # Update product stock
-        await db.products.update_one(
-            {"id": order['product_id']},
-            {"$inc": {"current_stock": order['quantity']}}
+        await adjust_material_stock(
+            {"id": order['product_id']}, order['quantity'], 'production_order',
+            source=('production_orders', order_id), user=current_user['username'], collection='products'
         )
     
     await db.production_orders.update_one({"id": order_id}, {"$set": update_data})
@@ -798,22 +1826,185 @@ async def create_consumption(consumption_data: ConsumptionCreate, current_user =
     await db.consumptions.insert_one(doc)
     
     # Update material stock
-    await db.raw_materials.update_one(
-        {"id": consumption_data.material_id},
-        {"$inc": {"current_stock": -consumption_data.quantity}}
+    await adjust_material_stock(
+        {"id": consumption_data.material_id}, -consumption_data.quantity, 'consumption',
+        source=('consumptions', doc['id']), occurred_at=doc['created_at'], user=current_user['username']
     )
     
     return consumption_obj
 
 @api_router.get("/consumptions", response_model=List[Consumption])
-async def get_consumptions(current_user = Depends(get_current_user)):
-    consumptions = await db.consumptions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+async def get_consumptions(start: Optional[str] = None, end: Optional[str] = None, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, Consumption)
+    consumptions = await history_find(db, 'consumptions', start=start, end=end, sort=[("created_at", -1)], limit=1000, projection=field_projection(names))
+    if names:
+        return sparse_response(Consumption, names, consumptions)
     for cons in consumptions:
         if isinstance(cons['created_at'], str):
             cons['created_at'] = datetime.fromisoformat(cons['created_at'])
     return consumptions
 
 
+# Time-Series Stores (Günlük tüketim / gaz okumaları)
+# Migration durumları: legacy (eski koleksiyon), dual_write (ikisine de yaz, eskiden oku),
+# verifying (ikisine de yaz, time-series'ten oku; geri dönüş kayıpsız), timeseries (onaylandı, sadece time-series)
+TIMESERIES_READ_ROUTES = ('verifying', 'timeseries')
+timeseries_routes_cache = cache_bus.register('timeseries_routes')
+
+def to_timeseries_doc(doc: dict) -> dict:
+    """Time-series koleksiyon için belge: timeField BSON tarih olmalı"""
+    ts_doc = {k: v for k, v in doc.items() if k != '_id'}
+    value = ts_doc['date']
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    ts_doc['date'] = value.astimezone(timezone.utc)
+    return ts_doc
+
+class TimeSeriesStore:
+    """Makine başına günlük okuma koleksiyonu; migration durumuna göre eski veya time-series koleksiyona yönlenir"""
+
+    def __init__(self, name: str, meta_field: Optional[str]):
+        self.name = name
+        self.meta_field = meta_field
+        self.target = f"{name}_ts"
+
+    async def route(self) -> str:
+        async def load():
+            migration = await db.migrations.find_one({"_id": f"timeseries:{self.name}"})
+            return migration['route'] if migration else 'legacy'
+        return await timeseries_routes_cache.get_or_load(self.name, load)
+
+    async def reader(self, database=None):
+        """Okuma koleksiyonu ve tarih alanının BSON tarih olup olmadığı"""
+        database = database if database is not None else db
+        if await self.route() in TIMESERIES_READ_ROUTES:
+            return database[self.target], True
+        return database[self.name], False
+
+    async def find_one(self, query: dict) -> Optional[dict]:
+        collection, _ = await self.reader()
+        return await collection.find_one(query, {"_id": 0})
+
+    async def insert(self, doc: dict):
+        route = await self.route()
+        if route != 'timeseries':
+            await db[self.name].insert_one(dict(doc))
+        if route != 'legacy':
+            await db[self.target].insert_one(to_timeseries_doc(doc))
+
+    async def replace(self, record_id: str, doc: dict):
+        route = await self.route()
+        if route != 'timeseries':
+            await db[self.name].update_one({"id": record_id}, {"$set": doc})
+        if route != 'legacy':
+            # Time-series koleksiyonlarda güncelleme kısıtlı; sil + ekle (varsa tüm kopyalar)
+            await db[self.target].delete_many({"id": record_id})
+            await db[self.target].insert_one(to_timeseries_doc(doc))
+
+    async def delete(self, record_id: str) -> bool:
+        route = await self.route()
+        deleted = False
+        if route != 'timeseries':
+            deleted = (await db[self.name].delete_one({"id": record_id})).deleted_count > 0
+        if route != 'legacy':
+            ts_deleted = (await db[self.target].delete_one({"id": record_id})).deleted_count > 0
+            deleted = deleted or ts_deleted
+        return deleted
+
+    async def _set_route(self, route: str, **fields):
+        await db.migrations.update_one(
+            {"_id": f"timeseries:{self.name}"},
+            {"$set": {"route": route, "updated_at": datetime.now(timezone.utc).isoformat(), **fields}},
+            upsert=True
+        )
+        await cache_bus.invalidate('timeseries_routes')
+
+    async def migrate(self):
+        """Eski koleksiyonu çevrimiçi olarak time-series koleksiyona taşı"""
+        build_info = await db.command('buildInfo')
+        if build_info.get('versionArray', [0])[:2] < [7, 0]:
+            raise RuntimeError("Time-series migration requires MongoDB 7.0+ (arbitrary deletes on time-series collections)")
+        
+        if self.target not in await db.list_collection_names():
+            timeseries = {"timeField": "date", "granularity": "hours"}
+            if self.meta_field:
+                timeseries['metaField'] = self.meta_field
+            await db.create_collection(self.target, timeseries=timeseries)
+        await db[self.target].create_index("id")
+        
+        # Önce çift yazmaya geç; diğer worker'ların yeni durumu görmesini bekle
+        await self._set_route('dual_write', started_at=datetime.now(timezone.utc).isoformat(), copied=0, error=None)
+        await asyncio.sleep(CACHE_POLL_INTERVAL_S * 2)
+        
+        copied = 0
+        batch = []
+        
+        async def flush():
+            nonlocal copied
+            ids = [d['id'] for d in batch]
+            existing = set(await db[self.target].distinct('id', {"id": {"$in": ids}}))
+            docs = [to_timeseries_doc(d) for d in batch if d['id'] not in existing]
+            if docs:
+                await db[self.target].insert_many(docs, ordered=False)
+            copied += len(docs)
+            batch.clear()
+            await db.migrations.update_one({"_id": f"timeseries:{self.name}"}, {"$set": {"copied": copied}})
+        
+        async for doc in db[self.name].find({"id": {"$exists": True}, "date": {"$exists": True}}, {"_id": 0}):
+            batch.append(doc)
+            if len(batch) >= 1000:
+                await flush()
+        if batch:
+            await flush()
+        
+        # Kopyalama ile çift yazmanın çakıştığı nadir durumlarda oluşan kopyaları temizle.
+        # Time-series koleksiyonda unique index olmadığından hangi kopyanın güncel olduğu bilinemez
+        # (geç kalan kopya en yeni _id'yi alabilir); çift yazmada her zaman güncel olan eski
+        # koleksiyondaki belge yeniden eklenir, ardından diğer tüm kopyalar silinir.
+        duplicates = db[self.target].aggregate([
+            {"$group": {"_id": "$id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ])
+        async for dup in duplicates:
+            current = await db[self.name].find_one({"id": dup['_id']}, {"_id": 0})
+            keep = None
+            if current is not None:
+                keep = (await db[self.target].insert_one(to_timeseries_doc(current))).inserted_id
+            await db[self.target].delete_many({"id": dup['_id'], "_id": {"$ne": keep}})
+        
+        # Eski koleksiyon yazılmaya devam eder; admin onaylayana kadar geri dönüş veri kaybetmez
+        await self._set_route('verifying', finished_at=datetime.now(timezone.utc).isoformat(), copied=copied)
+    
+    async def confirm(self):
+        """Time-series okumaları doğrulandı: çift yazmayı bitir (bundan sonra geri dönüş kayıplı olur)"""
+        await self._set_route('timeseries', confirmed_at=datetime.now(timezone.utc).isoformat())
+    
+    async def rollback(self):
+        """Eski koleksiyona geri dön; çift yazma sürdüğü için eski koleksiyon eksiksizdir"""
+        await self._set_route('legacy', rolled_back_at=datetime.now(timezone.utc).isoformat())
+        # Diğer worker'lar çift yazmayı bırakınca hedefi sil; yeniden migration temiz başlasın
+        await asyncio.sleep(CACHE_POLL_INTERVAL_S * 2)
+        await db[self.target].drop()
+
+daily_consumption_store = TimeSeriesStore('daily_consumptions', 'machine')
+# Gaz kaydı makine bazında tutulmaz (DailyGasConsumption'da meta alanı yok); tek seri, metaField'sız
+gas_consumption_store = TimeSeriesStore('daily_gas_consumption', None)
+TIMESERIES_STORES = {store.name: store for store in (daily_consumption_store, gas_consumption_store)}
+
+async def run_timeseries_migration(store: TimeSeriesStore):
+    try:
+        await store.migrate()
+        logger.info(f"Time-series migration finished for {store.name}")
+    except Exception as e:
+        logger.exception(f"Time-series migration failed for {store.name}")
+        await db.migrations.update_one(
+            {"_id": f"timeseries:{store.name}"},
+            {"$set": {"error": str(e)}},
+            upsert=True
+        )
+
 # Daily Consumption Routes
 @api_router.post("/daily-consumptions", response_model=DailyConsumption)
 async def create_daily_consumption(consumption_data: DailyConsumptionCreate, current_user = Depends(get_current_user)):
@@ -832,32 +2023,28 @@ async def create_daily_consumption(consumption_data: DailyConsumptionCreate, cur
     doc = consumption_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['date'] = doc['date'].isoformat()
-    await db.daily_consumptions.insert_one(doc)
+    await daily_consumption_store.insert(doc)
+    await invalidate_stock_snapshots(doc['date'])
     
     # Update material stocks
-    # Petkim + Fire için toplam stok düşürülmesi
-    await db.raw_materials.update_one(
-        {"name": "Petkim"},
-        {"$inc": {"current_stock": -total_petkim}}
-    )
-    
-    # Estol stoğunu düşür
-    await db.raw_materials.update_one(
-        {"name": "Estol"},
-        {"$inc": {"current_stock": -consumption_data.estol_quantity}}
-    )
-    
-    # Talk stoğunu düşür
-    await db.raw_materials.update_one(
-        {"name": "Talk"},
-        {"$inc": {"current_stock": -consumption_data.talk_quantity}}
-    )
+    # Petkim + Fire için toplam, Estol ve Talk için ayrı stok düşürülmesi
+    for name, quantity in (("Petkim", total_petkim), ("Estol", consumption_data.estol_quantity), ("Talk", consumption_data.talk_quantity)):
+        await adjust_material_stock(
+            {"name": name}, -quantity, 'daily_consumption',
+            source=('daily_consumptions', doc['id']), occurred_at=doc['date'], user=current_user['username']
+        )
     
     return consumption_obj
 
 @api_router.get("/daily-consumptions", response_model=List[DailyConsumption])
-async def get_daily_consumptions(current_user = Depends(get_current_user)):
-    consumptions = await db.daily_consumptions.find({}, {"_id": 0}).sort("date", -1).to_list(1000)
+async def get_daily_consumptions(start: Optional[str] = None, end: Optional[str] = None, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, DailyConsumption)
+    collection, is_ts = await daily_consumption_store.reader()
+    consumptions = await collection.find(
+        date_range_filter('date', start, end, as_datetime=is_ts), field_projection(names)
+    ).sort("date", -1).to_list(1000)
+    if names:
+        return sparse_response(DailyConsumption, names, consumptions)
     for cons in consumptions:
         if isinstance(cons['created_at'], str):
             cons['created_at'] = datetime.fromisoformat(cons['created_at'])
@@ -865,45 +2052,54 @@ async def get_daily_consumptions(current_user = Depends(get_current_user)):
             cons['date'] = datetime.fromisoformat(cons['date'])
     return consumptions
 
+@api_router.get("/daily-consumptions/rolling")
+async def get_daily_consumption_rolling(window: int = 7, start: Optional[str] = None, end: Optional[str] = None, current_user = Depends(get_current_user)):
+    """Makine bazında kayan pencere (son N gün) tüketim toplam ve ortalamaları"""
+    if not 1 <= window <= 366:
+        raise HTTPException(status_code=400, detail="window must be between 1 and 366 days")
+    
+    collection, is_ts = await daily_consumption_store.reader(analytics_db)
+    # Time-series koleksiyonda gerçek gün aralığı; eski koleksiyonda (string tarih) makine başına günde bir kayıt varsayımı
+    window_spec = {"range": [-(window - 1), 0], "unit": "day"} if is_ts else {"documents": [-(window - 1), 0]}
+    output = {}
+    for field in ('total_petkim', 'estol_quantity', 'talk_quantity'):
+        output[f"rolling_sum_{field}"] = {"$sum": f"${field}", "window": window_spec}
+        output[f"rolling_avg_{field}"] = {"$avg": f"${field}", "window": window_spec}
+    
+    pipeline = [
+        {"$match": date_range_filter('date', start, end, as_datetime=is_ts)},
+        {"$setWindowFields": {"partitionBy": "$machine", "sortBy": {"date": 1}, "output": output}},
+        {"$project": {"_id": 0, "id": 1, "date": 1, "machine": 1, "total_petkim": 1, "estol_quantity": 1, "talk_quantity": 1, **{k: 1 for k in output}}},
+        {"$sort": {"date": -1}}
+    ]
+    rows = await collection.aggregate(pipeline).to_list(None)
+    for row in rows:
+        if isinstance(row.get('date'), datetime):
+            row['date'] = row['date'].isoformat()
+    return rows
+
 @api_router.put("/daily-consumptions/{consumption_id}", response_model=DailyConsumption)
 async def update_daily_consumption(consumption_id: str, consumption_data: DailyConsumptionCreate, current_user = Depends(get_current_user)):
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    existing = await db.daily_consumptions.find_one({"id": consumption_id})
+    existing = await daily_consumption_store.find_one({"id": consumption_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Consumption not found")
     
-    # Eski değerleri geri ekle (stok düzeltmesi için)
-    await db.raw_materials.update_one(
-        {"name": "Petkim"},
-        {"$inc": {"current_stock": existing['total_petkim']}}
-    )
-    await db.raw_materials.update_one(
-        {"name": "Estol"},
-        {"$inc": {"current_stock": existing['estol_quantity']}}
-    )
-    await db.raw_materials.update_one(
-        {"name": "Talk"},
-        {"$inc": {"current_stock": existing['talk_quantity']}}
-    )
-    
     # Calculate new total_petkim
     new_total_petkim = consumption_data.petkim_quantity + consumption_data.fire_quantity
     
-    # Yeni değerleri düş
-    await db.raw_materials.update_one(
-        {"name": "Petkim"},
-        {"$inc": {"current_stock": -new_total_petkim}}
-    )
-    await db.raw_materials.update_one(
-        {"name": "Estol"},
-        {"$inc": {"current_stock": -consumption_data.estol_quantity}}
-    )
-    await db.raw_materials.update_one(
-        {"name": "Talk"},
-        {"$inc": {"current_stock": -consumption_data.talk_quantity}}
-    )
+    # Eski değerleri geri ekle, yenilerini düş (net fark tek hareket olarak yazılır)
+    for name, old, new in (
+        ("Petkim", existing['total_petkim'], new_total_petkim),
+        ("Estol", existing['estol_quantity'], consumption_data.estol_quantity),
+        ("Talk", existing['talk_quantity'], consumption_data.talk_quantity)
+    ):
+        await adjust_material_stock(
+            {"name": name}, old - new, 'daily_consumption_update',
+            source=('daily_consumptions', consumption_id), occurred_at=consumption_data.date, user=current_user['username']
+        )
     
     updated_consumption = DailyConsumption(
         id=consumption_id,
@@ -917,10 +2113,8 @@ async def update_daily_consumption(consumption_id: str, consumption_data: DailyC
     doc['created_at'] = doc['created_at'].isoformat()
     doc['date'] = doc['date'].isoformat()
     
-    await db.daily_consumptions.update_one(
-        {"id": consumption_id},
-        {"$set": doc}
-    )
+    await daily_consumption_store.replace(consumption_id, doc)
+    await invalidate_stock_snapshots(min(str(existing['date']), doc['date']))
     
     return updated_consumption
 
@@ -929,27 +2123,20 @@ async def delete_daily_consumption(consumption_id: str, current_user = Depends(g
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    existing = await db.daily_consumptions.find_one({"id": consumption_id})
+    existing = await daily_consumption_store.find_one({"id": consumption_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Consumption not found")
     
     # Stokları geri ekle
-    await db.raw_materials.update_one(
-        {"name": "Petkim"},
-        {"$inc": {"current_stock": existing['total_petkim']}}
-    )
-    await db.raw_materials.update_one(
-        {"name": "Estol"},
-        {"$inc": {"current_stock": existing['estol_quantity']}}
-    )
-    await db.raw_materials.update_one(
-        {"name": "Talk"},
-        {"$inc": {"current_stock": existing['talk_quantity']}}
-    )
+    for name, quantity in (("Petkim", existing['total_petkim']), ("Estol", existing['estol_quantity']), ("Talk", existing['talk_quantity'])):
+        await adjust_material_stock(
+            {"name": name}, quantity, 'daily_consumption_delete',
+            source=('daily_consumptions', consumption_id), occurred_at=existing['date'], user=current_user['username']
+        )
     
-    result = await db.daily_consumptions.delete_one({"id": consumption_id})
-    if result.deleted_count == 0:
+    if not await daily_consumption_store.delete(consumption_id):
         raise HTTPException(status_code=404, detail="Consumption not found")
+    await invalidate_stock_snapshots(existing['date'])
     
     return {"message": "Consumption deleted successfully"}
 
@@ -969,19 +2156,24 @@ async def create_gas_consumption(gas_data: DailyGasConsumptionCreate, current_us
     doc = gas_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['date'] = doc['date'].isoformat()
-    await db.daily_gas_consumption.insert_one(doc)
+    await gas_consumption_store.insert(doc)
+    await invalidate_stock_snapshots(doc['date'])
     
     # Gaz stoğunu düşür
-    await db.raw_materials.update_one(
-        {"name": "Gaz"},
-        {"$inc": {"current_stock": -gas_data.total_gas_kg}}
+    await adjust_material_stock(
+        {"name": "Gaz"}, -gas_data.total_gas_kg, 'gas_consumption',
+        source=('daily_gas_consumption', doc['id']), occurred_at=doc['date'], user=current_user['username']
     )
     
     return gas_obj
 
 @api_router.get("/gas-consumption", response_model=List[DailyGasConsumption])
-async def get_gas_consumption(current_user = Depends(get_current_user)):
-    records = await db.daily_gas_consumption.find({}, {"_id": 0}).sort("date", -1).to_list(1000)
+async def get_gas_consumption(start: Optional[str] = None, end: Optional[str] = None, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, DailyGasConsumption)
+    collection, is_ts = await gas_consumption_store.reader()
+    records = await collection.find(
+        date_range_filter('date', start, end, as_datetime=is_ts), field_projection(names, 'id', 'date', 'total_gas_kg')
+    ).sort("date", -1).to_list(1000)
     
     valid_records = []
     for rec in records:
@@ -997,6 +2189,8 @@ async def get_gas_consumption(current_user = Depends(get_current_user)):
         if 'id' in rec and 'date' in rec and 'total_gas_kg' in rec:
             valid_records.append(rec)
     
+    if names:
+        return sparse_response(DailyGasConsumption, names, valid_records)
     return valid_records
 
 @api_router.put("/gas-consumption/{gas_id}", response_model=DailyGasConsumption)
@@ -1004,20 +2198,14 @@ async def update_gas_consumption(gas_id: str, gas_data: DailyGasConsumptionCreat
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    existing = await db.daily_gas_consumption.find_one({"id": gas_id})
+    existing = await gas_consumption_store.find_one({"id": gas_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Gas consumption not found")
     
-    # Eski değeri geri ekle
-    await db.raw_materials.update_one(
-        {"name": "Gaz"},
-        {"$inc": {"current_stock": existing['total_gas_kg']}}
-    )
-    
-    # Yeni değeri düş
-    await db.raw_materials.update_one(
-        {"name": "Gaz"},
-        {"$inc": {"current_stock": -gas_data.total_gas_kg}}
+    # Eski değeri geri ekle, yenisini düş
+    await adjust_material_stock(
+        {"name": "Gaz"}, existing['total_gas_kg'] - gas_data.total_gas_kg, 'gas_consumption_update',
+        source=('daily_gas_consumption', gas_id), occurred_at=gas_data.date, user=current_user['username']
     )
     
     updated_gas = DailyGasConsumption(
@@ -1031,10 +2219,8 @@ async def update_gas_consumption(gas_id: str, gas_data: DailyGasConsumptionCreat
     doc['created_at'] = doc['created_at'].isoformat()
     doc['date'] = doc['date'].isoformat()
     
-    await db.daily_gas_consumption.update_one(
-        {"id": gas_id},
-        {"$set": doc}
-    )
+    await gas_consumption_store.replace(gas_id, doc)
+    await invalidate_stock_snapshots(min(str(existing['date']), doc['date']))
     
     return updated_gas
 
@@ -1043,19 +2229,19 @@ async def delete_gas_consumption(gas_id: str, current_user = Depends(get_current
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    existing = await db.daily_gas_consumption.find_one({"id": gas_id})
+    existing = await gas_consumption_store.find_one({"id": gas_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Gas consumption not found")
     
     # Stoğu geri ekle
-    await db.raw_materials.update_one(
-        {"name": "Gaz"},
-        {"$inc": {"current_stock": existing['total_gas_kg']}}
+    await adjust_material_stock(
+        {"name": "Gaz"}, existing['total_gas_kg'], 'gas_consumption_delete',
+        source=('daily_gas_consumption', gas_id), occurred_at=existing['date'], user=current_user['username']
     )
     
-    result = await db.daily_gas_consumption.delete_one({"id": gas_id})
-    if result.deleted_count == 0:
+    if not await gas_consumption_store.delete(gas_id):
         raise HTTPException(status_code=404, detail="Gas consumption not found")
+    await invalidate_stock_snapshots(existing['date'])
     
     return {"message": "Gas consumption deleted successfully"}
 
@@ -1067,7 +2253,7 @@ async def create_material_entry(entry_data: MaterialEntryCreate, current_user =
         raise HTTPException(status_code=403, detail="Permission denied")
     
     # Hammadde bilgisini al
-    material = await db.raw_materials.find_one({"id": entry_data.material_id})
+    material = await find_catalog_material(entry_data.material_id)
     if not material:
         raise HTTPException(status_code=404, detail="Material not found")
     
@@ -1080,38 +2266,47 @@ async def create_material_entry(entry_data: MaterialEntryCreate, current_user =
     doc = entry_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['entry_date'] = doc['entry_date'].isoformat()
-    await db.material_entries.insert_one(doc)
+    await db.material_entries.insert_one(set_search_keys('material_entries', doc))
+    await invalidate_stock_snapshots(doc['entry_date'])
+    await cache_bus.invalidate('material_prices')
     
     # Stoğu artır
-    await db.raw_materials.update_one(
-        {"id": entry_data.material_id},
-        {"$inc": {"current_stock": entry_data.quantity}}
+    await adjust_material_stock(
+        {"id": entry_data.material_id}, entry_data.quantity, 'material_entry',
+        source=('material_entries', doc['id']), occurred_at=doc['entry_date'], user=current_user['username']
     )
     
     return entry_obj
 
 @api_router.get("/material-entries", response_model=List[MaterialEntry])
-async def get_material_entries(current_user = Depends(get_current_user)):
-    entries = await db.material_entries.find({}, {"_id": 0}).sort("entry_date", -1).to_list(1000)
+async def get_material_entries(fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, MaterialEntry)
+    entries = await db.material_entries.find(
+        {}, field_projection(names, 'id', 'material_id', 'material_name')
+    ).sort("entry_date", -1).to_list(1000)
     
     valid_entries = []
     for entry in entries:
-        if isinstance(entry['created_at'], str):
+        if isinstance(entry.get('created_at'), str):
             entry['created_at'] = datetime.fromisoformat(entry['created_at'])
-        if isinstance(entry['entry_date'], str):
+        if isinstance(entry.get('entry_date'), str):
             entry['entry_date'] = datetime.fromisoformat(entry['entry_date'])
         
         # Eğer material_id yoksa, material_name'den bul ve ekle
         if not entry.get('material_id') and entry.get('material_name'):
-            material = await db.raw_materials.find_one({"name": entry['material_name']})
+            material = await find_catalog_material(name=entry['material_name'])
             if material:
                 entry['material_id'] = material['id']
                 # Veritabanını da güncelle
                 await db.material_entries.update_one(
                     {"id": entry['id']},
-                    {"$set": {"material_id": material['id']}}
+                    versioned_update({"material_id": material['id']})
                 )
         
+        if names:
+            valid_entries.append(entry)
+            continue
+        
         # Sadece MaterialEntry model'ine uygun alanları al
         valid_entry = {
             'id': entry['id'],
@@ -1124,40 +2319,28 @@ async def get_material_entries(current_user = Depends(get_current_user)):
             'total_amount': entry['total_amount'],
             'supplier': entry.get('supplier'),
             'invoice_number': entry.get('invoice_number'),
+            'version': entry.get('version', 1),
             'created_by': entry['created_by'],
             'created_at': entry['created_at']
         }
         valid_entries.append(valid_entry)
     
+    if names:
+        return sparse_response(MaterialEntry, names, valid_entries)
     return valid_entries
 
 @api_router.put("/material-entries/{entry_id}", response_model=MaterialEntry)
-async def update_material_entry(entry_id: str, entry_data: MaterialEntryCreate, current_user = Depends(get_current_user)):
+async def update_material_entry(entry_id: str, entry_data: MaterialEntryCreate, response: Response,
+                                if_match: Optional[str] = Header(None), current_user = Depends(get_current_user)):
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    existing = await db.material_entries.find_one({"id": entry_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Material entry not found")
-    
-    # Eski miktarı geri al
-    await db.raw_materials.update_one(
-        {"id": existing['material_id']},
-        {"$inc": {"current_stock": -existing['quantity']}}
-    )
-    
-    # Yeni miktarı ekle
-    await db.raw_materials.update_one(
-        {"id": entry_data.material_id},
-        {"$inc": {"current_stock": entry_data.quantity}}
-    )
-    
     # Hammadde bilgisini al
-    material = await db.raw_materials.find_one({"id": entry_data.material_id})
+    material = await find_catalog_material(entry_data.material_id)
     
     # Güncelleme verisi
     update_data = {
-        "entry_date": entry_data.entry_date,
+        "entry_date": entry_data.entry_date.isoformat(),
         "material_id": entry_data.material_id,
         "material_name": material['name'] if material else "",
         "quantity": entry_data.quantity,
@@ -1168,13 +2351,38 @@ async def update_material_entry(entry_id: str, entry_data: MaterialEntryCreate,
         "invoice_number": entry_data.invoice_number
     }
     
-    await db.material_entries.update_one(
-        {"id": entry_id},
-        {"$set": update_data}
+    # Tek gidiş-dönüş: eski hali döner (stok farkı için), yeni hal yazılan alanlardan kurulur
+    existing = await db.material_entries.find_one_and_update(
+        versioned_filter(entry_id, parse_if_match(if_match)),
+        versioned_update(set_search_keys('material_entries', update_data)),
+        projection={"_id": 0, "search_keys": 0}
     )
+    if existing is None:
+        await raise_update_failure(db.material_entries, entry_id, "Material entry not found")
+    
+    # Eski miktarı geri al, yeni miktarı ekle (hammadde değişmediyse net fark)
+    source = ('material_entries', entry_id)
+    if existing['material_id'] == entry_data.material_id:
+        await adjust_material_stock(
+            {"id": entry_data.material_id}, entry_data.quantity - existing['quantity'], 'material_entry_update',
+            source=source, occurred_at=entry_data.entry_date, user=current_user['username']
+        )
+    else:
+        await adjust_material_stock(
+            {"id": existing['material_id']}, -existing['quantity'], 'material_entry_update',
+            source=source, occurred_at=entry_data.entry_date, user=current_user['username']
+        )
+        await adjust_material_stock(
+            {"id": entry_data.material_id}, entry_data.quantity, 'material_entry_update',
+            source=source, occurred_at=entry_data.entry_date, user=current_user['username']
+        )
+    
+    await invalidate_stock_snapshots(min(str(existing['entry_date']), entry_data.entry_date.isoformat()))
+    await cache_bus.invalidate('material_prices')
     
     # Güncellenmiş kaydı döndür
-    updated_entry = await db.material_entries.find_one({"id": entry_id}, {"_id": 0})
+    updated_entry = {**existing, **update_data, "version": existing.get('version', 1) + 1}
+    response.headers['ETag'] = etag(updated_entry)
     
     # Tarih dönüşümü
     if isinstance(updated_entry['entry_date'], str):
@@ -1194,7 +2402,7 @@ async def create_cut_production(cut_data: CutProductionCreate, current_user = De
     # Ana malzeme bilgisini al (üretim kaydından)
     source = await db.manufacturing_records.find_one({"id": cut_data.source_production_id})
     if not source:
-        raise HTTPException(status_code=404, detail="Source production record not found")
+        await raise_not_found('manufacturing_records', cut_data.source_production_id, "Source production record not found")
     
     source_thickness = source['thickness_mm']
     source_width = source['width_cm']
@@ -1215,6 +2423,7 @@ async def create_cut_production(cut_data: CutProductionCreate, current_user = De
     # 4. Kesilmiş ürün metrekaresi
     cut_length_m = cut_data.cut_length_cm / 100
     cut_square_meters = (cut_data.cut_width_cm / 100) * cut_length_m * total_cut_pieces
+    output_sku = make_sku(source_thickness, cut_data.cut_width_cm, cut_length_m, cut_data.color)
     
     cut_record = CutProductionRecord(
         **cut_data.model_dump(),
@@ -1225,6 +2434,8 @@ async def create_cut_production(cut_data: CutProductionCreate, current_user = De
         source_pieces_used=source_pieces_used,
         total_cut_pieces=total_cut_pieces,
         cut_square_meters=cut_square_meters,
+        sku=output_sku,
+        output_record_id=str(uuid.uuid4()),
         created_by=current_user['username']
     )
     
@@ -1232,17 +2443,22 @@ async def create_cut_production(cut_data: CutProductionCreate, current_user = De
     doc['created_at'] = doc['created_at'].isoformat()
     doc['date'] = doc['date'].isoformat()
     await db.cut_production_records.insert_one(doc)
+    await invalidate_stock_snapshots(doc['date'])
     
     # STOK GÜNCELLEMESİ: Ana malzemeyi manufacturing_records'dan düşür
     # Kullanılan ana malzeme adedi kadar quantity'yi azalt
     await db.manufacturing_records.update_one(
         {"id": cut_data.source_production_id},
-        {"$inc": {"quantity": -source_pieces_used}}
+        [{"$set": {"quantity": {"$add": ["$quantity", -source_pieces_used]}, **VERSION_BUMP}}]
+    )
+    await append_inventory_event(
+        'finished_good', sku_of(source), -source_pieces_used, 'cut_production',
+        ('cut_production_records', cut_record.id), doc['date'], current_user['username'], delta_sqm=0
     )
     
     # Kesilmiş ürünü yeni bir üretim kaydı olarak ekle
     cut_manufacturing_record = {
-        "id": str(uuid.uuid4()),
+        "id": cut_record.output_record_id,
         "production_date": cut_record.date.isoformat(),
         "machine": "Kesim",
         "thickness_mm": source_thickness,
@@ -1256,16 +2472,24 @@ async def create_cut_production(cut_data: CutProductionCreate, current_user = De
         "color_name": cut_data.color if cut_data.color else None,
         "model": f"{source_thickness}mm x {cut_data.cut_width_cm}cm x {int(cut_length_m*100)}cm (Kesik)",
         "gas_consumption_kg": 0,
+        "sku": output_sku,
         "created_by": current_user['username'],
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.manufacturing_records.insert_one(cut_manufacturing_record)
+    await db.manufacturing_records.insert_one(set_search_keys('manufacturing_records', cut_manufacturing_record))
+    await record_finished_goods_change(
+        None, cut_manufacturing_record, 'cut_production',
+        ('cut_production_records', cut_record.id), current_user['username']
+    )
     
     return cut_record
 
 @api_router.get("/cut-production", response_model=List[CutProductionRecord])
-async def get_cut_production(current_user = Depends(get_current_user)):
-    records = await db.cut_production_records.find({}, {"_id": 0}).sort("date", -1).to_list(1000)
+async def get_cut_production(fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, CutProductionRecord)
+    records = await db.cut_production_records.find({}, field_projection(names)).sort("date", -1).to_list(1000)
+    if names:
+        return sparse_response(CutProductionRecord, names, records)
     for rec in records:
         if isinstance(rec['created_at'], str):
             rec['created_at'] = datetime.fromisoformat(rec['created_at'])
@@ -1281,27 +2505,45 @@ async def delete_cut_production(record_id: str, current_user = Depends(get_curre
     existing = await db.cut_production_records.find_one({"id": record_id})
     if not existing:
         raise HTTPException(status_code=404, detail="Cut production record not found")
-    
-    # Stoğu geri düşür
-    cut_length_m = existing['cut_length_cm'] / 100
-    cut_model_key = f"{existing['source_thickness_mm']}mm_{existing['cut_width_cm']}cm_{cut_length_m}m_kesik"
-    
-    await db.stock.update_one(
-        {"model_key": cut_model_key},
-        {"$inc": {
-            "quantity": -existing['total_cut_pieces'],
-            "square_meters": -existing['cut_square_meters']
-        }}
-    )
+    # Kaynak veya çıktı üretim kaydı arşivdeyse stok geri alınamaz; kesim de silinemez
+    linked = [existing['source_production_id'], existing.get('output_record_id')]
+    if await db.archive_manufacturing_records.find_one({"id": {"$in": [i for i in linked if i]}}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="Linked production record is archived (closed period), cut cannot be deleted")
     
     result = await db.cut_production_records.delete_one({"id": record_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cut production record not found")
     
-    return {"message": "Cut production record deleted successfully"}
-
-@api_router.delete("/material-entries/{entry_id}")
-async def delete_material_entry(entry_id: str, current_user = Depends(get_current_user)):
+    # Stoğu geri al: kesilmiş ürünün üretim kaydını sil, kullanılan ana malzemeyi iade et
+    if existing.get('output_record_id'):
+        output = await db.manufacturing_records.find_one_and_delete({"id": existing['output_record_id']})
+    else:
+        # Eski kayıtlarda bağlantı yok; aynı gün, SKU ve adetteki kesim kaydını bul
+        output = await db.manufacturing_records.find_one_and_delete({
+            "machine": MachineType.CUTTING.value,
+            "sku": existing.get('sku') or cut_sku(existing),
+            "production_date": existing['date'],
+            "quantity": existing['total_cut_pieces']
+        })
+    source = await db.manufacturing_records.find_one_and_update(
+        {"id": existing['source_production_id']},
+        [{"$set": {"quantity": {"$add": ["$quantity", existing['source_pieces_used']]}, **VERSION_BUMP}}],
+        projection={"_id": 0}
+    )
+    event_source = ('cut_production_records', record_id)
+    if output:
+        await record_finished_goods_change(output, None, 'cut_production_delete', event_source, current_user['username'])
+    if source:
+        await append_inventory_event(
+            'finished_good', sku_of(source), existing['source_pieces_used'], 'cut_production_delete',
+            event_source, existing['date'], current_user['username'], delta_sqm=0
+        )
+    await invalidate_stock_snapshots(existing['date'])
+    
+    return {"message": "Cut production record deleted successfully"}
+
+@api_router.delete("/material-entries/{entry_id}")
+async def delete_material_entry(entry_id: str, current_user = Depends(get_current_user)):
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
@@ -1310,14 +2552,16 @@ async def delete_material_entry(entry_id: str, current_user = Depends(get_curren
         raise HTTPException(status_code=404, detail="Material entry not found")
     
     # Stoğu geri düş (girişi iptal et)
-    await db.raw_materials.update_one(
-        {"id": existing['material_id']},
-        {"$inc": {"current_stock": -existing['quantity']}}
+    await adjust_material_stock(
+        {"id": existing['material_id']}, -existing['quantity'], 'material_entry_delete',
+        source=('material_entries', entry_id), occurred_at=existing['entry_date'], user=current_user['username']
     )
     
     result = await db.material_entries.delete_one({"id": entry_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Material entry not found")
+    await invalidate_stock_snapshots(existing['entry_date'])
+    await cache_bus.invalidate('material_prices')
     
     return {"message": "Material entry deleted successfully"}
 
@@ -1335,7 +2579,7 @@ async def create_shipment(shipment_data: ShipmentCreate, current_user = Depends(
     # Get color name if color selected
     color_name = None
     if shipment_data.color_material_id:
-        color_material = await db.raw_materials.find_one({"id": shipment_data.color_material_id})
+        color_material = await find_catalog_material(shipment_data.color_material_id)
         if color_material:
             color_name = color_material['name']
     
@@ -1353,6 +2597,7 @@ async def create_shipment(shipment_data: ShipmentCreate, current_user = Depends(
         color_name=color_name,
         quantity=shipment_data.quantity,
         square_meters=square_meters,
+        sku=make_sku(shipment_data.thickness_mm, shipment_data.width_cm, shipment_data.length_m, color_name),
         invoice_number=shipment_data.invoice_number,
         vehicle_plate=shipment_data.vehicle_plate,
         driver_name=shipment_data.driver_name,
@@ -1362,13 +2607,20 @@ async def create_shipment(shipment_data: ShipmentCreate, current_user = Depends(
     doc = shipment_obj.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['shipment_date'] = doc['shipment_date'].isoformat()
-    await db.shipments.insert_one(doc)
+    await db.shipments.insert_one(set_search_keys('shipments', doc))
+    await invalidate_stock_snapshots(doc['shipment_date'])
+    await record_finished_goods_change(
+        None, doc, 'shipment', ('shipments', doc['id']), current_user['username'], sign=-1, date_field='shipment_date'
+    )
     
     return shipment_obj
 
 @api_router.get("/shipments", response_model=List[Shipment])
-async def get_shipments(current_user = Depends(get_current_user)):
-    shipments = await db.shipments.find({}, {"_id": 0}).sort("shipment_date", -1).to_list(1000)
+async def get_shipments(start: Optional[str] = None, end: Optional[str] = None, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, Shipment)
+    shipments = await history_find(db, 'shipments', start=start, end=end, sort=[("shipment_date", -1)], limit=1000, projection=field_projection(names))
+    if names:
+        return sparse_response(Shipment, names, shipments)
     for ship in shipments:
         if isinstance(ship['created_at'], str):
             ship['created_at'] = datetime.fromisoformat(ship['created_at'])
@@ -1385,7 +2637,7 @@ async def update_shipment(shipment_id: str, shipment_data: ShipmentCreate, curre
     # Mevcut sevkiyatı kontrol et
     existing_shipment = await db.shipments.find_one({"id": shipment_id})
     if not existing_shipment:
-        raise HTTPException(status_code=404, detail="Shipment not found")
+        await raise_not_found('shipments', shipment_id, "Shipment not found")
     
     # Güncellenmiş sevkiyat objesi oluştur
     updated_shipment = Shipment(
@@ -1399,9 +2651,12 @@ async def update_shipment(shipment_id: str, shipment_data: ShipmentCreate, curre
     
     # Renk adını ekle
     if shipment_data.color_material_id:
-        color_material = await db.raw_materials.find_one({"id": shipment_data.color_material_id})
+        color_material = await find_catalog_material(shipment_data.color_material_id)
         if color_material:
             updated_shipment.color_name = color_material['name']
+    updated_shipment.sku = make_sku(
+        shipment_data.thickness_mm, shipment_data.width_cm, shipment_data.length_m, updated_shipment.color_name
+    )
     
     # Veritabanını güncelle
     doc = updated_shipment.model_dump()
@@ -1410,7 +2665,12 @@ async def update_shipment(shipment_id: str, shipment_data: ShipmentCreate, curre
     
     await db.shipments.update_one(
         {"id": shipment_id},
-        {"$set": doc}
+        {"$set": set_search_keys('shipments', doc)}
+    )
+    await invalidate_stock_snapshots(min(str(existing_shipment['shipment_date']), doc['shipment_date']))
+    await record_finished_goods_change(
+        existing_shipment, doc, 'shipment_update', ('shipments', shipment_id), current_user['username'],
+        sign=-1, date_field='shipment_date'
     )
     
     return updated_shipment
@@ -1420,19 +2680,129 @@ async def delete_shipment(shipment_id: str, current_user = Depends(get_current_u
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    result = await db.shipments.delete_one({"id": shipment_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Shipment not found")
+    existing = await db.shipments.find_one_and_delete({"id": shipment_id}, {"_id": 0})
+    if not existing:
+        await raise_not_found('shipments', shipment_id, "Shipment not found")
+    await invalidate_stock_snapshots(existing['shipment_date'])
+    await record_finished_goods_change(
+        existing, None, 'shipment_delete', ('shipments', shipment_id), current_user['username'],
+        sign=-1, date_field='shipment_date'
+    )
     
     return {"message": "Shipment deleted successfully"}
 
+# Search (Typeahead: Türkçe katlanmış anahtarlar üzerinde önek araması)
+SEARCH_FIELDS = {
+    'shipments': ('customer_company', 'invoice_number', 'vehicle_plate', 'driver_name', 'shipment_number'),
+    'raw_materials': ('name', 'code'),
+    'material_entries': ('supplier',),
+    'manufacturing_records': ('model', 'color_name', 'sku'),
+}
+SEARCH_MAX_LIMIT = 20
+SEARCH_GROUP_SCAN = int(os.environ.get('SEARCH_GROUP_SCAN', '200'))
+_SEARCH_CASE = str.maketrans('İI', 'iı')
+_SEARCH_FOLD = str.maketrans('ıişğüöçâîû', 'iisguocaiu')
+
+def search_normalize(text) -> str:
+    """Türkçe büyük/küçük harf ve aksan duyarsız biçim (İ/I/ı/i -> i, ş -> s, ...)"""
+    text = str(text).translate(_SEARCH_CASE).lower().translate(_SEARCH_FOLD)
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text).split())
+
+def search_keys(*values) -> List[str]:
+    """Tam metin, boşluksuz hali (plakalar için) ve her kelime ayrı önek anahtarı"""
+    keys = set()
+    for value in values:
+        if not value:
+            continue
+        normalized = search_normalize(value)
+        if normalized:
+            keys.add(normalized)
+            keys.add(normalized.replace(' ', ''))
+            keys.update(normalized.split())
+    return sorted(keys)
+
+def set_search_keys(name: str, doc: dict) -> dict:
+    doc['search_keys'] = search_keys(*(doc.get(field) for field in SEARCH_FIELDS[name]))
+    return doc
+
+async def backfill_search_keys():
+    """search_keys alanı olmayan eski belgeleri doldur (tek seferlik)"""
+    if await db.migrations.find_one({"_id": "search_keys"}):
+        return
+    
+    names = list(SEARCH_FIELDS) + [f"archive_{name}" for name in SEARCH_FIELDS if name in ARCHIVED_COLLECTIONS]
+    updated = 0
+    for name in names:
+        fields = SEARCH_FIELDS[name.removeprefix('archive_')]
+        ops = []
+        async for doc in db[name].find({"search_keys": {"$exists": False}}, {field: 1 for field in fields}):
+            ops.append(UpdateOne({"_id": doc['_id']}, set_fields(name, {"search_keys": search_keys(*(doc.get(f) for f in fields))})))
+            if len(ops) >= 1000:
+                updated += (await db[name].bulk_write(ops, ordered=False)).modified_count
+                ops = []
+        if ops:
+            updated += (await db[name].bulk_write(ops, ordered=False)).modified_count
+    
+    await db.migrations.update_one(
+        {"_id": "search_keys"},
+        {"$set": {"updated": updated, "finished_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    logger.info(f"Search key backfill finished, {updated} documents updated")
+
+async def _search_docs(name: str, prefix: dict, projection: dict, limit: int) -> list:
+    """Önek eşleşmesi; sıcak koleksiyon yetmezse arşive in (index sırasıyla, sıralama yok)"""
+    docs = await db[name].find(prefix, {"_id": 0, **projection}).limit(limit).to_list(limit)
+    if len(docs) < limit and name in ARCHIVED_COLLECTIONS and await archived_before(name):
+        docs += await db[f"archive_{name}"].find(prefix, {"_id": 0, **projection}).limit(limit - len(docs)).to_list(limit)
+    return docs
+
+async def _search_distinct(name: str, prefix: dict, group_by: str, limit: int) -> list:
+    """Tekrarlayan değerler (tedarikçi, model) için ilk eşleşmelerden benzersizleri topla"""
+    rows = await db[name].aggregate([
+        {"$match": prefix},
+        {"$limit": SEARCH_GROUP_SCAN},
+        {"$group": {"_id": f"${group_by}", "count": {"$sum": 1}, "doc": {"$first": "$$ROOT"}}},
+        {"$sort": {"count": -1}},
+        {"$limit": limit}
+    ]).to_list(limit)
+    return [row for row in rows if row['_id']]
+
+@api_router.get("/search")
+async def search(q: str, limit: int = 5, current_user = Depends(get_current_user)):
+    """Sevkiyat, hammadde, tedarikçi ve model araması (önek, Türkçe büyük/küçük harf duyarsız)"""
+    query = search_normalize(q)
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    if not query:
+        return {"query": q, "shipments": [], "materials": [], "suppliers": [], "models": []}
+    
+    prefix = {"search_keys": {"$regex": f"^{re.escape(query)}"}}
+    shipments, materials, suppliers, models = await asyncio.gather(
+        _search_docs('shipments', prefix, {
+            "id": 1, "shipment_number": 1, "shipment_date": 1, "customer_company": 1,
+            "invoice_number": 1, "vehicle_plate": 1, "driver_name": 1
+        }, limit),
+        _search_docs('raw_materials', prefix, {"id": 1, "name": 1, "code": 1, "unit": 1, "current_stock": 1}, limit),
+        _search_distinct('material_entries', prefix, 'supplier', limit),
+        _search_distinct('manufacturing_records', prefix, 'sku', limit)
+    )
+    metrics.incr('search_requests')
+    return {
+        "query": q,
+        "shipments": shipments,
+        "materials": materials,
+        "suppliers": [{"name": row['_id']} for row in suppliers],
+        "models": [
+            {"sku": row['_id'], "model": row['doc'].get('model'), "color_name": row['doc'].get('color_name')}
+            for row in models
+        ]
+    }
+
 # Cost Analysis Routes
-@api_router.get("/costs/analysis", response_model=List[CostAnalysis])
-async def get_cost_analysis(current_user = Depends(get_current_user)):
-    consumptions = await db.consumptions.find({}, {"_id": 0}).to_list(10000)
-    materials = await db.raw_materials.find({}, {"_id": 0}).to_list(1000)
-    
-    material_map = {m['id']: m for m in materials}
+async def build_cost_analysis() -> List[dict]:
+    """Hammadde bazında tüketim maliyeti"""
+    consumptions = await history_find(analytics_db, 'consumptions', limit=10000)
+    material_map = await get_material_catalog()
     cost_data = {}
     
     for cons in consumptions:
@@ -1454,85 +2824,83 @@ async def get_cost_analysis(current_user = Depends(get_current_user)):
     
     return list(cost_data.values())
 
-@api_router.get("/costs/production-analysis", response_model=List[ProductionCostAnalysis])
-async def get_production_cost_analysis(current_user = Depends(get_current_user)):
-    """Üretim bazında detaylı maliyet analizi"""
+@api_router.get("/costs/analysis", response_model=List[CostAnalysis])
+async def get_cost_analysis(current_user = Depends(get_current_user)):
+    return await single_flight.run('cost_analysis', coalesce_key(), build_cost_analysis)
+
+async def material_price_components() -> dict:
+    """Hammadde adı -> para birimi bazında ağırlıklı ortalama birim fiyat bileşenleri (önbellekten)
+    
+    TL fiyat = TRY + USD * usd_kuru + EUR * eur_kuru; girişi olmayan hammaddede kartındaki birim fiyat.
+    Kurdan bağımsız olduğu için kur değişikliğinde yeniden hesaplanması gerekmez.
+    """
+    async def load():
+        # Önbelleğe yazılan değer invalidate sonrası sonuna kadar kalır; gecikmeli ikincilden değil birincilden okunur
+        rows = await db.material_entries.aggregate([
+            {"$group": {
+                "_id": {"name": "$material_name", "currency": "$currency"},
+                "quantity": {"$sum": "$quantity"},
+                "amount": {"$sum": {"$multiply": ["$quantity", "$unit_price"]}}
+            }}
+        ]).to_list(None)
+        
+        totals = {}
+        for row in rows:
+            currency = row['_id'].get('currency')
+            currency = currency if currency in ('USD', 'EUR') else 'TRY'
+            total = totals.setdefault(row['_id'].get('name'), {'quantity': 0, 'TRY': 0, 'USD': 0, 'EUR': 0})
+            total['quantity'] += row['quantity']
+            total[currency] += row['amount']
+        
+        components = {}
+        for material in (await get_material_catalog()).values():
+            total = totals.get(material['name'])
+            if total and total['quantity'] > 0:
+                components[material['name']] = {c: total[c] / total['quantity'] for c in ('TRY', 'USD', 'EUR')}
+            else:
+                components[material['name']] = {'TRY': material.get('unit_price', 0), 'USD': 0, 'EUR': 0}
+        return components
+    return await material_prices_cache.get_or_load('components', load)
+
+def price_from_components(parts: dict, exchange_rates: dict) -> float:
+    return parts['TRY'] + parts['USD'] * exchange_rates.get('USD', 0) + parts['EUR'] * exchange_rates.get('EUR', 0)
+
+async def build_production_cost_analysis(start: Optional[str] = None, end: Optional[str] = None, limit: Optional[int] = 1000) -> List[dict]:
+    """Üretim bazında detaylı maliyet analizi (limit=None: tüm geçmiş)"""
     
     # Üretim kayıtlarını al (Kesim hariç)
-    manufacturing = await db.manufacturing_records.find(
-        {"machine": {"$ne": "Kesim"}}, 
-        {"_id": 0}
-    ).sort("production_date", -1).to_list(1000)
+    manufacturing = await history_find(
+        analytics_db, 'manufacturing_records', {"machine": {"$ne": "Kesim"}},
+        start=start, end=end, sort=[("production_date", -1)], limit=limit
+    )
     
     # Günlük tüketimleri al  
-    daily_consumptions = await db.daily_consumptions.find({}, {"_id": 0}).to_list(1000)
-    
-    # Güncel döviz kurlarını al
-    exchange_rates = {}
-    rates_data = await db.exchange_rates.find({}, {"_id": 0}).to_list(10)
-    for rate in rates_data:
-        exchange_rates[rate['currency']] = rate['rate']
-    
-    # Varsayılan kurlar
-    if 'USD' not in exchange_rates:
-        exchange_rates['USD'] = 32.50
-    if 'EUR' not in exchange_rates:
-        exchange_rates['EUR'] = 35.00
-    
-    # Hammaddeleri al ve birim fiyatlarını güncel kurla hesapla
-    materials = await db.raw_materials.find({}, {"_id": 0}).to_list(1000)
-    
-    # Her hammadde için en son girişleri al ve ağırlıklı ortalama fiyat hesapla
-    material_entries = await db.material_entries.find({}, {"_id": 0}).to_list(10000)
-    
-    # Hammadde bazında fiyat hesapla
-    material_prices = {}
-    for material in materials:
-        mat_name = material['name']
-        
-        # Bu hammaddeye ait girişleri bul
-        mat_entries = [e for e in material_entries if e.get('material_name') == mat_name]
-        
-        if mat_entries:
-            # Ağırlıklı ortalama hesapla
-            total_quantity = 0
-            total_cost_tl = 0
-            
-            for entry in mat_entries:
-                qty = entry.get('quantity', 0)
-                unit_price = entry.get('unit_price', 0)
-                currency = entry.get('currency', 'TRY')
-                
-                # Döviz cinsinden ise TL'ye çevir
-                if currency == 'USD':
-                    unit_price_tl = unit_price * exchange_rates['USD']
-                elif currency == 'EUR':
-                    unit_price_tl = unit_price * exchange_rates['EUR']
-                else:  # TRY
-                    unit_price_tl = unit_price
-                
-                total_quantity += qty
-                total_cost_tl += qty * unit_price_tl
-            
-            # Ağırlıklı ortalama birim fiyat
-            if total_quantity > 0:
-                material_prices[mat_name] = total_cost_tl / total_quantity
-            else:
-                material_prices[mat_name] = material.get('unit_price', 0)
-        else:
-            # Giriş yoksa raw_materials'deki fiyatı kullan
-            material_prices[mat_name] = material.get('unit_price', 0)
+    daily_collection, daily_is_ts = await daily_consumption_store.reader(analytics_db)
+    daily_consumptions = await daily_collection.find(
+        date_range_filter('date', start, end, as_datetime=daily_is_ts), {"_id": 0}
+    ).to_list(None)
+    
+    # Güncel döviz kurlarını al (varsayılanlar dahil)
+    exchange_rates = await get_exchange_rate_map()
     
-    material_map = {m['name']: m for m in materials}
+    # Hammadde birim fiyatları: girişlerin ağırlıklı ortalaması, güncel kurla TL'ye çevrilmiş
+    components = await material_price_components()
+    material_prices = {name: price_from_components(parts, exchange_rates) for name, parts in components.items()}
     
     # Günlük tüketimleri tarih+makine bazında grupla
     daily_map = {}
     for dc in daily_consumptions:
-        date_str = dc.get('date', '')[:10]  # YYYY-MM-DD formatına çevir
+        date_str = str(dc.get('date', ''))[:10]  # YYYY-MM-DD formatına çevir
         machine = dc.get('machine', '')
         key = f"{date_str}|{machine}"
         daily_map[key] = dc
     
+    # Gün+makine bazında toplam üretim m²
+    day_totals = {}
+    for m in manufacturing:
+        day_key = f"{str(m.get('production_date', ''))[:10]}|{m.get('machine')}"
+        day_totals[day_key] = day_totals.get(day_key, 0) + m.get('square_meters', 0)
+    
     results = []
     row_number = 1
     
@@ -1550,12 +2918,8 @@ async def get_production_cost_analysis(current_user = Depends(get_current_user))
         machine = mfg.get('machine', '')
         key = f"{date_only}|{machine}"
         
-        # O günün o makinesinin toplam üretimini bul
-        same_day_productions = [m for m in manufacturing 
-                               if (str(m.get('production_date', ''))[:10] == date_only and 
-                                   m.get('machine') == machine)]
-        
-        total_day_sqm = sum(m.get('square_meters', 0) for m in same_day_productions)
+        # O günün o makinesinin toplam üretimi
+        total_day_sqm = day_totals.get(key, 0)
         
         # Bu üretimin payı
         mfg_sqm = mfg.get('square_meters', 0)
@@ -1625,15 +2989,273 @@ async def get_production_cost_analysis(current_user = Depends(get_current_user))
     
     return results
 
+@api_router.get("/costs/production-analysis", response_model=List[ProductionCostAnalysis])
+async def get_production_cost_analysis(start: Optional[str] = None, end: Optional[str] = None, current_user = Depends(get_current_user)):
+    """Üretim bazında detaylı maliyet analizi"""
+    return await single_flight.run(
+        'production_cost_analysis', coalesce_key(start=start, end=end),
+        lambda: build_production_cost_analysis(start, end)
+    )
+
+# Batch Quote (Manuel Hesaplama sayfasının sunucu tarafı karşılığı)
+QUOTE_RATIOS = {'Estol': 0.03, 'Talk': 0.015, 'Gaz': 0.04}  # Petkim kg'ına oranla
+QUOTE_MAX_SPECS = int(os.environ.get('QUOTE_MAX_SPECS', '1000'))
+
+class QuoteSpec(BaseModel):
+    thickness_mm: float = Field(gt=0)
+    width_cm: float = Field(gt=0)
+    length_m: float = Field(gt=0)
+    quantity: int = Field(default=1, gt=0)
+    masura_type: Optional[str] = None
+    color: Optional[str] = None
+    petkim_g_per_sqm: Optional[float] = None  # Verilmezse istek geneli değer
+    general_expenses_pct: Optional[float] = None
+    profit_pct: Optional[float] = None
+
+class QuoteRequest(BaseModel):
+    specs: List[QuoteSpec]
+    petkim_g_per_sqm: Optional[float] = None  # gr/m²
+    general_expenses_pct: float = 0
+    profit_pct: float = 0
+
+def _quote_price(prices: dict, name: str) -> float:
+    """Önce tam ad, sonra sayfadaki gibi ad içinde arama (büyük/küçük harf duyarsız)"""
+    if name in prices:
+        return prices[name]
+    needle = name.casefold()
+    return next((price for material, price in prices.items() if needle in material.casefold()), 0)
+
+@api_router.post("/costs/quote")
+async def quote_costs(request: QuoteRequest, current_user = Depends(get_current_user)):
+    """Birden çok ürün özelliği için birim ve m² başı maliyet / satış fiyatı"""
+    if not request.specs:
+        raise HTTPException(status_code=400, detail="At least one spec is required")
+    if len(request.specs) > QUOTE_MAX_SPECS:
+        raise HTTPException(status_code=400, detail=f"Too many specs, maximum is {QUOTE_MAX_SPECS}")
+    
+    exchange_rates = await get_exchange_rate_map()
+    prices = {name: price_from_components(parts, exchange_rates) for name, parts in (await material_price_components()).items()}
+    petkim_price = _quote_price(prices, 'Petkim')
+    ratio_prices = {name: _quote_price(prices, name) for name in QUOTE_RATIOS}
+    
+    quotes = []
+    masura_prices = {}
+    for index, spec in enumerate(request.specs):
+        petkim_g_per_sqm = spec.petkim_g_per_sqm if spec.petkim_g_per_sqm is not None else request.petkim_g_per_sqm
+        if petkim_g_per_sqm is None:
+            raise HTTPException(status_code=400, detail=f"Spec {index}: petkim_g_per_sqm is required")
+        masura_price = 0
+        if spec.masura_type and spec.masura_type != MasuraType.NO_MASURA.value:
+            if spec.masura_type not in prices:
+                raise HTTPException(status_code=400, detail=f"Spec {index}: unknown masura type {spec.masura_type}")
+            masura_price = masura_prices[spec.masura_type] = prices[spec.masura_type]
+        
+        # Birim (bir bobin) başına
+        square_meters = (spec.width_cm / 100) * spec.length_m
+        petkim_kg = petkim_g_per_sqm * square_meters / 1000
+        consumption = {'Petkim': petkim_kg, **{name: petkim_kg * ratio for name, ratio in QUOTE_RATIOS.items()}}
+        material_cost = petkim_kg * petkim_price + sum(consumption[name] * ratio_prices[name] for name in QUOTE_RATIOS)
+        raw_cost = material_cost + masura_price
+        
+        expenses_pct = spec.general_expenses_pct if spec.general_expenses_pct is not None else request.general_expenses_pct
+        profit_pct = spec.profit_pct if spec.profit_pct is not None else request.profit_pct
+        cost_with_expenses = raw_cost * (1 + expenses_pct / 100)
+        final_price = cost_with_expenses * (1 + profit_pct / 100)
+        
+        quotes.append({
+            'index': index,
+            'sku': make_sku(spec.thickness_mm, spec.width_cm, spec.length_m, spec.color),
+            'quantity': spec.quantity,
+            'square_meters_per_unit': round(square_meters, 4),
+            'total_square_meters': round(square_meters * spec.quantity, 2),
+            'consumption_kg_per_unit': {name.lower(): round(kg, 3) for name, kg in consumption.items()},
+            'material_cost_per_unit': round(material_cost, 2),
+            'masura_cost_per_unit': round(masura_price, 2),
+            'raw_cost_per_unit': round(raw_cost, 2),
+            'raw_cost_per_sqm': round(raw_cost / square_meters, 2),
+            'cost_with_expenses_per_unit': round(cost_with_expenses, 2),
+            'price_per_unit': round(final_price, 2),
+            'price_per_sqm': round(final_price / square_meters, 2),
+            'total_price': round(final_price * spec.quantity, 2)
+        })
+    
+    return {
+        'exchange_rates': exchange_rates,
+        'prices': {
+            'petkim': round(petkim_price, 4),
+            **{name.lower(): round(price, 4) for name, price in ratio_prices.items()},
+            **{name: round(price, 4) for name, price in masura_prices.items()}
+        },
+        'quotes': quotes,
+        'totals': {
+            'quantity': sum(q['quantity'] for q in quotes),
+            'square_meters': round(sum(q['total_square_meters'] for q in quotes), 2),
+            'total_price': round(sum(q['total_price'] for q in quotes), 2)
+        }
+    }
+
+# What-if Cost Simulation (tüm üretim geçmişini NumPy dizileriyle yeniden fiyatlar, hiçbir şey yazmaz)
+SIMULATION_PERIODS = {'day': 10, 'month': 7, 'year': 4}  # Periyot -> tarih string'inin ilk kaç karakteri
+SIMULATION_BASE_MATERIALS = ('Petkim', 'Estol', 'Talk', 'Gaz')
+
+class CostSimulationRequest(BaseModel):
+    start: Optional[str] = None
+    end: Optional[str] = None
+    price_changes_pct: Dict[str, float] = Field(default_factory=dict)  # Hammadde adı -> % değişim (örn. {"Petkim": 8})
+    price_overrides: Dict[str, float] = Field(default_factory=dict)  # Hammadde adı -> yeni TL birim fiyat
+    exchange_rates: Dict[str, float] = Field(default_factory=dict)  # Para birimi -> yeni kur (örn. {"USD": 36.5})
+    period: str = 'month'  # day, month, year
+    row_limit: int = 100
+
+def _cost_groups(keys, base, simulated, sqm) -> List[dict]:
+    """Anahtara göre maliyet toplamları (np.unique + bincount)"""
+    uniques, inverse = np.unique(keys, return_inverse=True)
+    base_sum = np.bincount(inverse, weights=base, minlength=len(uniques))
+    sim_sum = np.bincount(inverse, weights=simulated, minlength=len(uniques))
+    sqm_sum = np.bincount(inverse, weights=sqm, minlength=len(uniques))
+    safe_sqm = np.where(sqm_sum > 0, sqm_sum, 1)
+    groups = []
+    for i, key in enumerate(uniques.tolist()):
+        delta = sim_sum[i] - base_sum[i]
+        groups.append({
+            'key': key,
+            'square_meters': round(float(sqm_sum[i]), 2),
+            'base_cost': round(float(base_sum[i]), 2),
+            'simulated_cost': round(float(sim_sum[i]), 2),
+            'delta': round(float(delta), 2),
+            'delta_pct': round(float(delta / base_sum[i] * 100), 2) if base_sum[i] else 0,
+            'base_cost_per_sqm': round(float(base_sum[i] / safe_sqm[i]), 2) if sqm_sum[i] > 0 else 0,
+            'simulated_cost_per_sqm': round(float(sim_sum[i] / safe_sqm[i]), 2) if sqm_sum[i] > 0 else 0
+        })
+    return groups
+
+@api_router.post("/costs/simulate")
+async def simulate_costs(request: CostSimulationRequest, current_user = Depends(get_current_user)):
+    """Fiyat / kur değişikliklerinin üretim maliyetine etkisi (satır, SKU ve periyot bazında)"""
+    started = time.perf_counter()
+    if request.period not in SIMULATION_PERIODS:
+        raise HTTPException(status_code=400, detail=f"Invalid period, expected one of: {', '.join(SIMULATION_PERIODS)}")
+    
+    base_rates = await get_exchange_rate_map()
+    unknown_currencies = set(request.exchange_rates) - set(base_rates)
+    if unknown_currencies:
+        raise HTTPException(status_code=400, detail=f"Unknown currencies: {', '.join(sorted(unknown_currencies))}")
+    components = await material_price_components()
+    unknown = (set(request.price_changes_pct) | set(request.price_overrides)) - set(components)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown materials: {', '.join(sorted(unknown))}")
+    
+    # Mevcut ve senaryo fiyatları (override sonra yüzde değişim uygulanır)
+    simulated_rates = {**base_rates, **request.exchange_rates}
+    base_prices = {name: price_from_components(parts, base_rates) for name, parts in components.items()}
+    simulated_prices = {}
+    for name, parts in components.items():
+        price = request.price_overrides.get(name, price_from_components(parts, simulated_rates))
+        simulated_prices[name] = price * (1 + request.price_changes_pct.get(name, 0) / 100)
+    
+    manufacturing = await history_find(
+        analytics_db, 'manufacturing_records', {"machine": {"$ne": "Kesim"}},
+        start=request.start, end=request.end,
+        projection={"_id": 0, "id": 1, "production_date": 1, "machine": 1, "square_meters": 1, "quantity": 1,
+                    "gas_consumption_kg": 1, "masura_type": 1, "masura_quantity": 1, "sku": 1,
+                    "thickness_mm": 1, "width_cm": 1, "length_m": 1, "color_name": 1}
+    )
+    daily_collection, daily_is_ts = await daily_consumption_store.reader(analytics_db)
+    daily_consumptions = await daily_collection.find(
+        date_range_filter('date', request.start, request.end, as_datetime=daily_is_ts),
+        {"_id": 0, "date": 1, "machine": 1, "petkim_quantity": 1, "fire_quantity": 1, "estol_quantity": 1, "talk_quantity": 1}
+    ).to_list(None)
+    
+    n = len(manufacturing)
+    days = np.array([
+        m['production_date'].strftime('%Y-%m-%d') if isinstance(m.get('production_date'), datetime) else str(m.get('production_date', ''))[:10]
+        for m in manufacturing
+    ], dtype=str)
+    day_keys = np.char.add(np.char.add(days, '|'), np.array([str(m.get('machine', '')) for m in manufacturing], dtype=str))
+    sqm = np.fromiter((m.get('square_meters') or 0 for m in manufacturing), dtype=np.float64, count=n)
+    gas = np.fromiter((m.get('gas_consumption_kg') or 0 for m in manufacturing), dtype=np.float64, count=n)
+    masura_qty = np.fromiter((m.get('masura_quantity') or 0 for m in manufacturing), dtype=np.float64, count=n)
+    masura_names, masura_idx = np.unique(
+        np.array([m.get('masura_type') or 'Masura 100' for m in manufacturing], dtype=str), return_inverse=True
+    )
+    
+    # Günlük tüketimi gün+makine bazında üretim m² payına göre dağıt
+    daily_map = {}
+    for dc in daily_consumptions:
+        date_value = dc.get('date', '')
+        date_str = date_value.strftime('%Y-%m-%d') if isinstance(date_value, datetime) else str(date_value)[:10]
+        daily_map[f"{date_str}|{dc.get('machine', '')}"] = dc
+    unique_days, day_idx = np.unique(day_keys, return_inverse=True)
+    day_sqm = np.bincount(day_idx, weights=sqm, minlength=len(unique_days))
+    share = np.divide(sqm, day_sqm[day_idx], out=np.zeros(n), where=day_sqm[day_idx] > 0)
+    daily = np.array([
+        [
+            daily_map.get(key, {}).get('petkim_quantity', 0) + daily_map.get(key, {}).get('fire_quantity', 0),
+            daily_map.get(key, {}).get('estol_quantity', 0),
+            daily_map.get(key, {}).get('talk_quantity', 0)
+        ]
+        for key in unique_days.tolist()
+    ], dtype=np.float64).reshape(len(unique_days), 3)
+    
+    # Satır x (Petkim, Estol, Talk, Gaz) miktar matrisi
+    quantities = np.column_stack([daily[day_idx] * share[:, None], gas])
+    
+    def price_vector(prices):
+        return np.array([prices.get(name, 0) for name in SIMULATION_BASE_MATERIALS], dtype=np.float64)
+    
+    def masura_prices(prices):
+        return np.array([prices.get(name, 0) for name in masura_names.tolist()], dtype=np.float64)
+    
+    base_cost = quantities @ price_vector(base_prices) + masura_qty * masura_prices(base_prices)[masura_idx]
+    simulated_cost = quantities @ price_vector(simulated_prices) + masura_qty * masura_prices(simulated_prices)[masura_idx]
+    delta = simulated_cost - base_cost
+    
+    skus = np.array([sku_of(m) for m in manufacturing], dtype=str)
+    periods = np.array([day[:SIMULATION_PERIODS[request.period]] for day in days.tolist()], dtype=str)
+    
+    # Satırlar: en yeni üretimler önce
+    rows = []
+    for i in np.argsort(days, kind='stable')[::-1][:max(request.row_limit, 0)].tolist():
+        rows.append({
+            'production_id': manufacturing[i].get('id', ''),
+            'date': str(days[i]),
+            'sku': str(skus[i]),
+            'square_meters': round(float(sqm[i]), 2),
+            'base_cost': round(float(base_cost[i]), 2),
+            'simulated_cost': round(float(simulated_cost[i]), 2),
+            'delta': round(float(delta[i]), 2),
+            'base_cost_per_sqm': round(float(base_cost[i] / sqm[i]), 2) if sqm[i] > 0 else 0,
+            'simulated_cost_per_sqm': round(float(simulated_cost[i] / sqm[i]), 2) if sqm[i] > 0 else 0
+        })
+    
+    total_group = _cost_groups(np.zeros(n, dtype=int), base_cost, simulated_cost, sqm) if n else []
+    used_materials = [*SIMULATION_BASE_MATERIALS, *masura_names.tolist()]
+    duration_ms = (time.perf_counter() - started) * 1000
+    metrics.observe('cost_simulation_ms', duration_ms)
+    
+    return {
+        'rows_total': n,
+        'period': request.period,
+        'exchange_rates': {'base': base_rates, 'simulated': simulated_rates},
+        'prices': [
+            {'material': name, 'base': round(base_prices.get(name, 0), 4), 'simulated': round(simulated_prices.get(name, 0), 4)}
+            for name in dict.fromkeys(used_materials)
+        ],
+        'summary': {k: v for k, v in total_group[0].items() if k != 'key'} if total_group else None,
+        'by_period': [{'period': g.pop('key'), **g} for g in _cost_groups(periods, base_cost, simulated_cost, sqm)] if n else [],
+        'by_sku': [{'sku': g.pop('key'), **g} for g in _cost_groups(skus, base_cost, simulated_cost, sqm)] if n else [],
+        'rows': rows,
+        'duration_ms': round(duration_ms, 1)
+    }
+
 # Dashboard Routes
-@api_router.get("/dashboard/stats", response_model=DashboardStats)
-async def get_dashboard_stats(current_user = Depends(get_current_user)):
+async def build_dashboard_stats() -> DashboardStats:
     # Hammadde çeşidi
-    total_raw_materials = await db.raw_materials.count_documents({})
+    total_raw_materials = await analytics_db.raw_materials.count_documents({})
     
     # Stok hesaplama (üretim - sevkiyat)
-    manufacturing = await db.manufacturing_records.find({}, {"_id": 0}).to_list(10000)
-    shipments = await db.shipments.find({}, {"_id": 0}).to_list(10000)
+    manufacturing = await history_find(analytics_db, 'manufacturing_records', limit=10000)
+    shipments = await history_find(analytics_db, 'shipments', limit=10000)
     
     stock_dict = {}
     normal_stock_total = 0
@@ -1641,12 +3263,7 @@ async def get_dashboard_stats(current_user = Depends(get_current_user)):
     
     # Üretimleri grupla
     for record in manufacturing:
-        color_key = record.get('color_name', '') or ''
-        # Normalize to float to match shipments
-        thickness = float(record['thickness_mm'])
-        width = float(record['width_cm'])
-        length = float(record['length_m'])
-        key = f"{thickness}|{width}|{length}|{color_key}"
+        key = sku_of(record)
         
         if key not in stock_dict:
             stock_dict[key] = {
@@ -1658,12 +3275,7 @@ async def get_dashboard_stats(current_user = Depends(get_current_user)):
     
     # Sevkiyatları düş
     for shipment in shipments:
-        color_key = shipment.get('color_name', '') or ''
-        # Normalize to float to match manufacturing
-        thickness = float(shipment['thickness_mm'])
-        width = float(shipment['width_cm'])
-        length = float(shipment['length_m'])
-        key = f"{thickness}|{width}|{length}|{color_key}"
+        key = sku_of(shipment)
         
         if key in stock_dict:
             stock_dict[key]['quantity'] -= shipment['quantity']
@@ -1686,6 +3298,10 @@ async def get_dashboard_stats(current_user = Depends(get_current_user)):
         cut_production_stock=cut_stock_total
     )
 
+@api_router.get("/dashboard/stats", response_model=DashboardStats)
+async def get_dashboard_stats(current_user = Depends(get_current_user)):
+    return await single_flight.run('dashboard_stats', coalesce_key(), build_dashboard_stats)
+
 # Manufacturing Routes
 @api_router.post("/manufacturing", response_model=ManufacturingRecord)
 async def create_manufacturing_record(record_data: ManufacturingRecordCreate, current_user = Depends(get_current_user)):
@@ -1701,7 +3317,7 @@ async def create_manufacturing_record(record_data: ManufacturingRecordCreate, cu
     # Get color name if color selected
     color_name = None
     if record_data.color_material_id:
-        color_material = await db.raw_materials.find_one({"id": record_data.color_material_id})
+        color_material = await find_catalog_material(record_data.color_material_id)
         if color_material:
             color_name = color_material['name']
     
@@ -1710,6 +3326,7 @@ async def create_manufacturing_record(record_data: ManufacturingRecordCreate, cu
         square_meters=square_meters,
         model=model,
         color_name=color_name,
+        sku=make_sku(record_data.thickness_mm, record_data.width_cm, record_data.length_m, color_name),
         created_by=current_user['username']
     )
     
@@ -1717,18 +3334,20 @@ async def create_manufacturing_record(record_data: ManufacturingRecordCreate, cu
     doc['production_date'] = doc['production_date'].isoformat()
     doc['created_at'] = doc['created_at'].isoformat()
     
-    await db.manufacturing_records.insert_one(doc)
+    await db.manufacturing_records.insert_one(set_search_keys('manufacturing_records', doc))
+    await invalidate_stock_snapshots(doc['production_date'])
+    source = ('manufacturing_records', record_obj.id)
+    await record_finished_goods_change(None, doc, 'manufacturing', source, current_user['username'])
     
     # Update masura stock if not "Masura Yok"
-    # Üretilen adet kadar masura stoğunu düş
+    # Üretilen adet kadar masura stoğunu düş (stok yetersizse dokunma)
     if record_data.masura_type != MasuraType.NO_MASURA:
-        masura_material = await db.raw_materials.find_one({"name": record_data.masura_type})
-        if masura_material and masura_material['current_stock'] >= record_data.quantity:
-            await db.raw_materials.update_one(
-                {"id": masura_material['id']},
-                {"$inc": {"current_stock": -record_data.quantity}}
-            )
-            
+        masura_material = await adjust_material_stock(
+            {"name": record_data.masura_type, "current_stock": {"$gte": record_data.quantity}},
+            -record_data.quantity, 'manufacturing',
+            source=source, occurred_at=doc['production_date'], user=current_user['username']
+        )
+        if masura_material:
             # Create consumption record for masura (üretilen adet kadar)
             consumption_doc = {
                 "id": str(uuid.uuid4()),
@@ -1742,13 +3361,12 @@ async def create_manufacturing_record(record_data: ManufacturingRecordCreate, cu
             await db.consumptions.insert_one(consumption_doc)
     
     # Update gas consumption (Gaz material)
-    gaz_material = await db.raw_materials.find_one({"code": "GAZ001"})
-    if gaz_material and gaz_material['current_stock'] >= record_data.gas_consumption_kg:
-        await db.raw_materials.update_one(
-            {"id": gaz_material['id']},
-            {"$inc": {"current_stock": -record_data.gas_consumption_kg}}
-        )
-        
+    gaz_material = await adjust_material_stock(
+        {"code": "GAZ001", "current_stock": {"$gte": record_data.gas_consumption_kg}},
+        -record_data.gas_consumption_kg, 'manufacturing',
+        source=source, occurred_at=doc['production_date'], user=current_user['username']
+    )
+    if gaz_material:
         # Create consumption record for gas
         gas_consumption_doc = {
             "id": str(uuid.uuid4()),
@@ -1764,8 +3382,11 @@ async def create_manufacturing_record(record_data: ManufacturingRecordCreate, cu
     return record_obj
 
 @api_router.get("/manufacturing", response_model=List[ManufacturingRecord])
-async def get_manufacturing_records(current_user = Depends(get_current_user)):
-    records = await db.manufacturing_records.find({}, {"_id": 0}).sort("production_date", -1).to_list(1000)
+async def get_manufacturing_records(start: Optional[str] = None, end: Optional[str] = None, fields: Optional[str] = None, current_user = Depends(get_current_user)):
+    names = parse_fields(fields, ManufacturingRecord)
+    records = await history_find(db, 'manufacturing_records', start=start, end=end, sort=[("production_date", -1)], limit=1000, projection=field_projection(names))
+    if names:
+        return sparse_response(ManufacturingRecord, names, records)
     for record in records:
         if isinstance(record['production_date'], str):
             record['production_date'] = datetime.fromisoformat(record['production_date'])
@@ -1774,15 +3395,11 @@ async def get_manufacturing_records(current_user = Depends(get_current_user)):
     return records
 
 @api_router.put("/manufacturing/{record_id}", response_model=ManufacturingRecord)
-async def update_manufacturing_record(record_id: str, record_data: ManufacturingRecordCreate, current_user = Depends(get_current_user)):
+async def update_manufacturing_record(record_id: str, record_data: ManufacturingRecordCreate, response: Response,
+                                      if_match: Optional[str] = Header(None), current_user = Depends(get_current_user)):
     if current_user['role'] == 'viewer':
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    # Check if record exists
-    existing = await db.manufacturing_records.find_one({"id": record_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Record not found")
-    
     # Calculate square meters
     square_meters = (record_data.width_cm / 100) * record_data.length_m * record_data.quantity
     
@@ -1792,7 +3409,7 @@ async def update_manufacturing_record(record_id: str, record_data: Manufacturing
     # Get color name if color selected
     color_name = None
     if record_data.color_material_id:
-        color_material = await db.raw_materials.find_one({"id": record_data.color_material_id})
+        color_material = await find_catalog_material(record_data.color_material_id)
         if color_material:
             color_name = color_material['name']
     
@@ -1810,13 +3427,26 @@ async def update_manufacturing_record(record_id: str, record_data: Manufacturing
         "color_material_id": record_data.color_material_id,
         "color_name": color_name,
         "model": model,
-        "gas_consumption_kg": record_data.gas_consumption_kg
+        "gas_consumption_kg": record_data.gas_consumption_kg,
+        "sku": make_sku(record_data.thickness_mm, record_data.width_cm, record_data.length_m, color_name)
     }
     
-    await db.manufacturing_records.update_one({"id": record_id}, {"$set": update_data})
+    # Tek gidiş-dönüş: eski hali döner (mamul stok farkı için), yeni hal yazılan alanlardan kurulur
+    existing = await db.manufacturing_records.find_one_and_update(
+        versioned_filter(record_id, parse_if_match(if_match)),
+        versioned_update(set_search_keys('manufacturing_records', update_data)),
+        projection={"_id": 0, "search_keys": 0}
+    )
+    if existing is None:
+        await raise_update_failure(db.manufacturing_records, record_id, "Record not found")
+    await invalidate_stock_snapshots(min(str(existing['production_date']), update_data['production_date']))
     
     # Get updated record
-    updated = await db.manufacturing_records.find_one({"id": record_id}, {"_id": 0})
+    updated = {**existing, **update_data, "version": existing.get('version', 1) + 1}
+    response.headers['ETag'] = etag(updated)
+    await record_finished_goods_change(
+        existing, updated, 'manufacturing_update', ('manufacturing_records', record_id), current_user['username']
+    )
     if isinstance(updated['production_date'], str):
         updated['production_date'] = datetime.fromisoformat(updated['production_date'])
     if isinstance(updated['created_at'], str):
@@ -1824,20 +3454,192 @@ async def update_manufacturing_record(record_id: str, record_data: Manufacturing
     
     return ManufacturingRecord(**updated)
 
+def transactions_supported() -> bool:
+    """Transaction yalnızca replica set / sharded kümede var; tek sunucuda adımlar sırayla yazılır"""
+    return client.topology_description.topology_type_name in ('ReplicaSetWithPrimary', 'Sharded')
+
+async def run_in_transaction(operations):
+    """operations(session) tek transaction içinde çalışır (geçici hatalarda sürücü yeniden dener)"""
+    if not transactions_supported():
+        return await operations(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(operations)
+
+async def delete_manufacturing_cascade(match: dict, user: str) -> dict:
+    """Üretim kayıtlarını bağlı masura/gaz tüketimleriyle birlikte sil ve stokları iade et"""
+    async def operations(session):
+        records = await db.manufacturing_records.find(match, {"_id": 0}, session=session).to_list(None)
+        if not records:
+            return records, [], {}, {}
+        ids = [record['id'] for record in records]
+        
+        # Bağlı tüketimler tek sorguda (production_order_id index'i)
+        dependent = {"production_order_id": {"$in": ids}}
+        consumptions = await db.consumptions.find(dependent, {"_id": 0}, session=session).to_list(None)
+        consumptions += await db.archive_consumptions.find(dependent, {"_id": 0}, session=session).to_list(None)
+        restore = {}
+        for consumption in consumptions:
+            restore[consumption['material_id']] = restore.get(consumption['material_id'], 0) + consumption['quantity']
+        materials = {}
+        if restore:
+            materials = {m['id']: m for m in await db.raw_materials.find(
+                {"id": {"$in": list(restore)}},
+                {"_id": 0, "id": 1, "name": 1, "current_stock": 1, "min_stock_level": 1, "below_min": 1},
+                session=session
+            ).to_list(None)}
+            # Hammadde başına tek güncelleme, hepsi tek bulk_write
+            await db.raw_materials.bulk_write([
+                UpdateOne({"id": material_id}, [
+                    {"$set": {"current_stock": {"$add": [{"$ifNull": ["$current_stock", 0]}, quantity]}}},
+                    BELOW_MIN_STAGE
+                ])
+                for material_id, quantity in restore.items()
+            ], ordered=False, session=session)
+        
+        await db.manufacturing_records.delete_many({"id": {"$in": ids}}, session=session)
+        if consumptions:
+            await db.consumptions.delete_many(dependent, session=session)
+            await db.archive_consumptions.delete_many(dependent, session=session)
+        
+        dates = {record['id']: record['production_date'] for record in records}
+        balances = {material_id: material.get('current_stock', 0) for material_id, material in materials.items()}
+        events = []
+        for consumption in consumptions:
+            material_id = consumption['material_id']
+            if material_id not in balances:
+                continue  # Silinmiş hammadde
+            balances[material_id] += consumption['quantity']
+            events.append(inventory_event_doc(
+                'raw_material', material_id, consumption['quantity'], 'manufacturing_delete',
+                ('manufacturing_records', consumption['production_order_id']), dates[consumption['production_order_id']], user,
+                name=consumption.get('material_name'), balance_after=balances[material_id]
+            ))
+        for record in records:
+            events += finished_goods_events(record, None, 'manufacturing_delete', ('manufacturing_records', record['id']), user)
+        if events:
+            await db.inventory_events.insert_many(events, session=session)
+        return records, consumptions, materials, balances
+    
+    records, consumptions, materials, balances = await run_in_transaction(operations)
+    if not records:
+        return {"records": 0, "consumptions": 0, "restored": {}}
+    
+    # İade sonrası min seviyenin üstüne çıkan hammaddeler için uyarı
+    for material_id, material in materials.items():
+        now_below = balances[material_id] <= material.get('min_stock_level', 0)
+        if material.get('below_min') and not now_below:
+            await publish_stock_alert({**material, "current_stock": balances[material_id], "below_min": now_below})
+    await invalidate_stock_snapshots(min([str(r['production_date']) for r in records] + [c['created_at'] for c in consumptions]))
+    metrics.incr('manufacturing_cascade_deletes', len(records))
+    return {
+        "records": len(records),
+        "consumptions": len(consumptions),
+        "restored": {materials[m]['name']: round(balances[m] - materials[m].get('current_stock', 0), 6) for m in materials}
+    }
+
 @api_router.delete("/manufacturing/{record_id}")
 async def delete_manufacturing_record(record_id: str, current_user = Depends(get_current_user)):
     if current_user['role'] not in ['admin', 'user']:
         raise HTTPException(status_code=403, detail="Permission denied")
     
-    result = await db.manufacturing_records.delete_one({"id": record_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Record not found")
+    # Üretimde düşülen masura ve gaz stoklarını iade et, tüketim kayıtlarını da sil
+    result = await delete_manufacturing_cascade({"id": record_id}, current_user['username'])
+    if not result['records']:
+        await raise_not_found('manufacturing_records', record_id, "Record not found")
     
-    return {"message": "Record deleted successfully"}
+    return {"message": "Record deleted successfully", **result}
+
+@api_router.delete("/admin/manufacturing")
+async def delete_manufacturing_range(start: str, end: str, admin_user = Depends(get_admin_user)):
+    """Tarih aralığındaki üretim kayıtlarını bağlı tüketimleriyle sil (test verisi temizliği, Sadece Admin)"""
+    match = date_range_filter('production_date', start, end)
+    result = await delete_manufacturing_cascade(match, admin_user['username'])
+    # Arşivdeki (kapanmış dönem) kayıtlar salt okunur, silinmez
+    result['archived_skipped'] = await db.archive_manufacturing_records.count_documents(match)
+    logger.info(f"Admin {admin_user['username']} deleted {result['records']} manufacturing records between {start} and {end}")
+    return {"message": "Records deleted successfully", **result}
 
 # Stock Management Routes
+# SKU: kalınlık|en|boy|renk; sayılar sondaki sıfırlar atılmış ondalık, renk boşlukları sadeleştirilmiş küçük harf
+SKU_COLLECTIONS = ('manufacturing_records', 'shipments')
+
+def _sku_number(value) -> str:
+    text = f"{round(float(value), 3):.3f}".rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+def _sku_color(color: Optional[str]) -> str:
+    return ' '.join((color or '').replace('|', ' ').split()).casefold()
+
+@lru_cache(maxsize=4096)
+def make_sku(thickness, width, length, color: Optional[str] = None) -> str:
+    """Kanonik ürün anahtarı (2.0 / 2 / "2.00" aynı SKU'yu verir)"""
+    return '|'.join([_sku_number(thickness), _sku_number(width), _sku_number(length), _sku_color(color)])
+
+def sku_of(doc: dict) -> str:
+    """Üretim / sevkiyat belgesinin SKU'su (eski belgelerde alanlardan hesaplanır)"""
+    return doc.get('sku') or make_sku(doc['thickness_mm'], doc['width_cm'], doc['length_m'], doc.get('color_name'))
+
+def cut_sku(doc: dict) -> str:
+    """Kesim kaydının ürettiği kesilmiş ürünün SKU'su"""
+    return make_sku(doc['source_thickness_mm'], doc['cut_width_cm'], doc['cut_length_cm'] / 100, doc.get('color'))
+
+def parse_sku(sku: str) -> str:
+    parts = sku.split('|')
+    if len(parts) != 4:
+        raise HTTPException(status_code=400, detail="Invalid SKU, expected thickness|width|length|color")
+    try:
+        return make_sku(*parts)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid SKU, expected thickness|width|length|color")
+
+def sku_prefix_pattern(thickness: Optional[float] = None, width: Optional[float] = None,
+                       length: Optional[float] = None, color: Optional[str] = None) -> str:
+    """Başa sabitlenmiş SKU regex'i; verilen ilk alanlar index sınırı olarak kullanılır"""
+    parts = [
+        None if thickness is None else _sku_number(thickness),
+        None if width is None else _sku_number(width),
+        None if length is None else _sku_number(length),
+        _sku_color(color) if color else None,
+    ]
+    while parts and parts[-1] is None:
+        parts.pop()
+    pattern = '^' + r'\|'.join('[^|]*' if part is None else re.escape(part) for part in parts)
+    return pattern + ('$' if len(parts) == 4 else r'\|')
+
+async def backfill_skus():
+    """SKU alanı olmayan eski belgeleri doldur (tek seferlik)"""
+    if await db.migrations.find_one({"_id": "sku_backfill"}):
+        return
+    
+    targets = [(name, sku_of) for name in SKU_COLLECTIONS]
+    targets += [(f"archive_{name}", sku_of) for name in SKU_COLLECTIONS]
+    targets.append(('cut_production_records', cut_sku))
+    updated = 0
+    for name, compute in targets:
+        ops = []
+        async for doc in db[name].find({"sku": {"$exists": False}}):
+            try:
+                ops.append(UpdateOne({"_id": doc['_id']}, set_fields(name, {"sku": compute(doc)})))
+            except (KeyError, TypeError, ValueError):
+                continue  # Boyutları eksik bozuk kayıt
+            if len(ops) >= 1000:
+                updated += (await db[name].bulk_write(ops, ordered=False)).modified_count
+                ops = []
+        if ops:
+            updated += (await db[name].bulk_write(ops, ordered=False)).modified_count
+    
+    # Eski snapshot'lar farklı anahtar biçimiyle tutuluyordu
+    await db.stock_snapshots.delete_many({})
+    await db.migrations.update_one(
+        {"_id": "sku_backfill"},
+        {"$set": {"updated": updated, "finished_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    logger.info(f"SKU backfill finished, {updated} documents updated")
+
 class StockItem(BaseModel):
     model_config = ConfigDict(extra="ignore")
+    sku: Optional[str] = None
     thickness_mm: float
     width_cm: float
     length_m: float
@@ -1846,29 +3648,15 @@ class StockItem(BaseModel):
     total_quantity: int
     total_square_meters: float
 
-@api_router.get("/stock", response_model=List[StockItem])
-async def get_stock(current_user = Depends(get_current_user)):
-    # Get all manufacturing records
-    manufacturing = await db.manufacturing_records.find({}, {"_id": 0}).to_list(10000)
-    
-    # Get all shipments
-    shipments = await db.shipments.find({}, {"_id": 0}).to_list(10000)
-    
-    # Group by model (thickness, width, length, AND color if present)
-    stock_dict = {}
-    
+def accumulate_stock(stock_dict: dict, manufacturing: list, shipments: list) -> dict:
+    """Üretimleri ekle, sevkiyatları düş (model anahtarı bazında, yerinde günceller)"""
     # Add manufacturing (production)
     for record in manufacturing:
-        # Key includes color if present, empty string if not
-        color_key = record.get('color_name', '') or ''
-        # Normalize to float to match shipments
-        thickness = float(record['thickness_mm'])
-        width = float(record['width_cm'])
-        length = float(record['length_m'])
-        key = f"{thickness}|{width}|{length}|{color_key}"
+        key = sku_of(record)
         
         if key not in stock_dict:
             stock_dict[key] = {
+                'sku': key,
                 'thickness_mm': record['thickness_mm'],
                 'width_cm': record['width_cm'],
                 'length_m': record['length_m'],
@@ -1883,22 +3671,438 @@ async def get_stock(current_user = Depends(get_current_user)):
     
     # Subtract shipments
     for shipment in shipments:
-        color_key = shipment.get('color_name', '') or ''
-        # Normalize to float to match manufacturing
-        thickness = float(shipment['thickness_mm'])
-        width = float(shipment['width_cm'])
-        length = float(shipment['length_m'])
-        key = f"{thickness}|{width}|{length}|{color_key}"
+        key = sku_of(shipment)
         
         if key in stock_dict:
             stock_dict[key]['total_quantity'] -= shipment['quantity']
             stock_dict[key]['total_square_meters'] -= shipment['square_meters']
     
+    return stock_dict
+
+async def build_stock() -> List[dict]:
+    """Üretim - sevkiyat farkından model bazında stok"""
+    # Get all manufacturing records
+    manufacturing = await history_find(analytics_db, 'manufacturing_records', limit=10000)
+    
+    # Get all shipments
+    shipments = await history_find(analytics_db, 'shipments', limit=10000)
+    
+    # Group by model (thickness, width, length, AND color if present)
+    stock_dict = accumulate_stock({}, manufacturing, shipments)
+    
     # Filter out items with zero or negative stock
     result = [item for item in stock_dict.values() if item['total_quantity'] > 0]
     
     return result
 
+async def build_sku_stock(sku_match: dict) -> List[dict]:
+    """sku index'i üzerinden seçilen SKU'ların stoğu (üretim - sevkiyat)"""
+    async def grouped(name, extra):
+        pipeline = await history_match_stages(name, {"sku": sku_match})
+        pipeline.append({"$group": {
+            "_id": "$sku",
+            "total_quantity": {"$sum": "$quantity"},
+            "total_square_meters": {"$sum": "$square_meters"},
+            **extra
+        }})
+        return await analytics_db[name].aggregate(pipeline).to_list(None)
+    
+    produced = await grouped('manufacturing_records', {
+        field: {"$first": f"${field}"} for field in ('thickness_mm', 'width_cm', 'length_m', 'color_name', 'model')
+    })
+    shipped = {row['_id']: row for row in await grouped('shipments', {})}
+    
+    result = []
+    for row in produced:
+        out = shipped.get(row['_id'], {})
+        result.append({
+            'sku': row['_id'],
+            'thickness_mm': row['thickness_mm'],
+            'width_cm': row['width_cm'],
+            'length_m': row['length_m'],
+            'color_name': row.get('color_name'),
+            'model': row.get('model', ''),
+            'total_quantity': row['total_quantity'] - out.get('total_quantity', 0),
+            'total_square_meters': row['total_square_meters'] - out.get('total_square_meters', 0)
+        })
+    return result
+
+# Stock Snapshots (Geçmiş tarihli stok sorguları: en yakın önceki snapshot + sonraki hareketler)
+STOCK_SNAPSHOT_INTERVAL_S = int(os.environ.get('STOCK_SNAPSHOT_INTERVAL_S', '3600'))
+STOCK_SNAPSHOT_VERSION = 2  # Hesaplama değişince artar; eski snapshot'lar kullanılmaz, yeniden alınır
+
+def _next_day(date_str: str) -> str:
+    return (datetime.fromisoformat(date_str[:10]) + timedelta(days=1)).strftime('%Y-%m-%d')
+
+def _parse_as_of(as_of: str) -> str:
+    try:
+        return datetime.fromisoformat(as_of[:10]).strftime('%Y-%m-%d')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid as_of, expected YYYY-MM-DD")
+
+async def finished_goods_deltas(stock_dict: dict, after: Optional[str], until: Optional[str], source=None) -> dict:
+    """(after, until] aralığındaki üretim, kesim ve sevkiyatları stok sözlüğüne uygula"""
+    source = source if source is not None else analytics_db
+    start = _next_day(after) if after else None
+    manufacturing = await history_find(source, 'manufacturing_records', start=start, end=until)
+    shipments = await history_find(source, 'shipments', start=start, end=until)
+    
+    # Kesim, kaynak üretim kaydının quantity alanını yerinde düşürür; geçmiş için
+    # üretilen adet geri kurulur ve kesim kendi tarihinde ayrıca düşülür
+    cut_totals = {
+        row['_id']: row['pieces'] for row in await source.cut_production_records.aggregate([
+            {"$group": {"_id": "$source_production_id", "pieces": {"$sum": "$source_pieces_used"}}}
+        ]).to_list(None)
+    }
+    for record in manufacturing:
+        record['quantity'] += cut_totals.get(record['id'], 0)
+    accumulate_stock(stock_dict, manufacturing, shipments)
+    
+    cuts = await source.cut_production_records.find(
+        date_range_filter('date', start, until), {"_id": 0, "source_production_id": 1, "source_pieces_used": 1}
+    ).to_list(None)
+    if cuts:
+        sources = await history_find(
+            source, 'manufacturing_records', {"id": {"$in": list({cut['source_production_id'] for cut in cuts})}}
+        )
+        sku_by_id = {record['id']: sku_of(record) for record in sources}
+        for cut in cuts:
+            key = sku_by_id.get(cut['source_production_id'])
+            if key in stock_dict:
+                stock_dict[key]['total_quantity'] -= cut['source_pieces_used']
+    return stock_dict
+
+async def raw_material_deltas(after: Optional[str], until: Optional[str], source=None) -> dict:
+    """(after, until] aralığındaki hammadde stok değişimleri (material_id -> miktar)"""
+    source = source if source is not None else analytics_db
+    start = _next_day(after) if after else None
+    deltas = {}
+    
+    def add(material_id, quantity):
+        if material_id:
+            deltas[material_id] = deltas.get(material_id, 0) + quantity
+    
+    async def grouped(name, date_field, group_by, amount):
+        if name in ARCHIVED_COLLECTIONS:
+            stages = await history_match_stages(name, {}, start, until)
+        else:
+            stages = [{"$match": date_range_filter(date_field, start, until)}]
+        pipeline = stages + [{"$group": {"_id": group_by, "total": {"$sum": amount}}}]
+        return await source[name].aggregate(pipeline).to_list(None)
+    
+    for row in await grouped('material_entries', 'entry_date', '$material_id', '$quantity'):
+        add(row['_id'], row['total'])
+    signed_quantity = {"$cond": [{"$eq": ["$transaction_type", "in"]}, "$quantity", {"$multiply": ["$quantity", -1]}]}
+    for row in await grouped('stock_transactions', 'created_at', '$material_id', signed_quantity):
+        add(row['_id'], row['total'])
+    for row in await grouped('consumptions', 'created_at', '$material_id', '$quantity'):
+        add(row['_id'], -row['total'])
+    
+    # Günlük tüketim ve gaz kayıtları hammaddeye isimle bağlı
+    catalog = await get_material_catalog()
+    ids_by_name = {m['name']: m['id'] for m in catalog.values()}
+    daily_collection, daily_is_ts = await daily_consumption_store.reader(source)
+    daily = await daily_collection.aggregate([
+        {"$match": date_range_filter('date', start, until, as_datetime=daily_is_ts)},
+        {"$group": {
+            "_id": None,
+            "Petkim": {"$sum": "$total_petkim"},
+            "Estol": {"$sum": "$estol_quantity"},
+            "Talk": {"$sum": "$talk_quantity"}
+        }}
+    ]).to_list(1)
+    for name in ('Petkim', 'Estol', 'Talk'):
+        if daily:
+            add(ids_by_name.get(name), -daily[0][name])
+    gas_collection, gas_is_ts = await gas_consumption_store.reader(source)
+    gas = await gas_collection.aggregate([
+        {"$match": date_range_filter('date', start, until, as_datetime=gas_is_ts)},
+        {"$group": {"_id": None, "total": {"$sum": "$total_gas_kg"}}}
+    ]).to_list(1)
+    if gas:
+        add(ids_by_name.get('Gaz'), -gas[0]['total'])
+    return deltas
+
+async def build_stock_as_of(as_of: str, source=None) -> dict:
+    """Belirtilen gün sonundaki mamul ve hammadde stoğu (varsayılan: analitik okuma bağlantısı)"""
+    source = source if source is not None else analytics_db
+    snapshot = await source.stock_snapshots.find_one(
+        {"as_of": {"$lte": as_of}, "version": STOCK_SNAPSHOT_VERSION}, {"_id": 0}, sort=[("as_of", -1)]
+    )
+    snapshot_as_of = snapshot['as_of'] if snapshot else None
+    
+    base = {item['key']: {k: v for k, v in item.items() if k != 'key'} for item in snapshot['finished_goods']} if snapshot else {}
+    finished_goods = await finished_goods_deltas(base, snapshot_as_of, as_of, source)
+    
+    materials = await source.raw_materials.find(
+        {}, {"_id": 0, "id": 1, "name": 1, "unit": 1, "current_stock": 1}
+    ).to_list(1000)
+    if snapshot:
+        # Snapshot'tan ileri doğru
+        stocks = {m['id']: m['stock'] for m in snapshot['raw_materials']}
+        deltas = await raw_material_deltas(snapshot_as_of, as_of, source)
+        sign = 1
+    else:
+        # Snapshot yoksa güncel stoktan geriye doğru
+        stocks = {m['id']: m.get('current_stock', 0) for m in materials}
+        deltas = await raw_material_deltas(as_of, None, source)
+        sign = -1
+    raw_materials = [
+        {
+            'id': m['id'],
+            'name': m['name'],
+            'unit': m.get('unit'),
+            'stock': stocks.get(m['id'], 0) + sign * deltas.get(m['id'], 0)
+        }
+        for m in materials
+    ]
+    
+    return {
+        'as_of': as_of,
+        'snapshot_as_of': snapshot_as_of,
+        'finished_goods': finished_goods,
+        'raw_materials': raw_materials
+    }
+
+async def take_stock_snapshot(as_of: str) -> dict:
+    """as_of gün sonu için snapshot al (önceki snapshot + aradaki hareketler)"""
+    # Kalıcı kayıt: gecikmeli secondary yerine birincil veritabanından oku
+    state = await build_stock_as_of(as_of, source=db)
+    
+    # Hammadde: birincil veritabanındaki güncel stoktan geriye doğru (tutarlı okuma için)
+    materials = await db.raw_materials.find({}, {"_id": 0, "id": 1, "name": 1, "unit": 1, "current_stock": 1}).to_list(1000)
+    deltas = await raw_material_deltas(as_of, None, source=db)
+    
+    snapshot = {
+        "id": str(uuid.uuid4()),
+        "as_of": as_of,
+        "version": STOCK_SNAPSHOT_VERSION,
+        "finished_goods": [{'key': key, **item} for key, item in state['finished_goods'].items()],
+        "raw_materials": [
+            {'id': m['id'], 'name': m['name'], 'unit': m.get('unit'), 'stock': m.get('current_stock', 0) - deltas.get(m['id'], 0)}
+            for m in materials
+        ],
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.stock_snapshots.replace_one({"as_of": as_of}, snapshot, upsert=True)
+    return snapshot
+
+async def invalidate_stock_snapshots(date_value):
+    """Geriye dönük kayıt girildiğinde o tarihten sonraki snapshot'ları sil"""
+    date_str = date_value.isoformat() if isinstance(date_value, datetime) else str(date_value)
+    await db.stock_snapshots.delete_many({"as_of": {"$gte": date_str[:10]}})
+
+async def run_stock_snapshot_scheduler():
+    """Kapanmış her gün için bir snapshot al (lease sahibi tek worker)"""
+    while True:
+        try:
+            if not await hold_scheduler_lease('stock_snapshots', STOCK_SNAPSHOT_INTERVAL_S * 2):
+                await asyncio.sleep(STOCK_SNAPSHOT_INTERVAL_S)
+                continue
+            yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+            if not await db.stock_snapshots.find_one({"as_of": yesterday, "version": STOCK_SNAPSHOT_VERSION}, {"_id": 1}):
+                await take_stock_snapshot(yesterday)
+                logger.info(f"Stock snapshot taken for {yesterday}")
+        except Exception as e:
+            logger.warning(f"Stock snapshot failed: {e}")
+        await asyncio.sleep(STOCK_SNAPSHOT_INTERVAL_S)
+
+# Stock Reconciliation (Hammadde stoğu kaynak kayıtlardan yeniden hesaplanır)
+RECONCILE_INTERVAL_S = int(os.environ.get('RECONCILE_INTERVAL_S', '21600'))
+RECONCILE_AUTO_CORRECT = os.environ.get('RECONCILE_AUTO_CORRECT', 'false').lower() == 'true'
+
+def _negated(field: str) -> dict:
+    return {"$multiply": [{"$ifNull": [f"${field}", 0]}, -1]}
+
+async def expected_material_stock(source=None) -> Dict[str, float]:
+    """Girişler, hareketler ve tüm tüketim kaynaklarından beklenen stok (tek $unionWith/$group)"""
+    source = source if source is not None else db
+    daily_collection, _ = await daily_consumption_store.reader(source)
+    gas_collection, _ = await gas_consumption_store.reader(source)
+    
+    def union(name, project, *stages):
+        return {"$unionWith": {"coll": name, "pipeline": [*stages, {"$project": {"_id": 0, **project}}]}}
+    
+    signed_quantity = {"$cond": [{"$eq": ["$transaction_type", "in"]}, "$quantity", _negated('quantity')]}
+    pipeline = [
+        # material_id'si olmayan eski kayıtlar isimle eşleşir
+        {"$project": {"_id": 0, "material_id": 1, "material_name": 1, "amount": "$quantity"}},
+        union('stock_transactions', {"material_id": 1, "material_name": 1, "amount": signed_quantity}),
+        union('archive_stock_transactions', {"material_id": 1, "material_name": 1, "amount": signed_quantity}),
+        union('consumptions', {"material_id": 1, "material_name": 1, "amount": _negated('quantity')}),
+        union('archive_consumptions', {"material_id": 1, "material_name": 1, "amount": _negated('quantity')}),
+        # Günlük tüketim ve gaz kayıtları hammaddeye isimle bağlı
+        union(daily_collection.name, {"material_name": "$parts.name", "amount": "$parts.amount"},
+              {"$project": {"parts": [
+                  {"name": "Petkim", "amount": _negated('total_petkim')},
+                  {"name": "Estol", "amount": _negated('estol_quantity')},
+                  {"name": "Talk", "amount": _negated('talk_quantity')}
+              ]}},
+              {"$unwind": "$parts"}),
+        union(gas_collection.name, {"material_name": {"$literal": "Gaz"}, "amount": _negated('total_gas_kg')}),
+        {"$group": {"_id": {"id": "$material_id", "name": "$material_name"}, "total": {"$sum": "$amount"}}}
+    ]
+    rows = await source.material_entries.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    
+    ids_by_name = {m['name']: m['id'] async for m in source.raw_materials.find({}, {"_id": 0, "id": 1, "name": 1})}
+    expected = {}
+    for row in rows:
+        material_id = row['_id'].get('id') or ids_by_name.get(row['_id'].get('name'))
+        if material_id:
+            expected[material_id] = expected.get(material_id, 0) + row['total']
+    return expected
+
+async def reconcile_material_stock(apply: bool = False, require_confirmation: bool = False) -> dict:
+    """Saklanan current_stock ile kaynak kayıtlardan hesaplanan stoğu karşılaştır
+    
+    Yazmaları kilitlemez: düzeltme koşullu $inc ile yalnızca stok okunduğundan beri değişmediyse
+    yapılır. require_confirmation ise aynı farkın önceki çalıştırmada da görülmesi gerekir
+    (kaydı yazılmış ama stoğu henüz güncellenmemiş işlemler düzeltilmesin diye).
+    """
+    started = time.perf_counter()
+    report_id = str(uuid.uuid4())
+    expected = await expected_material_stock()
+    previous = await db.stock_reconciliations.find_one({}, {"_id": 0, "drift": 1}, sort=[("created_at", -1)])
+    previous_drift = {item['id']: item['difference'] for item in (previous or {}).get('drift', [])}
+    
+    drift = []
+    corrected = 0
+    async for material in db.raw_materials.find({}, {"_id": 0, "id": 1, "name": 1, "current_stock": 1}):
+        stored = material.get('current_stock') or 0
+        difference = round(expected.get(material['id'], 0) - stored, 6)
+        if abs(difference) <= INVENTORY_TOLERANCE:
+            continue
+        item = {"id": material['id'], "name": material['name'], "stored": stored,
+                "expected": round(expected.get(material['id'], 0), 6), "difference": difference, "corrected": False}
+        confirmed = abs(previous_drift.get(material['id'], 0) - difference) <= INVENTORY_TOLERANCE
+        if apply and (confirmed or not require_confirmation):
+            item['corrected'] = bool(await adjust_material_stock(
+                {"id": material['id'], "current_stock": material.get('current_stock')}, difference, 'reconciliation',
+                source=('stock_reconciliations', report_id), user='system'
+            ))
+            corrected += item['corrected']
+        drift.append(item)
+    
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    report = {
+        "id": report_id,
+        "materials": len(expected),
+        "drift": drift,
+        "corrected": corrected,
+        "applied": apply,
+        "duration_ms": duration_ms,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.stock_reconciliations.insert_one(dict(report))
+    metrics.observe('stock_reconciliation_ms', duration_ms)
+    metrics.incr('stock_reconciliation_drift', len(drift))
+    return report
+
+async def run_stock_reconciliation_scheduler():
+    while RECONCILE_INTERVAL_S > 0:
+        try:
+            report = await reconcile_material_stock(apply=RECONCILE_AUTO_CORRECT, require_confirmation=True)
+            if report['drift']:
+                logger.warning(f"Stock reconciliation found drift on {len(report['drift'])} materials, corrected {report['corrected']}")
+        except Exception as e:
+            logger.warning(f"Stock reconciliation failed: {e}")
+        await asyncio.sleep(RECONCILE_INTERVAL_S)
+
+@api_router.get("/stock", response_model=List[StockItem])
+async def get_stock(
+    as_of: Optional[str] = None,
+    thickness: Optional[float] = None,
+    width: Optional[float] = None,
+    length: Optional[float] = None,
+    color: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user = Depends(get_current_user)
+):
+    names = parse_fields(fields, StockItem)
+    filtered = thickness is not None or width is not None or length is not None or bool(color)
+    pattern = sku_prefix_pattern(thickness, width, length, color) if filtered else None
+    
+    async def load():
+        if as_of:
+            state = await build_stock_as_of(_parse_as_of(as_of))
+            items = [
+                item for key, item in state['finished_goods'].items()
+                if item['total_quantity'] > 0 and (pattern is None or re.match(pattern, key))
+            ]
+        elif filtered:
+            items = [item for item in await build_sku_stock({"$regex": pattern}) if item['total_quantity'] > 0]
+        else:
+            items = await build_stock()
+        if names:
+            return sparse_response(StockItem, names, items)
+        return items
+    
+    return await single_flight.run(
+        'stock', coalesce_key(as_of=as_of, pattern=pattern, fields=names), load
+    )
+
+@api_router.get("/stock/raw-materials")
+async def get_raw_material_stock(as_of: Optional[str] = None, current_user = Depends(get_current_user)):
+    """Hammadde stokları (as_of verilirse o gün sonundaki durum)"""
+    if as_of:
+        state = await build_stock_as_of(_parse_as_of(as_of))
+        return state['raw_materials']
+    materials = await analytics_db.raw_materials.find({}, {"_id": 0, "id": 1, "name": 1, "unit": 1, "current_stock": 1}).to_list(1000)
+    return [{'id': m['id'], 'name': m['name'], 'unit': m.get('unit'), 'stock': m.get('current_stock', 0)} for m in materials]
+
+@api_router.get("/stock/{sku:path}", response_model=StockItem)
+async def get_sku_stock(sku: str, current_user = Depends(get_current_user)):
+    """Tek SKU'nun stoğu (örn. 2|100|50|beyaz)"""
+    items = await build_sku_stock(parse_sku(sku))
+    if not items:
+        raise HTTPException(status_code=404, detail="SKU not found")
+    return items[0]
+
+@api_router.post("/admin/stock-snapshots")
+async def create_stock_snapshot(as_of: str, admin_user = Depends(get_admin_user)):
+    """Belirli bir gün için snapshot al (geçmişi doldurmak için, Sadece Admin)"""
+    snapshot = await take_stock_snapshot(_parse_as_of(as_of))
+    return {"as_of": snapshot['as_of'], "finished_goods": len(snapshot['finished_goods']), "raw_materials": len(snapshot['raw_materials'])}
+
+@api_router.get("/inventory/events", response_model=List[InventoryEvent])
+async def get_inventory_events(kind: Optional[str] = None, item_id: Optional[str] = None, start: Optional[str] = None,
+                               end: Optional[str] = None, current_user = Depends(get_current_user)):
+    """Stok hareket geçmişi (hammadde id'si veya SKU bazında)"""
+    match = date_range_filter('created_at', start, end)
+    if kind:
+        match['kind'] = kind
+    if item_id:
+        match['item_id'] = item_id
+    events = await db.inventory_events.find(match, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    for event in events:
+        if isinstance(event['created_at'], str):
+            event['created_at'] = datetime.fromisoformat(event['created_at'])
+    return events
+
+@api_router.get("/admin/stock-reconciliation")
+async def get_stock_reconciliations(admin_user = Depends(get_admin_user)):
+    """Son stok mutabakatı raporları (Sadece Admin)"""
+    return await db.stock_reconciliations.find({}, {"_id": 0}).sort("created_at", -1).to_list(20)
+
+@api_router.post("/admin/stock-reconciliation")
+async def run_stock_reconciliation(apply: bool = False, admin_user = Depends(get_admin_user)):
+    """Hammadde stoklarını kaynak kayıtlarla karşılaştır; apply=true ise farkları düzelt (Sadece Admin)"""
+    report = await reconcile_material_stock(apply=apply)
+    if report['corrected']:
+        logger.info(f"Admin {admin_user['username']} corrected {report['corrected']} stock balances by reconciliation")
+    return report
+
+@api_router.post("/admin/inventory/rebuild")
+async def rebuild_inventory_state(apply: bool = False, admin_user = Depends(get_admin_user)):
+    """Olay kaydından stokları yeniden hesapla; apply=true ise ürün farklarını düzelt (Sadece Admin)
+    
+    Hammadde farkları yalnızca raporlanır; düzeltme /admin/stock-reconciliation ile yapılır.
+    """
+    report = await rebuild_inventory(apply=apply)
+    if report['corrected']:
+        logger.info(f"Admin {admin_user['username']} corrected {report['corrected']} stock balances from event log")
+    return report
+
 # User management endpoints added above
 
 # Exchange Rate Management (Admin Only)
@@ -1959,6 +4163,8 @@ async def update_exchange_rates(rates: ExchangeRateUpdate, admin_user = Depends(
         upsert=True
     )
     
+    await cache_bus.invalidate('exchange_rates')
+    
     logger.info(f"Admin {admin_user['username']} updated exchange rates: USD={rates.usd_rate}, EUR={rates.eur_rate}")
     
     return {
@@ -1967,23 +4173,1439 @@ async def update_exchange_rates(rates: ExchangeRateUpdate, admin_user = Depends(
         "EUR": rates.eur_rate
     }
 
+# Background Jobs (Uzun süren raporlar)
+JOB_MAX_CONCURRENCY = int(os.environ.get('JOB_MAX_CONCURRENCY', '2'))
+JOB_PROCESS_WORKERS = int(os.environ.get('JOB_PROCESS_WORKERS', '2'))
+JOB_RESULT_TTL_HOURS = int(os.environ.get('JOB_RESULT_TTL_HOURS', '24'))
+JOB_CLEANUP_INTERVAL_S = int(os.environ.get('JOB_CLEANUP_INTERVAL_S', '3600'))
+JOB_LEASE_S = int(os.environ.get('JOB_LEASE_S', '60'))  # Sahibi bu sürede yenilemezse iş başka worker'a geçer
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class Job(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    report: str
+    format: str
+    params: dict = {}
+    status: JobStatus = JobStatus.QUEUED
+    progress: float = 0
+    message: Optional[str] = None
+    result_file_id: Optional[str] = None
+    result_size: Optional[int] = None
+    error: Optional[str] = None
+    created_by: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: datetime
+
+class JobCreate(BaseModel):
+    report: str
+    format: str = "json"
+    params: dict = {}
+
+def _report_rows(data) -> list:
+    if isinstance(data, BaseModel):
+        data = data.model_dump()
+    return data if isinstance(data, list) else [data]
+
+def render_report_json(data) -> bytes:
+    return json.dumps(_report_rows(data), default=str, ensure_ascii=False).encode('utf-8')
+
+def render_report_csv(data) -> bytes:
+    import pandas as pd
+    # Excel'in Türkçe karakterleri doğru açması için BOM'lu UTF-8
+    return pd.DataFrame(_report_rows(data)).to_csv(index=False).encode('utf-8-sig')
+
+# Rapor adı -> veri üreten async fonksiyon (I/O ağırlıklı, event loop üzerinde çalışır)
+JOB_REPORTS = {
+    'cost-analysis': lambda params: build_cost_analysis(),
+    'production-cost-analysis': lambda params: build_production_cost_analysis(
+        params.get('start'), params.get('end'), limit=None
+    ),
+    'dashboard': lambda params: build_dashboard_stats(),
+    'stock': lambda params: build_stock(),
+}
+
+# Format -> (render fonksiyonu, media type, dosya uzantısı, process pool'da mı)
+JOB_FORMATS = {
+    'json': (render_report_json, 'application/json', 'json', False),
+    'csv': (render_report_csv, 'text/csv; charset=utf-8', 'csv', True),
+}
+
+_job_slots = asyncio.Semaphore(JOB_MAX_CONCURRENCY)
+_process_pool = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """CPU ağırlıklı işler (pandas vb.) için paylaşılan process pool"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=JOB_PROCESS_WORKERS, initializer=_init_pool_worker)
+    return _process_pool
+
+def _init_pool_worker():
+    # Rapor şablonlarını her worker süreci açılışta bir kez hazırlasın
+    try:
+        _xlsx_template()
+        _pdf_template()
+    except ImportError:
+        pass
+
+def job_results_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name='job_results')
+
+async def _update_job(job_id: str, **fields):
+    for key in ('started_at', 'finished_at'):
+        if isinstance(fields.get(key), datetime):
+            fields[key] = fields[key].isoformat()
+    await db.jobs.update_one({"id": job_id}, {"$set": fields})
+
+def job_lease_until() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_S)
+
+async def renew_job_lease(job_id: str):
+    """İş bu worker'da beklediği/çalıştığı sürece lease'i yenile"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_S / 3)
+        try:
+            await db.jobs.update_one({"id": job_id, "owner": WORKER_ID}, {"$set": {"lease_until": job_lease_until()}})
+        except Exception as e:
+            logger.warning(f"Job {job_id} lease renewal failed: {e}")
+
+async def run_job(job: Job):
+    """Raporu üret, formatla ve sonucu GridFS'e yaz"""
+    heartbeat = asyncio.ensure_future(renew_job_lease(job.id))
+    try:
+        await _run_job(job)
+    finally:
+        heartbeat.cancel()
+
+async def _run_job(job: Job):
+    async with _job_slots:
+        await _update_job(job.id, status=JobStatus.RUNNING, progress=0.1, message="Veri hazırlanıyor", started_at=datetime.now(timezone.utc))
+        try:
+            data = await JOB_REPORTS[job.report](job.params)
+            await _update_job(job.id, progress=0.6, message="Dosya oluşturuluyor")
+            
+            renderer, media_type, extension, use_process_pool = JOB_FORMATS[job.format]
+            loop = asyncio.get_running_loop()
+            if use_process_pool:
+                payload = await loop.run_in_executor(get_process_pool(), renderer, _report_rows(data))
+            else:
+                payload = await asyncio.to_thread(renderer, data)
+            await _update_job(job.id, progress=0.9, message="Sonuç kaydediliyor")
+            
+            file_id = await job_results_bucket().upload_from_stream(
+                f"{job.report}-{job.id}.{extension}",
+                payload,
+                metadata={"job_id": job.id, "content_type": media_type, "expires_at": job.expires_at}
+            )
+            await _update_job(
+                job.id, status=JobStatus.COMPLETED, progress=1.0, message=None,
+                result_file_id=str(file_id), result_size=len(payload), finished_at=datetime.now(timezone.utc)
+            )
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.report}) failed")
+            await _update_job(job.id, status=JobStatus.FAILED, message=None, error=str(e), finished_at=datetime.now(timezone.utc))
+
+async def recover_interrupted_jobs() -> int:
+    """Lease'i dolmuş queued/running işleri (sahibi kapanmış/çökmüş) devral ve yeniden kuyruğa al"""
+    recovered = 0
+    while True:
+        # Koşul ve sahiplik tek atomik güncellemede: canlı bir worker'ın işi alınmaz, iki worker aynı işi almaz
+        doc = await db.jobs.find_one_and_update(
+            {
+                "status": {"$in": [JobStatus.QUEUED.value, JobStatus.RUNNING.value]},
+                "$or": [{"lease_until": {"$lt": datetime.now(timezone.utc)}}, {"lease_until": {"$exists": False}}]
+            },
+            {
+                "$set": {"owner": WORKER_ID, "lease_until": job_lease_until(), "status": JobStatus.QUEUED.value,
+                         "progress": 0, "message": "Yeniden kuyruğa alındı"},
+                "$inc": {"attempts": 1}
+            },
+            projection={"_id": 0}
+        )
+        if doc is None:
+            return recovered
+        recovered += 1
+        attempts = doc.get('attempts', 0) + 1
+        if attempts > JOB_MAX_ATTEMPTS:
+            logger.warning(f"Job {doc['id']} ({doc['report']}) interrupted {attempts - 1} times, giving up")
+            await _update_job(
+                doc['id'], status=JobStatus.FAILED, message=None,
+                error="Job was interrupted by a server restart too many times", finished_at=datetime.now(timezone.utc)
+            )
+        else:
+            logger.info(f"Re-queueing interrupted job {doc['id']} ({doc['report']}), attempt {attempts}")
+            spawn_background(run_job(Job(**doc)))
+
+async def run_job_recovery_scheduler():
+    while True:
+        try:
+            await recover_interrupted_jobs()
+        except Exception as e:
+            logger.warning(f"Job recovery failed: {e}")
+        await asyncio.sleep(JOB_LEASE_S)
+
+async def cleanup_expired_job_results():
+    """Süresi dolan GridFS sonuçlarını periyodik olarak sil (jobs kayıtları TTL index ile silinir)"""
+    while True:
+        try:
+            bucket = job_results_bucket()
+            cursor = db['job_results.files'].find(
+                {"metadata.expires_at": {"$lt": datetime.now(timezone.utc)}}, {"_id": 1}
+            )
+            async for file_doc in cursor:
+                await bucket.delete(file_doc['_id'])
+        except Exception as e:
+            logger.warning(f"Job result cleanup failed: {e}")
+        await asyncio.sleep(JOB_CLEANUP_INTERVAL_S)
+
+async def get_job_doc(job_id: str, current_user) -> dict:
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['created_by'] != current_user['username'] and not is_admin(current_user):
+        raise HTTPException(status_code=403, detail="Permission denied")
+    return job
+
+@api_router.post("/jobs", response_model=Job, status_code=202)
+async def create_job(job_data: JobCreate, current_user = Depends(get_current_user)):
+    """Uzun süren rapor işini kuyruğa ekle"""
+    if job_data.report not in JOB_REPORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown report, expected one of: {', '.join(JOB_REPORTS)}")
+    if job_data.format not in JOB_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, expected one of: {', '.join(JOB_FORMATS)}")
+    
+    job = Job(
+        **job_data.model_dump(),
+        created_by=current_user['username'],
+        expires_at=datetime.now(timezone.utc) + timedelta(hours=JOB_RESULT_TTL_HOURS)
+    )
+    
+    doc = job.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    # Lease: bu worker kapanırsa iş recover_interrupted_jobs ile devralınır
+    doc.update(owner=WORKER_ID, lease_until=job_lease_until(), attempts=1)
+    # TTL index için BSON tarih olarak saklanır
+    await db.jobs.insert_one(doc)
+    
+    spawn_background(run_job(job))
+    return job
+
+@api_router.get("/jobs", response_model=List[Job])
+async def get_jobs(current_user = Depends(get_current_user)):
+    query = {} if is_admin(current_user) else {"created_by": current_user['username']}
+    return await db.jobs.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str, current_user = Depends(get_current_user)):
+    return await get_job_doc(job_id, current_user)
+
+@api_router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, current_user = Depends(get_current_user)):
+    """İş durumunu Server-Sent Events olarak akıt (iş tamamlanınca kapanır)"""
+    await get_job_doc(job_id, current_user)
+    
+    async def events():
+        last = None
+        while True:
+            job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+            if job is None:
+                break
+            payload = Job(**job).model_dump_json()
+            if payload != last:
+                last = payload
+                yield f"event: status\ndata: {payload}\n\n"
+            if job['status'] in (JobStatus.COMPLETED, JobStatus.FAILED):
+                break
+            await asyncio.sleep(1)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@api_router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, current_user = Depends(get_current_user)):
+    """Tamamlanan işin sonucunu GridFS'den akıt"""
+    job = await get_job_doc(job_id, current_user)
+    if job['status'] != JobStatus.COMPLETED or not job.get('result_file_id'):
+        raise HTTPException(status_code=409, detail="Job result not ready")
+    
+    try:
+        stream = await job_results_bucket().open_download_stream(ObjectId(job['result_file_id']))
+    except NoFile:
+        raise HTTPException(status_code=410, detail="Job result expired")
+    
+    async def chunks():
+        while True:
+            chunk = await stream.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    
+    return StreamingResponse(
+        chunks(),
+        media_type=stream.metadata.get('content_type', 'application/octet-stream'),
+        headers={"Content-Disposition": f'attachment; filename="{stream.filename}"'}
+    )
+
+# Downloadable Reports (Excel / PDF)
+REPORT_PDF_FONT = os.environ.get('REPORT_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+REPORT_PDF_FONT_BOLD = os.environ.get('REPORT_PDF_FONT_BOLD', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf')
+
+@lru_cache(maxsize=None)
+def _xlsx_template() -> dict:
+    from openpyxl.styles import Font, PatternFill
+    return {
+        'title': Font(bold=True, size=14),
+        'header': Font(bold=True, color='FFFFFF'),
+        'header_fill': PatternFill('solid', fgColor='4F46E5'),
+        'label': Font(bold=True),
+    }
+
+@lru_cache(maxsize=None)
+def _pdf_template() -> dict:
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    
+    # Standart Helvetica Türkçe karakterleri (ş, ğ, ı) içermez; varsa TTF font kullan
+    font, bold = 'Helvetica', 'Helvetica-Bold'
+    if os.path.exists(REPORT_PDF_FONT):
+        pdfmetrics.registerFont(TTFont('ReportFont', REPORT_PDF_FONT))
+        font = bold = 'ReportFont'
+        if os.path.exists(REPORT_PDF_FONT_BOLD):
+            pdfmetrics.registerFont(TTFont('ReportFont-Bold', REPORT_PDF_FONT_BOLD))
+            bold = 'ReportFont-Bold'
+    
+    styles = getSampleStyleSheet()
+    for style in styles.byName.values():
+        style.fontName = bold if style.name.startswith(('Heading', 'Title')) else font
+    return {
+        'styles': styles,
+        'table_style': [
+            ('FONTNAME', (0, 0), (-1, -1), font),
+            ('FONTNAME', (0, 0), (-1, 0), bold),
+            ('FONTSIZE', (0, 0), (-1, -1), 7),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#4F46E5')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#F3F4F6')]),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#D1D5DB')),
+            ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+        ],
+    }
+
+def render_report_xlsx(document: dict) -> bytes:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    
+    template = _xlsx_template()
+    workbook = Workbook(write_only=True)
+    
+    summary = workbook.create_sheet('Özet')
+    title = WriteOnlyCell(summary, value=document['title'])
+    title.font = template['title']
+    summary.append([title])
+    summary.append([document.get('subtitle', '')])
+    summary.append([])
+    for label, value in document.get('summary', []):
+        label_cell = WriteOnlyCell(summary, value=label)
+        label_cell.font = template['label']
+        summary.append([label_cell, value])
+    
+    for table in document.get('tables', []):
+        sheet = workbook.create_sheet(table['title'][:31])
+        header = []
+        for column in table['columns']:
+            cell = WriteOnlyCell(sheet, value=column)
+            cell.font = template['header']
+            cell.fill = template['header_fill']
+            header.append(cell)
+        sheet.append(header)
+        for row in table['rows']:
+            sheet.append(row)
+    
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def render_report_pdf(document: dict) -> bytes:
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    
+    template = _pdf_template()
+    styles = template['styles']
+    wide = any(len(table['columns']) > 8 for table in document.get('tables', []))
+    
+    buffer = io.BytesIO()
+    pdf = SimpleDocTemplate(
+        buffer, pagesize=landscape(A4) if wide else A4,
+        leftMargin=10 * mm, rightMargin=10 * mm, topMargin=12 * mm, bottomMargin=12 * mm,
+        title=document['title']
+    )
+    
+    def fmt(value):
+        if isinstance(value, float):
+            return f"{value:,.2f}"
+        return '' if value is None else str(value)
+    
+    story = [Paragraph(document['title'], styles['Title'])]
+    if document.get('subtitle'):
+        story.append(Paragraph(document['subtitle'], styles['Heading3']))
+    for label, value in document.get('summary', []):
+        story.append(Paragraph(f"<b>{label}:</b> {fmt(value)}", styles['Normal']))
+    for table in document.get('tables', []):
+        story.append(Spacer(1, 6 * mm))
+        story.append(Paragraph(table['title'], styles['Heading2']))
+        data = [table['columns']] + [[fmt(value) for value in row] for row in table['rows']]
+        pdf_table = Table(data, repeatRows=1)
+        pdf_table.setStyle(TableStyle(template['table_style']))
+        story.append(pdf_table)
+    
+    pdf.build(story)
+    return buffer.getvalue()
+
+def _render_in_worker(renderer, document: dict, submitted_at: float):
+    """Process pool içinde çalışır; kuyruk bekleme ve render sürelerini de döndürür"""
+    started_at = time.time()
+    payload = renderer(document)
+    return payload, started_at - submitted_at, time.time() - started_at
+
+REPORT_FORMATS = {
+    'xlsx': (render_report_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'pdf': (render_report_pdf, 'application/pdf'),
+}
+
+PRODUCTION_COST_COLUMNS = [
+    ('row_number', '#'), ('date', 'Tarih'), ('machine', 'Makine'),
+    ('thickness_mm', 'Kalınlık (mm)'), ('width_cm', 'En (cm)'), ('length_m', 'Metre'),
+    ('quantity', 'Adet'), ('square_meters', 'm²'),
+    ('allocated_petkim', 'Petkim (kg)'), ('allocated_estol', 'Estol (kg)'),
+    ('allocated_talk', 'Talk (kg)'), ('gas_share', 'Gaz (kg)'),
+    ('masura_type', 'Masura Tipi'), ('masura_quantity', 'Masura Adet'),
+    ('petkim_cost', 'Petkim (TL)'), ('estol_cost', 'Estol (TL)'), ('talk_cost', 'Talk (TL)'),
+    ('gas_cost', 'Gaz (TL)'), ('masura_cost', 'Masura (TL)'), ('total_cost', 'Toplam (TL)'),
+    ('cost_per_sqm', 'TL/m²'), ('cost_per_unit', 'TL/Adet'),
+]
+
+async def build_monthly_report_document(year: Optional[int] = None, month: Optional[int] = None) -> dict:
+    """Raporlar sayfasındaki aylık özetin sunucu tarafı karşılığı"""
+    start = end = None
+    period = 'Tüm Veriler'
+    if year and month:
+        start = f"{year:04d}-{month:02d}-01"
+        next_month = datetime(year + month // 12, month % 12 + 1, 1)
+        end = (next_month - timedelta(days=1)).strftime('%Y-%m-%d')
+        period = f"{month:02d}/{year}"
+    
+    async def totals(collection, date_field, fields, is_ts=False):
+        if collection.name in ARCHIVED_COLLECTIONS:
+            stages = await history_match_stages(collection.name, {}, start, end)
+        else:
+            stages = [{"$match": date_range_filter(date_field, start, end, as_datetime=is_ts)}]
+        pipeline = stages + [{"$group": {"_id": None, **{f: {"$sum": f"${f}"} for f in fields}}}]
+        result = await collection.aggregate(pipeline).to_list(1)
+        return result[0] if result else {f: 0 for f in fields}
+    
+    production = await totals(analytics_db.manufacturing_records, 'production_date', ['quantity', 'square_meters'])
+    daily_collection, daily_is_ts = await daily_consumption_store.reader(analytics_db)
+    consumption = await totals(daily_collection, 'date', ['total_petkim'], daily_is_ts)
+    shipment = await totals(analytics_db.shipments, 'shipment_date', ['quantity', 'square_meters'])
+    materials = await analytics_db.raw_materials.find(
+        {}, {"_id": 0, "name": 1, "unit": 1, "current_stock": 1, "min_stock_level": 1}
+    ).to_list(1000)
+    low_stock = sum(1 for m in materials if m.get('current_stock', 0) <= m.get('min_stock_level', 0))
+    
+    return {
+        'title': 'SAR - Aylık Rapor',
+        'subtitle': f"Dönem: {period}",
+        'summary': [
+            ('Toplam Üretim (adet)', production['quantity']),
+            ('Toplam Üretim (m²)', float(production['square_meters'])),
+            ('Toplam Tüketim (kg)', float(consumption['total_petkim'])),
+            ('Toplam Sevkiyat (adet)', shipment['quantity']),
+            ('Toplam Sevkiyat (m²)', float(shipment['square_meters'])),
+            ('Düşük Stoklu Hammadde', low_stock),
+        ],
+        'tables': [{
+            'title': 'Hammadde Stok Durumu',
+            'columns': ['Hammadde', 'Stok', 'Min. Stok', 'Birim'],
+            'rows': [
+                [m['name'], float(m.get('current_stock', 0)), float(m.get('min_stock_level', 0)), m.get('unit', '')]
+                for m in materials
+            ],
+        }],
+    }
+
+async def build_production_cost_document(start: Optional[str] = None, end: Optional[str] = None) -> dict:
+    rows = await build_production_cost_analysis(start, end, limit=None)
+    total_cost = sum(r['total_cost'] for r in rows)
+    total_sqm = sum(r['square_meters'] for r in rows)
+    period = f"{start or '...'} - {end or '...'}" if start or end else 'Tüm Veriler'
+    return {
+        'title': 'SAR - Üretim Maliyet Analizi',
+        'subtitle': f"Dönem: {period}",
+        'summary': [
+            ('Üretim Kaydı', len(rows)),
+            ('Toplam m²', float(total_sqm)),
+            ('Toplam Maliyet (TL)', float(total_cost)),
+            ('Ortalama TL/m²', float(total_cost / total_sqm) if total_sqm else 0.0),
+        ],
+        'tables': [{
+            'title': 'Üretim Maliyetleri',
+            'columns': [header for _, header in PRODUCTION_COST_COLUMNS],
+            'rows': [[r.get(key) for key, _ in PRODUCTION_COST_COLUMNS] for r in rows],
+        }],
+    }
+
+@api_router.get("/reports/{name}.{fmt}")
+async def download_report(
+    name: str,
+    fmt: str,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    current_user = Depends(get_current_user)
+):
+    """Raporu Excel veya PDF olarak indir (render process pool'da yapılır)"""
+    if fmt not in REPORT_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown report format")
+    if name == 'monthly':
+        document = await build_monthly_report_document(year, month)
+    elif name == 'production-cost-analysis':
+        document = await build_production_cost_document(start, end)
+    else:
+        raise HTTPException(status_code=404, detail="Unknown report")
+    
+    renderer, media_type = REPORT_FORMATS[fmt]
+    loop = asyncio.get_running_loop()
+    payload, queue_wait_s, render_s = await loop.run_in_executor(
+        get_process_pool(), _render_in_worker, renderer, document, time.time()
+    )
+    metrics.observe(f"report_queue_wait_ms.{fmt}", queue_wait_s * 1000)
+    metrics.observe(f"report_render_ms.{name}.{fmt}", render_s * 1000)
+    metrics.incr(f"report_bytes.{fmt}", len(payload))
+    
+    def chunks(size: int = 64 * 1024):
+        for offset in range(0, len(payload), size):
+            yield payload[offset:offset + size]
+    
+    return StreamingResponse(
+        chunks(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="sar-{name}.{fmt}"'}
+    )
+
+# Parquet Export (Analiz için sütunlu dışa aktarım)
+PARQUET_EXPORT_DIR = Path(os.environ.get('PARQUET_EXPORT_DIR', str(ROOT_DIR / 'exports')))
+PARQUET_CHUNK_ROWS = int(os.environ.get('PARQUET_CHUNK_ROWS', '10000'))
+
+# Koleksiyon -> (şema modeli, artımlı mı)
+# Artımlı koleksiyonlar created_at gününe göre bölümlenir (<koleksiyon>/created_date=YYYY-MM-DD/part-N.parquet),
+# diğerleri (güncellenen ana veriler) her seferinde tek dosya olarak yeniden yazılır
+PARQUET_DATASETS = {
+    'users': (User, False),
+    'raw_materials': (RawMaterial, False),
+    'products': (Product, False),
+    'exchange_rates': (ExchangeRate, False),
+    'production_orders': (ProductionOrder, False),
+    'stock_transactions': (StockTransaction, True),
+    'consumptions': (Consumption, True),
+    'daily_consumptions': (DailyConsumption, True),
+    'daily_gas_consumption': (DailyGasConsumption, True),
+    'material_entries': (MaterialEntry, True),
+    'manufacturing_records': (ManufacturingRecord, True),
+    'cut_production_records': (CutProductionRecord, True),
+    'shipments': (Shipment, True),
+    'inventory_events': (InventoryEvent, True),
+}
+
+_parquet_export_lock = asyncio.Lock()
+
+def parquet_dataset_names() -> List[str]:
+    # Arşivlenen koleksiyonlar sıcak + archive_<koleksiyon> birlikte tek veri setine yazılır;
+    # kayıt arşive taşındığında daha önce yazılmış bölümü değişmez, iki kez görünmez
+    return list(PARQUET_DATASETS)
+
+def _arrow_type(annotation):
+    import pyarrow as pa
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        annotation = args[0] if len(args) == 1 else str
+    if annotation is datetime:
+        return pa.timestamp('us', tz='UTC')
+    if annotation is bool:
+        return pa.bool_()
+    if annotation is int:
+        return pa.int64()
+    if annotation is float:
+        return pa.float64()
+    return pa.string()
+
+def parquet_schema(model):
+    """Pydantic modelinden açık Arrow şeması (tarihler timestamp, sayılar float64/int64)"""
+    import pyarrow as pa
+    return pa.schema([pa.field(name, _arrow_type(field.annotation)) for name, field in model.model_fields.items()])
+
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def _arrow_converter(arrow_type):
+    import pyarrow as pa
+    if pa.types.is_timestamp(arrow_type):
+        convert = _parse_timestamp
+    elif pa.types.is_boolean(arrow_type):
+        convert = bool
+    elif pa.types.is_integer(arrow_type):
+        convert = lambda v: int(float(v))
+    elif pa.types.is_floating(arrow_type):
+        convert = float
+    else:
+        convert = lambda v: v if isinstance(v, str) else json.dumps(v, default=str)
+    
+    def safe(value):
+        if value is None:
+            return None
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return None  # Bozuk eski kayıtlar export'u durdurmasın
+    return safe
+
+def _to_record_batch(rows: list, schema):
+    import pyarrow as pa
+    columns = {}
+    for field in schema:
+        convert = _arrow_converter(field.type)
+        columns[field.name] = [convert(row.get(field.name)) for row in rows]
+    return pa.RecordBatch.from_pydict(columns, schema=schema)
+
+def _partition_day(value) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, str) and len(value) >= 10:
+        return value[:10]
+    return 'unknown'
+
+async def _parquet_source(name: str):
+    store = TIMESERIES_STORES.get(name)
+    if store is not None:
+        collection, _ = await store.reader(analytics_db)
+        return collection
+    return analytics_db[name]
+
+async def _parquet_documents(name: str, query: dict, sort: bool):
+    """Sıcak koleksiyon, ardından (varsa) arşivi; taşıma sırasında iki yerde birden görülen kayıt bir kez yazılır"""
+    sources = [await _parquet_source(name)]
+    if name in ARCHIVED_COLLECTIONS:
+        sources.append(analytics_db[f"archive_{name}"])
+    seen = set()
+    for index, collection in enumerate(sources):
+        cursor = collection.find(query, {"_id": 0}, batch_size=PARQUET_CHUNK_ROWS)
+        if sort:
+            cursor = cursor.sort("created_at", 1)
+        async for doc in cursor:
+            if len(sources) > 1:
+                if index == 0:
+                    seen.add(doc.get('id'))
+                elif doc.get('id') in seen:
+                    continue
+            yield doc
+
+async def _drop_legacy_archive_exports(out_dir: Path):
+    """Eski ayrı archive_<koleksiyon> veri setleri artık sıcak veri setiyle çakışır"""
+    for name in ARCHIVED_COLLECTIONS:
+        await asyncio.to_thread(shutil.rmtree, out_dir / f"archive_{name}", True)
+    await db.parquet_exports.delete_many({"_id": {"$in": [f"archive_{name}" for name in ARCHIVED_COLLECTIONS]}})
+
+async def export_parquet_dataset(name: str, full: bool = False, out_dir: Optional[Path] = None) -> dict:
+    """Koleksiyonu cursor'dan parça parça okuyup Parquet'e yaz.
+    
+    Artımlı modda son yazılan günden itibaren (o gün dahil) yeniden yazılır; eski günlerdeki
+    güncelleme/silmeler için full=True ile tam export alınmalıdır.
+    """
+    import pyarrow.parquet as pq
+    
+    model, incremental = PARQUET_DATASETS[name]
+    schema = parquet_schema(model).with_metadata({'collection': name})
+    target = (out_dir or PARQUET_EXPORT_DIR) / name
+    started = time.perf_counter()
+    
+    state = await db.parquet_exports.find_one({"_id": name}) or {}
+    since = state.get('last_day') if incremental and not full else None
+    if incremental and full:
+        await asyncio.to_thread(shutil.rmtree, target, True)
+    await asyncio.to_thread(target.mkdir, parents=True, exist_ok=True)
+    
+    query = {"created_at": {"$gte": since}} if since else {}
+    cursor = _parquet_documents(name, query, sort=incremental)
+    
+    written = {}  # partition dizini -> bu çalıştırmada yazılan dosyalar
+    writer = None
+    current = None
+    pending = None  # (geçici dosya, son dosya)
+    rows = []
+    total = 0
+    last_day = since
+    
+    async def close_writer():
+        nonlocal writer, pending
+        if writer is not None:
+            await asyncio.to_thread(writer.close)
+            await asyncio.to_thread(os.replace, *pending)
+            writer = pending = None
+    
+    async def flush():
+        nonlocal writer, pending
+        if not rows:
+            return
+        if writer is None:
+            directory = target / f"created_date={current}" if incremental else target
+            await asyncio.to_thread(directory.mkdir, exist_ok=True)
+            parts = written.setdefault(directory, [])
+            final = directory / (f"part-{len(parts)}.parquet" if incremental else "snapshot.parquet")
+            parts.append(final.name)
+            # Nokta ile başlayan dosyaları Parquet okuyucuları yok sayar; bitince yerine taşınır
+            pending = (directory / f".{final.name}.tmp", final)
+            writer = await asyncio.to_thread(pq.ParquetWriter, str(pending[0]), schema, compression='zstd')
+        batch = await asyncio.to_thread(_to_record_batch, rows, schema)
+        await asyncio.to_thread(writer.write_batch, batch)
+        rows.clear()
+    
+    try:
+        async for doc in cursor:
+            day = _partition_day(doc.get('created_at')) if incremental else None
+            if day != current:
+                await flush()
+                await close_writer()
+                current = day
+                if day != 'unknown' and (last_day is None or day > last_day):
+                    last_day = day
+            rows.append(doc)
+            total += 1
+            if len(rows) >= PARQUET_CHUNK_ROWS:
+                await flush()
+        await flush()
+        await close_writer()
+    finally:
+        if writer is not None:
+            await asyncio.to_thread(writer.close)
+            await asyncio.to_thread(Path(pending[0]).unlink, True)
+    
+    # Yeniden yazılan günlerde önceki çalıştırmalardan kalan fazla parçaları temizle
+    for directory, names in written.items():
+        for stale in directory.glob("part-*.parquet"):
+            if stale.name not in names:
+                await asyncio.to_thread(stale.unlink, True)
+    
+    if not incremental and total == 0:
+        await asyncio.to_thread((target / "snapshot.parquet").unlink, True)
+    
+    duration_ms = (time.perf_counter() - started) * 1000
+    metrics.observe('parquet_export_ms', duration_ms)
+    metrics.incr('parquet_export_rows', total)
+    result = {
+        "dataset": name,
+        "rows": total,
+        "partitions": len(written),
+        "last_day": last_day,
+        "mode": "full" if full or not incremental else "incremental",
+        "duration_ms": round(duration_ms, 1),
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.parquet_exports.update_one({"_id": name}, {"$set": result}, upsert=True)
+    return result
+
+async def export_parquet_all(full: bool = False, out_dir: Optional[Path] = None) -> List[dict]:
+    """Tüm koleksiyonları sırayla dışa aktar (aynı anda tek export)"""
+    async with _parquet_export_lock:
+        await _drop_legacy_archive_exports(out_dir or PARQUET_EXPORT_DIR)
+        results = []
+        for name in parquet_dataset_names():
+            try:
+                results.append(await export_parquet_dataset(name, full=full, out_dir=out_dir))
+            except Exception as e:
+                logger.exception(f"Parquet export failed for {name}")
+                results.append({"dataset": name, "error": str(e)})
+        return results
+
+@api_router.get("/admin/exports/parquet")
+async def get_parquet_exports(admin_user = Depends(get_admin_user)):
+    """Son Parquet export durumları (Sadece Admin)"""
+    return {
+        "running": _parquet_export_lock.locked(),
+        "directory": str(PARQUET_EXPORT_DIR),
+        "datasets": await db.parquet_exports.find({}).to_list(100)
+    }
+
+@api_router.post("/admin/exports/parquet", status_code=202)
+async def start_parquet_export(full: bool = False, admin_user = Depends(get_admin_user)):
+    """Tüm koleksiyonları Parquet olarak dışa aktar (Sadece Admin)"""
+    if _parquet_export_lock.locked():
+        raise HTTPException(status_code=409, detail="Parquet export already running")
+    
+    spawn_background(export_parquet_all(full=full))
+    logger.info(f"Admin {admin_user['username']} started {'full' if full else 'incremental'} Parquet export")
+    return {"message": "Parquet export started", "directory": str(PARQUET_EXPORT_DIR), "full": full}
+
+@api_router.get("/admin/metrics")
+async def get_metrics(admin_user = Depends(get_admin_user)):
+    """Süreç içi performans metrikleri (Sadece Admin)"""
+    return metrics.snapshot()
+
+# Admin: Archival
+@api_router.get("/admin/archive")
+async def get_archive_state(admin_user = Depends(get_admin_user)):
+    """Koleksiyon bazında arşiv sınırı ve kayıt sayıları (Sadece Admin)"""
+    result = []
+    for name in ARCHIVED_COLLECTIONS:
+        result.append({
+            "collection": name,
+            "archived_before": await archived_before(name),
+            "hot_count": await db[name].estimated_document_count(),
+            "archived_count": await db[f"archive_{name}"].estimated_document_count()
+        })
+    return result
+
+@api_router.post("/admin/archive/run", status_code=202)
+async def run_archive(admin_user = Depends(get_admin_user)):
+    """Kapanmış ayları şimdi arşive taşı (Sadece Admin)"""
+    if ARCHIVE_AFTER_MONTHS <= 0:
+        raise HTTPException(status_code=400, detail="Archiving is disabled (ARCHIVE_AFTER_MONTHS=0)")
+    
+    async def run():
+        for name in ARCHIVED_COLLECTIONS:
+            await archive_closed_months(name)
+    
+    spawn_background(run())
+    return {"message": "Archiving started", "cutoff": archive_cutoff_month()}
+
+# Admin: Time-Series Migration
+@api_router.get("/admin/migrations")
+async def get_migrations(admin_user = Depends(get_admin_user)):
+    """Migration durumlarını listele (Sadece Admin)"""
+    return await db.migrations.find({}).to_list(100)
+
+def get_timeseries_store(name: str) -> TimeSeriesStore:
+    store = TIMESERIES_STORES.get(name)
+    if store is None:
+        raise HTTPException(status_code=404, detail=f"Unknown collection, expected one of: {', '.join(TIMESERIES_STORES)}")
+    return store
+
+@api_router.post("/admin/migrations/timeseries/{name}", status_code=202)
+async def start_timeseries_migration(name: str, admin_user = Depends(get_admin_user)):
+    """Günlük tüketim / gaz koleksiyonunu time-series koleksiyona taşı (Sadece Admin)"""
+    store = get_timeseries_store(name)
+    if await store.route() != 'legacy':
+        raise HTTPException(status_code=409, detail="Migration already started")
+    
+    spawn_background(run_timeseries_migration(store))
+    logger.info(f"Admin {admin_user['username']} started time-series migration for {name}")
+    return {"message": "Migration started", "collection": name, "target": store.target}
+
+@api_router.post("/admin/migrations/timeseries/{name}/confirm")
+async def confirm_timeseries_migration(name: str, admin_user = Depends(get_admin_user)):
+    """Doğrulanan migration'ı kesinleştir, eski koleksiyona yazmayı bırak (Sadece Admin)"""
+    store = get_timeseries_store(name)
+    if await store.route() != 'verifying':
+        raise HTTPException(status_code=409, detail="Migration is not awaiting confirmation")
+    await store.confirm()
+    logger.info(f"Admin {admin_user['username']} confirmed time-series migration for {name}")
+    return {"message": "Migration confirmed", "collection": name}
+
+@api_router.post("/admin/migrations/timeseries/{name}/rollback", status_code=202)
+async def rollback_timeseries_migration(name: str, admin_user = Depends(get_admin_user)):
+    """Onaylanmamış migration'ı geri al, eski koleksiyona dön (Sadece Admin)"""
+    store = get_timeseries_store(name)
+    route = await store.route()
+    migration = await db.migrations.find_one({"_id": f"timeseries:{name}"}) or {}
+    # dual_write sırasında kopyalama sürüyor olabilir; yalnızca hata ile durduysa geri alınır
+    if not (route == 'verifying' or (route == 'dual_write' and migration.get('error'))):
+        raise HTTPException(status_code=409, detail="Only a finished or failed, unconfirmed migration can be rolled back")
+    spawn_background(store.rollback())
+    logger.info(f"Admin {admin_user['username']} rolled back time-series migration for {name}")
+    return {"message": "Rollback started", "collection": name}
+
+# Admin: Slow Query Log
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(limit: int = Query(100, ge=1, le=1000), admin_user = Depends(get_admin_user)):
+    """Yavaş sorgu kayıtlarını listele (Sadece Admin)"""
+    entries = await db.slow_queries.find({}, {"_id": 0}).sort("$natural", -1).to_list(limit)
+    for entry in entries:
+        entry['shape'] = json.loads(entry['shape'])
+    return entries
+
+# Response Compression (gzip / Brotli)
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))  # Byte; bundan küçük yanıtlar sıkıştırılmaz
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))  # 1-9
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))  # 0-11
+
+# Zaten sıkıştırılmış (xlsx, parquet, resim) veya anlık akması gereken (SSE) içerikler hariç
+COMPRESSIBLE_TYPES = ('application/json', 'text/csv', 'text/plain', 'text/html')
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Accept-Encoding başlığından desteklenen en iyi kodlamayı seç (br > gzip)"""
+    accepted = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    
+    def allowed(encoding):
+        return accepted.get(encoding, accepted.get('*', 0)) > 0
+    
+    if brotli is not None and allowed('br'):
+        return 'br'
+    if allowed('gzip'):
+        return 'gzip'
+    return None
+
+class StreamCompressor:
+    """Parça parça sıkıştırıcı; her parça flush edilir, böylece akış yanıtları bekletilmez"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip başlığı
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == 'br':
+            out = self._compressor.process(data)
+            return out + (self._compressor.finish() if final else self._compressor.flush())
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class CompressionMiddleware:
+    """Saf ASGI sıkıştırma: tek parça yanıtlar eşik üstündeyse, akış yanıtları parça parça sıkıştırılır"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        
+        headers = {k.lower(): v for k, v in scope.get('headers', [])}
+        encoding = negotiate_encoding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        
+        start_message = None
+        compressor = None  # None: henüz karar verilmedi, False: sıkıştırma yok
+        buffered = b''
+        
+        async def send_compressed(message):
+            nonlocal start_message, compressor, buffered
+            if message['type'] == 'http.response.start':
+                start_message = message
+                response_headers = {k.lower(): v for k, v in message['headers']}
+                content_type = response_headers.get(b'content-type', b'').decode('latin-1').split(';')[0].strip()
+                if b'content-encoding' in response_headers or content_type not in COMPRESSIBLE_TYPES:
+                    compressor = False
+                    await send(message)
+                return
+            if message['type'] != 'http.response.body' or compressor is False:
+                return await send(message)
+            
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            
+            if compressor is None:
+                # Gövde parçalı gelebilir (ör. http middleware); eşiğe ulaşana kadar biriktir
+                buffered += body
+                if more_body and len(buffered) < COMPRESSION_MIN_SIZE:
+                    return
+                body, buffered = buffered, b''
+                
+                if not more_body and len(body) < COMPRESSION_MIN_SIZE:
+                    compressor = False
+                    await send(start_message)
+                    return await send({'type': 'http.response.body', 'body': body})
+                
+                compressor = StreamCompressor(encoding)
+                start_message['headers'] = [
+                    (k, v) for k, v in start_message['headers']
+                    if k.lower() not in (b'content-length', b'content-encoding', b'vary')
+                ] + [(b'content-encoding', encoding.encode()), (b'vary', b'Accept-Encoding')]
+                if not more_body:
+                    # Tek parça yanıt: gövde hazır, Content-Length ayarlanabilir
+                    compressed = self._compress(compressor, body, True)
+                    start_message['headers'].append((b'content-length', str(len(compressed)).encode()))
+                    await send(start_message)
+                    return await send({'type': 'http.response.body', 'body': compressed})
+                await send(start_message)
+            
+            await send({
+                'type': 'http.response.body',
+                'body': self._compress(compressor, body, not more_body),
+                'more_body': more_body
+            })
+        
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _compress(compressor: StreamCompressor, body: bytes, final: bool) -> bytes:
+        started = time.perf_counter()
+        compressed = compressor.compress(body, final)
+        metrics.observe(f"compression_{compressor.encoding}_ms", (time.perf_counter() - started) * 1000)
+        metrics.incr('compression_bytes_in', len(body))
+        metrics.incr('compression_bytes_out', len(compressed))
+        metrics.incr('compression_bytes_saved', len(body) - len(compressed))
+        return compressed
+
+# Idempotency (Idempotency-Key başlıklı POST'lar bir kez işlenir, tekrarlarda saklı yanıt döner)
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# İşleyen worker ölürse "processing" kaydı bu süreden sonra yeniden denemeye devredilir (yazma bütçesinden uzun olmalı)
+IDEMPOTENCY_LOCK_S = int(os.environ.get('IDEMPOTENCY_LOCK_S', '120'))
+# Bu durumlar geçicidir; saklanırsa istemci tekrar denese de hep aynı hatayı alır
+IDEMPOTENCY_TRANSIENT_STATUSES = (408, 409, 429)
+
+def idempotency_owner(authorization: bytes) -> Optional[str]:
+    """Anahtarlar kullanıcı bazında ayrılır; geçersiz token'da None (istek zaten 401 alır)"""
+    scheme, _, token = authorization.decode('latin-1').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]).get('user_id')
+    except Exception:
+        return None
+
+async def send_json_error(send, status: int, detail: str, headers: tuple = (), code: Optional[str] = None):
+    """code: başlıklar okunamasa da (CORS) istemcinin hatayı ayırt edebileceği makine kodu"""
+    body = json.dumps({"detail": detail, **({"code": code} if code else {})}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    """Saf ASGI: aynı anahtarla gelen tekrar, işlemi yeniden çalıştırmadan ilk yanıtı alır"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or not scope['path'].startswith('/api/'):
+            return await self.app(scope, receive, send)
+        
+        headers = {k.lower(): v for k, v in scope.get('headers', [])}
+        key = headers.get(b'idempotency-key', b'').decode('latin-1').strip()
+        if not key:
+            return await self.app(scope, receive, send)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return await send_json_error(send, 400, "Idempotency-Key is too long")
+        owner = idempotency_owner(headers.get(b'authorization', b''))
+        if owner is None:
+            return await self.app(scope, receive, send)
+        
+        # Parmak izi için gövdenin tamamı okunur, uygulamaya aynen yeniden verilir
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        fingerprint = hashlib.sha256(
+            b'%s %s?%s\n%s' % (scope['method'].encode(), scope['path'].encode(), scope.get('query_string', b''), body)
+        ).hexdigest()
+        record_key = f"{owner}:{key}"
+        now = datetime.now(timezone.utc)
+        lock = str(uuid.uuid4())  # Tamamlama/silme yalnızca kaydı hâlâ tutan istek tarafından yapılır
+        
+        try:
+            await db.idempotency_keys.insert_one({
+                "key": record_key,
+                "path": scope['path'],
+                "fingerprint": fingerprint,
+                "status": "processing",
+                "lock": lock,
+                "created_at": now.isoformat(),
+                # TTL index için BSON tarih olarak saklanır
+                "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_S),
+                "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+            })
+        except DuplicateKeyError:
+            existing = await db.idempotency_keys.find_one({"key": record_key})
+            if existing and existing['fingerprint'] != fingerprint:
+                return await send_json_error(send, 422, "Idempotency-Key was already used with a different request")
+            if existing and existing['status'] == 'completed':
+                metrics.incr('idempotency_replays')
+                response = existing['response']
+                await send({
+                    "type": "http.response.start",
+                    "status": response['status'],
+                    "headers": [(k.encode('latin-1'), v.encode('latin-1')) for k, v in response['headers']] + [(b'idempotent-replayed', b'true')]
+                })
+                await send({"type": "http.response.body", "body": response['body']})
+                return
+            # Kilidin süresi dolduysa sahibi ölmüştür; tek bir yeniden deneme devralır
+            taken = await db.idempotency_keys.update_one(
+                {"key": record_key, "status": "processing", "fingerprint": fingerprint,
+                 "$or": [{"locked_until": {"$lt": now}}, {"locked_until": {"$exists": False}}]},
+                {"$set": {"lock": lock, "locked_until": now + timedelta(seconds=IDEMPOTENCY_LOCK_S)}}
+            )
+            if not taken.modified_count:
+                return await send_json_error(send, 409, "A request with this Idempotency-Key is still in progress",
+                                             ((b'retry-after', b'1'),), code='idempotency_in_progress')
+            metrics.incr('idempotency_takeovers')
+        
+        body_sent = False
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+        
+        start_message = None
+        chunks = []
+        async def capture_send(message):
+            nonlocal start_message
+            if message['type'] == 'http.response.start':
+                start_message = message
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+            await send(message)
+        
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await db.idempotency_keys.delete_one({"key": record_key, "lock": lock})
+            raise
+        
+        status = start_message['status'] if start_message else 500
+        if status >= 500 or status in IDEMPOTENCY_TRANSIENT_STATUSES:
+            # Anahtarı bırak, istemci aynı anahtarla yeniden deneyebilsin
+            await db.idempotency_keys.delete_one({"key": record_key, "lock": lock})
+            return
+        await db.idempotency_keys.update_one({"key": record_key, "lock": lock}, {"$set": {
+            "status": "completed",
+            "response": {
+                "status": status,
+                "headers": [
+                    (k.decode('latin-1'), v.decode('latin-1')) for k, v in start_message['headers']
+                    if k.lower() not in (b'content-length', b'set-cookie')
+                ],
+                "body": b''.join(chunks)
+            }
+        }})
+
+# Admission Control (Ağır raporlar yazma yolunu boğmasın diye rota sınıfı başına kuyruk)
+ADMISSION_WRITE_CONCURRENCY = int(os.environ.get('ADMISSION_WRITE_CONCURRENCY', '64'))
+ADMISSION_WRITE_QUEUE = int(os.environ.get('ADMISSION_WRITE_QUEUE', '256'))
+ADMISSION_WRITE_MAX_WAIT_S = float(os.environ.get('ADMISSION_WRITE_MAX_WAIT_S', '10'))
+ADMISSION_WRITE_BUDGET_MS = int(os.environ.get('ADMISSION_WRITE_BUDGET_MS', '15000'))
+ADMISSION_ANALYTICS_CONCURRENCY = int(os.environ.get('ADMISSION_ANALYTICS_CONCURRENCY', '4'))
+ADMISSION_ANALYTICS_QUEUE = int(os.environ.get('ADMISSION_ANALYTICS_QUEUE', '16'))
+ADMISSION_ANALYTICS_MAX_WAIT_S = float(os.environ.get('ADMISSION_ANALYTICS_MAX_WAIT_S', '5'))
+ADMISSION_ANALYTICS_BUDGET_MS = int(os.environ.get('ADMISSION_ANALYTICS_BUDGET_MS', '30000'))
+
+# (method, path öneki) -> analitik sınıfı; SSE akışları hiçbir sınıfa girmez
+# Önek segment bazında eşleşir: '/api/stock' -> /api/stock ve /api/stock/..., /api/stock-transactions değil
+ANALYTICS_ROUTES = (
+    ('GET', '/api/costs/'),
+    ('POST', '/api/costs/simulate'),
+    ('GET', '/api/dashboard/'),
+    ('GET', '/api/stock'),
+    ('GET', '/api/daily-consumptions/rolling'),
+    ('GET', '/api/reports/'),
+    ('POST', '/api/admin/exports/'),
+    ('POST', '/api/admin/inventory/rebuild'),
+    ('POST', '/api/admin/stock-reconciliation'),
+)
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+class AdmissionLane:
+    """Sabit eş zamanlılık, sınırlı bekleme kuyruğu ve Mongo süre bütçesi olan rota sınıfı"""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, max_wait_s: float, budget_ms: int):
+        self.name = name
+        self.queue_size = queue_size
+        self.max_wait_s = max_wait_s
+        self.budget_ms = budget_ms
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait_s))
+
+    async def acquire(self) -> bool:
+        """Slot alınırsa True; kuyruk doluysa veya bekleme süresi aşılırsa False"""
+        if self._slots.locked() and self.waiting >= self.queue_size:
+            return False
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.max_wait_s)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+            metrics.observe(f"admission_wait_ms.{self.name}", (time.perf_counter() - started) * 1000)
+
+    def release(self):
+        self._slots.release()
+
+# Yazmaların kendi slotları var; analitik istekler onları hiçbir zaman tüketemez
+admission_lanes = {
+    'write': AdmissionLane('write', ADMISSION_WRITE_CONCURRENCY, ADMISSION_WRITE_QUEUE,
+                           ADMISSION_WRITE_MAX_WAIT_S, ADMISSION_WRITE_BUDGET_MS),
+    'analytics': AdmissionLane('analytics', ADMISSION_ANALYTICS_CONCURRENCY, ADMISSION_ANALYTICS_QUEUE,
+                               ADMISSION_ANALYTICS_MAX_WAIT_S, ADMISSION_ANALYTICS_BUDGET_MS),
+}
+
+def route_matches(path: str, prefix: str) -> bool:
+    if prefix.endswith('/'):
+        return path.startswith(prefix)
+    return path == prefix or path.startswith(prefix + '/')
+
+def admission_lane(method: str, path: str) -> Optional[AdmissionLane]:
+    if not path.startswith('/api/'):
+        return None
+    if any(method == route_method and route_matches(path, prefix) for route_method, prefix in ANALYTICS_ROUTES):
+        return admission_lanes['analytics']
+    if method in WRITE_METHODS:
+        return admission_lanes['write']
+    return None
+
+class AdmissionMiddleware:
+    """Saf ASGI: rota sınıfının slotu yoksa kuyrukta bekletir, dolu/zaman aşımında 503 + Retry-After döner"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        lane = admission_lane(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if lane is None:
+            return await self.app(scope, receive, send)
+        
+        retry_after = ((b'retry-after', str(lane.retry_after).encode()),)
+        if not await lane.acquire():
+            metrics.incr(f"admission_rejected.{lane.name}")
+            return await send_json_error(send, 503, "Server is busy, please retry later", retry_after)
+        
+        response_started = False
+        async def tracking_send(message):
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+        
+        try:
+            # Bütçe isteğin tüm Mongo komutlarına kalan süre kadar maxTimeMS olarak uygulanır
+            with mongo_timeout(lane.budget_ms / 1000):
+                await self.app(scope, receive, tracking_send)
+        except PyMongoError as e:
+            if not e.timeout or response_started:
+                raise
+            metrics.incr(f"admission_budget_exceeded.{lane.name}")
+            await send_json_error(send, 503, "Request exceeded its database time budget", retry_after)
+        finally:
+            lane.release()
+
 # Include router
 app.include_router(api_router)
 
+@app.middleware("http")
+async def track_request_scope(request, call_next):
+    """Mongo komutlarının hangi rotadan geldiğini izlemek için scope'u sakla"""
+    token = request_scope.set(request.scope)
+    try:
+        return await call_next(request)
+    finally:
+        request_scope.reset(token)
+
+app.add_middleware(IdempotencyMiddleware)
+
+# CORS'un içinde: 503 yanıtları da tarayıcıya CORS başlıklarıyla gitsin
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Farklı origin'den çağıran sayfa/service worker sürüm ve yeniden deneme başlıklarını okuyabilsin
+    expose_headers=["ETag", "Retry-After", "Idempotent-Replayed"],
 )
 
+app.add_middleware(CompressionMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+async def ensure_indexes():
+    """Uygulamanın ihtiyaç duyduğu index'leri oluştur (varsa dokunulmaz)"""
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index("expires_at", expireAfterSeconds=0)
+    await db.jobs.create_index([("status", 1), ("lease_until", 1)])
+    await db.idempotency_keys.create_index("key", unique=True)
+    try:
+        await db.users.create_index("username", unique=True)
+    except OperationFailure as e:
+        # Mevcut çift kayıtlar temizlenene kadar uygulama açılabilsin
+        logger.warning(f"Unique username index could not be created: {e}")
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    # Tarih aralığı sorguları (as_of stok, raporlar)
+    await db.manufacturing_records.create_index("production_date")
+    await db.shipments.create_index("shipment_date")
+    await db.material_entries.create_index("entry_date")
+    await db.stock_transactions.create_index("created_at")
+    await db.consumptions.create_index("created_at")
+    # Üretim silinirken bağlı masura/gaz tüketimleri
+    await db.consumptions.create_index("production_order_id")
+    await db.archive_consumptions.create_index("production_order_id")
+    await db.daily_consumptions.create_index("date")
+    await db.daily_gas_consumption.create_index("date")
+    await db.stock_snapshots.create_index("as_of", unique=True)
+    # SKU bazında stok sorguları
+    for name in SKU_COLLECTIONS:
+        await db[name].create_index("sku")
+        await db[f"archive_{name}"].create_index("sku")
+    await db.cut_production_records.create_index("sku")
+    # Stok olay kaydı: kalem bazında zaman sıralı okuma
+    await db.inventory_events.create_index("id", unique=True)
+    await db.inventory_events.create_index([("item_id", 1), ("created_at", 1)])
+    await db.stock_reconciliations.create_index("created_at")
+    # Typeahead önek araması
+    for name in SEARCH_FIELDS:
+        await db[name].create_index("search_keys")
+        if name in ARCHIVED_COLLECTIONS:
+            await db[f"archive_{name}"].create_index("search_keys")
+    # Düşük stok sorgusu yalnızca işaretli belgeleri içeren küçük index'e gider
+    await db.raw_materials.create_index("below_min", partialFilterExpression={"below_min": True})
+    # Artımlı Parquet export created_at sırasıyla okur
+    for name, (_, incremental) in PARQUET_DATASETS.items():
+        if incremental and name not in TIMESERIES_STORES:
+            await db[name].create_index("created_at")
+    for name, date_field in ARCHIVED_COLLECTIONS.items():
+        await db[f"archive_{name}"].create_index("id", unique=True)
+        await db[f"archive_{name}"].create_index(date_field)
+        await db[f"archive_{name}"].create_index("created_at")
+
+# Startup: aşamalar sırayla ısıtılır, hepsi bitince /healthz/ready 200 döner
+STARTUP_WARM_CONNECTIONS = int(os.environ.get('STARTUP_WARM_CONNECTIONS', '10'))
+startup_state = {"ready": False, "phases": {}}
+
+async def run_startup_phase(name: str, coro, critical: bool = True):
+    """Aşamayı çalıştır ve süresini logla; kritik olmayan aşamanın hatası başlatmayı durdurmaz"""
+    started = time.perf_counter()
+    try:
+        await coro
+    except Exception as e:
+        if critical:
+            raise
+        logger.warning(f"Startup phase {name} failed: {e}")
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    startup_state['phases'][name] = duration_ms
+    logger.info(f"Startup phase {name} finished in {duration_ms} ms")
+
+async def create_capped_collections():
+    collections = await db.list_collection_names()
+    for name, size in (('slow_queries', SLOW_QUERY_LOG_BYTES), ('stock_alerts', STOCK_ALERT_LOG_BYTES)):
+        if name not in collections:
+            try:
+                await db.create_collection(name, capped=True, size=size)
+            except CollectionInvalid:
+                pass
+
+async def warm_connections():
+    """Eşzamanlı ping'lerle havuzda bağlantıları önceden aç (ilk istekler el sıkışma beklemesin)"""
+    await asyncio.gather(*(db.command('ping') for _ in range(max(1, STARTUP_WARM_CONNECTIONS))))
+    await analytics_db.command('ping')
+
+async def warm_caches():
+    # Önce sürümleri al; yoksa cache_bus ilk senkronda yeni yüklenen veriyi siler
+    await cache_bus._sync()
+    await get_material_catalog()
+    await get_exchange_rate_map()
+    await material_price_components()
+    for name in ARCHIVED_COLLECTIONS:
+        await archived_before(name)
+    for store in TIMESERIES_STORES.values():
+        await store.route()
+
+async def warm_stock_ledger():
+    """Güncel stok hesabının okuduğu sayfaları Mongo önbelleğine al"""
+    await build_stock()
+    await analytics_db.raw_materials.find({}, {"_id": 0, "id": 1, "current_stock": 1}).to_list(1000)
+
+@app.on_event("startup")
+async def startup_db_client():
+    slow_query_listener.loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    await run_startup_phase('connections', warm_connections())
+    await run_startup_phase('collections', create_capped_collections())
+    await run_startup_phase('indexes', ensure_indexes())
+    # Açılış bakiyeleri istek kabul edilmeden yazılmalı, yoksa ilk hareketler iki kez sayılır
+    await run_startup_phase('inventory_seed', seed_inventory_events())
+    await run_startup_phase('caches', warm_caches(), critical=False)
+    await run_startup_phase('stock_ledger', warm_stock_ledger(), critical=False)
+    
+    spawn_background(cache_bus.run())
+    spawn_background(cleanup_expired_job_results())
+    spawn_background(run_job_recovery_scheduler())
+    spawn_background(run_stock_snapshot_scheduler())
+    spawn_background(run_archive_scheduler())
+    spawn_background(run_stock_reconciliation_scheduler())
+    spawn_background(backfill_skus())
+    spawn_background(backfill_below_min())
+    spawn_background(backfill_search_keys())
+    
+    startup_state['ready'] = True
+    logger.info(f"Startup finished in {round((time.perf_counter() - started) * 1000, 1)} ms, ready for traffic")
+
+@app.get("/healthz/live")
+async def liveness():
+    """Süreç ayakta mı (yeniden başlatma kararı için)"""
+    return {"status": "ok"}
+
+@app.get("/healthz/ready")
+async def readiness():
+    """Isınma bitti mi (yük dengeleyici trafiği ancak 200 dönünce yönlendirir)"""
+    if not startup_state['ready']:
+        return Response(
+            content=json.dumps({"status": "starting", "phases": startup_state['phases']}),
+            status_code=503, media_type="application/json"
+        )
+    return {"status": "ready", "phases": startup_state['phases']}
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    # Kapanırken yeni trafik almayalım
+    startup_state['ready'] = False
+    for task in list(_background_tasks):
+        task.cancel()
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    client.close()
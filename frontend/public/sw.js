@@ -1,5 +1,5 @@
 // SAR ERP Service Worker - Enhanced for PWA
-const CACHE_NAME = 'sar-erp-v1.1';
+const CACHE_NAME = 'sar-erp-v1.2';
 const urlsToCache = [
   '/',
   '/static/js/bundle.js',
@@ -10,6 +10,24 @@ const urlsToCache = [
   '/dashboard'
 ];
 
+// API cache (kullanıcı başına ayrı) ve yazma kuyruğu (outbox)
+const API_CACHE_PREFIX = 'sar-erp-api-v1-';
+const API_CACHE_MAX_ENTRIES = 200;
+const OUTBOX_DB = 'sar-erp-outbox';
+const OUTBOX_STORE = 'requests';
+const OUTBOX_SYNC_TAG = 'sar-erp-outbox';
+const OUTBOX_METHODS = ['POST', 'PUT'];
+// Hesaplama/oturum/yönetim istekleri çevrimdışı kuyruğa alınmaz
+const OUTBOX_EXCLUDED = ['/api/auth/', '/api/costs/', '/api/jobs', '/api/admin/'];
+// Sunucu meşgul veya anahtar hâlâ işleniyor: sonra tekrar dene
+const RETRYABLE_STATUSES = [408, 425, 429, 502, 503, 504];
+
+// Son yazmadan sonra ilk okuma ağdan gelsin (kullanıcı kendi kaydını hemen görsün)
+const lastWriteAt = {};
+// Kullanıcı başına en güncel token; süresi dolmuş token ile bekleyen istekler bununla gönderilir
+const latestAuthorization = {};
+let replayChain = Promise.resolve();
+
 // Install event - cache resources
 self.addEventListener('install', function(event) {
   console.log('SAR ERP SW: Installing...');
@@ -31,7 +49,7 @@ self.addEventListener('activate', function(event) {
     caches.keys().then(function(cacheNames) {
       return Promise.all(
         cacheNames.map(function(cacheName) {
-          if (cacheName !== CACHE_NAME) {
+          if (cacheName !== CACHE_NAME && !cacheName.startsWith(API_CACHE_PREFIX)) {
             console.log('SAR ERP SW: Deleting old cache:', cacheName);
             return caches.delete(cacheName);
           }
@@ -43,8 +61,382 @@ self.addEventListener('activate', function(event) {
   return self.clients.claim();
 });
 
-// Fetch event - serve from cache, fallback to network
+// ---- Yardımcılar ----
+
+function isApiRequest(url) {
+  return url.pathname.startsWith('/api/');
+}
+
+function jsonResponse(status, body, headers) {
+  return new Response(JSON.stringify(body), {
+    status: status,
+    headers: Object.assign({ 'Content-Type': 'application/json' }, headers || {})
+  });
+}
+
+function tokenUserId(authorization) {
+  // JWT gövdesindeki user_id; sadece token yenilendiğinde aynı kullanıcıyı bulmak için
+  try {
+    const payload = authorization.split(' ')[1].split('.')[1];
+    return JSON.parse(atob(payload.replace(/-/g, '+').replace(/_/g, '/'))).user_id || null;
+  } catch (e) {
+    return null;
+  }
+}
+
+async function userKey(authorization) {
+  // Token'ın özeti: farklı oturumlar birbirinin önbelleğini göremez
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(authorization || 'anonymous'));
+  return Array.from(new Uint8Array(digest)).slice(0, 8)
+    .map(function(b) { return b.toString(16).padStart(2, '0'); }).join('');
+}
+
+async function notifyClients(message) {
+  const clients = await self.clients.matchAll({ includeUncontrolled: true, type: 'window' });
+  clients.forEach(function(client) { client.postMessage(message); });
+}
+
+function rememberAuthorization(authorization) {
+  const userId = authorization && tokenUserId(authorization);
+  if (userId) {
+    latestAuthorization[userId] = authorization;
+  }
+}
+
+// ---- GET /api/*: stale-while-revalidate ----
+
+function isCacheableApiGet(request, url) {
+  if (request.method !== 'GET' || !isApiRequest(url)) {
+    return false;
+  }
+  // SSE akışları ve dosya indirmeleri önbelleğe alınmaz
+  if ((request.headers.get('Accept') || '').includes('text/event-stream') || url.pathname.endsWith('/events')) {
+    return false;
+  }
+  return !url.pathname.startsWith('/api/auth/') && !url.pathname.startsWith('/api/reports/')
+    && !url.pathname.endsWith('/result');
+}
+
+async function trimCache(cache) {
+  const keys = await cache.keys();
+  // cache.keys() ekleme sırasını korur; en eskiler silinir
+  await Promise.all(keys.slice(0, Math.max(0, keys.length - API_CACHE_MAX_ENTRIES)).map(function(key) {
+    return cache.delete(key);
+  }));
+}
+
+async function revalidate(cache, request, cached) {
+  const response = await fetch(request);
+  if (response.status === 401) {
+    // Oturum düştü: bu token'ın önbelleği artık geçersiz
+    await caches.delete(cache.name);
+    return response;
+  }
+  if (response.status !== 200 || (response.headers.get('Cache-Control') || '').includes('no-store')) {
+    return response;
+  }
+  const body = await response.clone().arrayBuffer();
+  const headers = new Headers(response.headers);
+  headers.set('sw-cached-at', String(Date.now()));
+  await cache.delete(request);
+  await cache.put(request, new Response(body, { status: 200, statusText: response.statusText, headers: headers }));
+  await trimCache(cache);
+
+  if (cached) {
+    const previous = await cached.clone().arrayBuffer();
+    if (!equalBuffers(previous, body)) {
+      // Sayfa eski veriyi gösterdi; yenisini istesin
+      notifyClients({ type: 'api-updated', url: request.url });
+    }
+  }
+  return response;
+}
+
+function equalBuffers(a, b) {
+  if (a.byteLength !== b.byteLength) {
+    return false;
+  }
+  const x = new Uint8Array(a);
+  const y = new Uint8Array(b);
+  for (let i = 0; i < x.length; i++) {
+    if (x[i] !== y[i]) {
+      return false;
+    }
+  }
+  return true;
+}
+
+async function handleApiGet(event) {
+  const request = event.request;
+  const authorization = request.headers.get('Authorization');
+  rememberAuthorization(authorization);
+  const key = await userKey(authorization);
+  const cache = await caches.open(API_CACHE_PREFIX + key);
+  const cached = await cache.match(request);
+
+  const freshAfterWrite = cached && Number(cached.headers.get('sw-cached-at') || 0) >= (lastWriteAt[key] || 0);
+  if (cached && freshAfterWrite) {
+    // Önbellekten hemen dön, arka planda yenile
+    event.waitUntil(revalidate(cache, request, cached).catch(function() {}));
+    return cached;
+  }
+
+  try {
+    return await revalidate(cache, request, cached);
+  } catch (error) {
+    if (cached) {
+      return cached;
+    }
+    return jsonResponse(503, { detail: 'Çevrimdışı: bu veri henüz önbellekte yok' });
+  }
+}
+
+// ---- POST/PUT /api/*: IndexedDB outbox + Background Sync ----
+
+function openOutbox() {
+  return new Promise(function(resolve, reject) {
+    const open = indexedDB.open(OUTBOX_DB, 1);
+    open.onupgradeneeded = function() {
+      open.result.createObjectStore(OUTBOX_STORE, { keyPath: 'id', autoIncrement: true });
+    };
+    open.onsuccess = function() { resolve(open.result); };
+    open.onerror = function() { reject(open.error); };
+  });
+}
+
+async function outboxTransaction(mode, operation) {
+  const database = await openOutbox();
+  return new Promise(function(resolve, reject) {
+    const tx = database.transaction(OUTBOX_STORE, mode);
+    const request = operation(tx.objectStore(OUTBOX_STORE));
+    tx.oncomplete = function() { resolve(request && request.result); database.close(); };
+    tx.onerror = function() { reject(tx.error); database.close(); };
+  });
+}
+
+function outboxAll() {
+  // autoIncrement anahtarı sırası = kuyruğa giriş sırası
+  return outboxTransaction('readonly', function(store) { return store.getAll(); });
+}
+
+function outboxAdd(entry) {
+  return outboxTransaction('readwrite', function(store) { return store.add(entry); });
+}
+
+function outboxDelete(id) {
+  return outboxTransaction('readwrite', function(store) { return store.delete(id); });
+}
+
+function isOutboxRequest(request, url) {
+  return OUTBOX_METHODS.includes(request.method) && isApiRequest(url)
+    && !OUTBOX_EXCLUDED.some(function(prefix) { return url.pathname.startsWith(prefix); });
+}
+
+async function cachedVersion(url, authorization) {
+  // PUT /api/x/{id} için önbellekteki GET /api/x yanıtında kaydın sürümü (en yeni yanıt önce)
+  const segments = new URL(url).pathname.split('/');
+  const id = segments.pop();
+  const listPath = segments.join('/');
+  const cache = await caches.open(API_CACHE_PREFIX + await userKey(authorization));
+  const keys = (await cache.keys()).filter(function(key) { return new URL(key.url).pathname === listPath; });
+  for (const key of keys.reverse()) {
+    try {
+      const items = await (await cache.match(key)).json();
+      const record = Array.isArray(items) && items.find(function(item) { return item && item.id === id; });
+      if (record && record.version) {
+        return record.version;
+      }
+    } catch (e) {
+      // Bozuk/JSON olmayan önbellek kaydı
+    }
+  }
+  return null;
+}
+
+async function toOutboxEntry(request) {
+  const headers = {};
+  request.headers.forEach(function(value, name) { headers[name] = value; });
+  // Tekrar gönderimde sunucu işlemi iki kez yapmasın
+  if (!headers['idempotency-key']) {
+    headers['idempotency-key'] = crypto.randomUUID();
+  }
+  // Kuyruktaki düzenleme, kullanıcının gördüğü sürüme göre gönderilsin; arada değiştiyse sunucu 409 döner
+  if (request.method === 'PUT' && !headers['if-match']) {
+    const version = await cachedVersion(request.url, headers['authorization']);
+    if (version) {
+      headers['if-match'] = '"' + version + '"';
+    }
+  }
+  return {
+    method: request.method,
+    url: request.url,
+    headers: headers,
+    body: await request.arrayBuffer(),
+    userId: tokenUserId(headers['authorization'] || ''),
+    queuedAt: new Date().toISOString()
+  };
+}
+
+function sendEntry(entry) {
+  const headers = Object.assign({}, entry.headers);
+  const refreshed = entry.userId && latestAuthorization[entry.userId];
+  if (refreshed) {
+    headers['authorization'] = refreshed;
+  }
+  return fetch(entry.url, { method: entry.method, headers: headers, body: entry.body });
+}
+
+async function markWritten(entry) {
+  lastWriteAt[await userKey(entry.headers['authorization'])] = Date.now();
+  const refreshed = entry.userId && latestAuthorization[entry.userId];
+  if (refreshed) {
+    lastWriteAt[await userKey(refreshed)] = Date.now();
+  }
+}
+
+async function readError(response) {
+  try {
+    return await response.clone().json();
+  } catch (e) {
+    return {};
+  }
+}
+
+async function replayOutboxOnce() {
+  // Sırayla gönder; ağ yoksa veya sunucu meşgulse dur, sonraki senkronda kaldığı yerden devam et
+  const sent = {};
+  const entries = await outboxAll();
+  for (const entry of entries) {
+    let response;
+    try {
+      response = await sendEntry(entry);
+    } catch (error) {
+      throw new Error('SAR ERP SW: Outbox replay stopped, network unavailable');
+    }
+    // Aynı anahtarlı istek hâlâ işleniyor (sürüm çakışması değil); CORS başlıkları gizleyebileceği
+    // için gövdedeki koda bakılır, Retry-After yalnızca yedek
+    const error = response.ok ? {} : await readError(response);
+    const inProgress = response.status === 409
+      && (error.code === 'idempotency_in_progress' || response.headers.has('Retry-After'));
+    if (RETRYABLE_STATUSES.includes(response.status) || inProgress) {
+      throw new Error('SAR ERP SW: Outbox replay deferred, status ' + response.status);
+    }
+    if (response.status === 401) {
+      // Yeni giriş yapılınca aynı kullanıcının token'ı ile devam edilir
+      notifyClients({ type: 'outbox-auth-required', pending: entries.length });
+      throw new Error('SAR ERP SW: Outbox replay needs a fresh login');
+    }
+
+    await outboxDelete(entry.id);
+    await markWritten(entry);
+    sent[entry.id] = response;
+    if (response.ok) {
+      notifyClients({ type: 'outbox-sent', method: entry.method, url: entry.url, queuedAt: entry.queuedAt });
+    } else {
+      // Çakışma (409/412) veya doğrulama hatası: tekrar denemek sonucu değiştirmez, kullanıcıya göster
+      notifyClients({
+        type: 'outbox-conflict',
+        status: response.status,
+        detail: error.detail ?? null,
+        etag: response.headers.get('ETag'),
+        method: entry.method,
+        url: entry.url,
+        body: new TextDecoder().decode(entry.body),
+        queuedAt: entry.queuedAt
+      });
+    }
+  }
+  return sent;
+}
+
+function replayOutbox() {
+  // Aynı anda tek gönderim; aksi halde bir istek iki kez gidebilir
+  const run = replayChain.then(replayOutboxOnce);
+  replayChain = run.catch(function() {});
+  return run;
+}
+
+async function registerSync() {
+  // Background Sync yoksa (Safari/Firefox) sayfa 'online' olunca replay-outbox mesajı gönderir
+  if (self.registration.sync) {
+    try {
+      await self.registration.sync.register(OUTBOX_SYNC_TAG);
+    } catch (e) {
+      console.log('SAR ERP SW: Background sync unavailable:', e.message);
+    }
+  }
+}
+
+function queuedResponse(entry) {
+  return jsonResponse(202, {
+    detail: 'Çevrimdışı: istek kuyruğa alındı, bağlantı gelince gönderilecek',
+    queued: true,
+    queued_at: entry.queuedAt
+  }, { 'sw-queued': 'true' });
+}
+
+async function handleApiWrite(request) {
+  rememberAuthorization(request.headers.get('Authorization'));
+  const entry = await toOutboxEntry(request);
+  const pending = await outboxAll();
+
+  if (pending.length === 0) {
+    try {
+      const response = await sendEntry(entry);
+      await markWritten(entry);
+      return response;
+    } catch (error) {
+      // Ağ yok: kuyruğa al
+    }
+    await outboxAdd(entry);
+    await registerSync();
+    notifyClients({ type: 'outbox-queued', pending: 1 });
+    return queuedResponse(entry);
+  }
+
+  // Önce bekleyenler gitmeli (sıra korunur); bu istek de sıraya girer
+  const id = await outboxAdd(entry);
+  try {
+    const sent = await replayOutbox();
+    if (sent[id]) {
+      return sent[id];
+    }
+  } catch (error) {
+    console.log(error.message);
+  }
+  await registerSync();
+  notifyClients({ type: 'outbox-queued', pending: pending.length + 1 });
+  return queuedResponse(entry);
+}
+
+self.addEventListener('sync', function(event) {
+  if (event.tag === OUTBOX_SYNC_TAG) {
+    event.waitUntil(replayOutbox());
+  }
+});
+
+self.addEventListener('message', function(event) {
+  if (event.data && event.data.type === 'replay-outbox') {
+    event.waitUntil(replayOutbox().catch(function(error) { console.log(error.message); }));
+  }
+});
+
+// Fetch event - API: stale-while-revalidate / outbox, statik dosyalar: cache, fallback to network
 self.addEventListener('fetch', function(event) {
+  const url = new URL(event.request.url);
+
+  if (isCacheableApiGet(event.request, url)) {
+    event.respondWith(handleApiGet(event));
+    return;
+  }
+  if (isOutboxRequest(event.request, url)) {
+    event.respondWith(handleApiWrite(event.request));
+    return;
+  }
+  if (event.request.method !== 'GET' || isApiRequest(url)) {
+    return;
+  }
+
   event.respondWith(
     caches.match(event.request)
       .then(function(response) {
@@ -59,19 +451,19 @@ self.addEventListener('fetch', function(event) {
           if (!response || response.status !== 200 || response.type !== 'basic') {
             return response;
           }
-          
+
           // Clone the response
           const responseToCache = response.clone();
-          
+
           // Add to cache for future use
           caches.open(CACHE_NAME)
             .then(function(cache) {
               cache.put(event.request, responseToCache);
             });
-          
+
           return response;
         });
       }
     )
   );
-});
\ No newline at end of file
+});
@@ -109,6 +109,39 @@ function App() {
     };
   }, []);
 
+  useEffect(() => {
+    // Service worker çevrimdışı kuyruk (outbox) bildirimleri
+    if (!('serviceWorker' in navigator)) {
+      return;
+    }
+
+    const handleWorkerMessage = (event) => {
+      const data = event.data || {};
+      if (data.type === 'outbox-queued') {
+        toast.info(`Bağlantı yok: ${data.pending} kayıt kuyrukta, bağlantı gelince gönderilecek`);
+      } else if (data.type === 'outbox-sent') {
+        toast.success('Bekleyen kayıt gönderildi');
+      } else if (data.type === 'outbox-conflict') {
+        toast.error(`Bekleyen kayıt gönderilemedi (${data.status}): ${data.detail || data.url}`, { duration: Infinity });
+      } else if (data.type === 'outbox-auth-required') {
+        toast.warning('Bekleyen kayıtların gönderilmesi için tekrar giriş yapın');
+      }
+    };
+
+    // Background Sync desteklemeyen tarayıcılarda kuyruğu bağlantı gelince gönder
+    const handleOnline = () => {
+      navigator.serviceWorker.controller?.postMessage({ type: 'replay-outbox' });
+    };
+
+    navigator.serviceWorker.addEventListener('message', handleWorkerMessage);
+    window.addEventListener('online', handleOnline);
+
+    return () => {
+      navigator.serviceWorker.removeEventListener('message', handleWorkerMessage);
+      window.removeEventListener('online', handleOnline);
+    };
+  }, []);
+
   const handleInstallClick = async () => {
     if (deferredPrompt) {
       deferredPrompt.prompt();
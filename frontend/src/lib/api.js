@@ -0,0 +1,21 @@
+import { toast } from "sonner";
+
+// Sürümlü kayıt (üretim, hammadde girişi, kullanıcı) düzenlenirken gönderilir;
+// kayıt bu arada başkası tarafından değiştirildiyse sunucu 409 döner
+export function ifMatchHeaders(record) {
+  return { 'If-Match': `"${record?.version ?? 1}"` };
+}
+
+// Service worker çevrimdışıyken isteği kuyruğa aldı (202 + sw-queued): kayıt henüz sunucuda değil
+export function isQueued(response) {
+  return response?.headers?.['sw-queued'] === 'true';
+}
+
+// Başarı mesajını yalnızca sunucu kaydettiyse göster; kuyruk bildirimi App.js'ten gelir
+export function toastSaved(response, message) {
+  if (isQueued(response)) {
+    return false;
+  }
+  toast.success(message);
+  return true;
+}
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -147,11 +148,11 @@ export default function Consumption({ user }) {
       };
 
       if (editingConsumption) {
-        await axios.put(`${API}/daily-consumptions/${editingConsumption.id}`, payload);
-        toast.success('Tüketim kaydı güncellendi');
+        const saved = await axios.put(`${API}/daily-consumptions/${editingConsumption.id}`, payload);
+        toastSaved(saved, 'Tüketim kaydı güncellendi');
       } else {
-        await axios.post(`${API}/daily-consumptions`, payload);
-        toast.success('Tüketim kaydı oluşturuldu');
+        const saved = await axios.post(`${API}/daily-consumptions`, payload);
+        toastSaved(saved, 'Tüketim kaydı oluşturuldu');
       }
       
       setDialogOpen(false);
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -194,8 +195,8 @@ export default function CutProduction({ user }) {
         color: formData.color || null
       };
 
-      await axios.post(`${API}/cut-production`, payload);
-      toast.success('Kesilmiş üretim kaydı oluşturuldu');
+      const saved = await axios.post(`${API}/cut-production`, payload);
+      toastSaved(saved, 'Kesilmiş üretim kaydı oluşturuldu');
       
       setDialogOpen(false);
       setFormData({
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Card, CardContent, CardHeader, CardTitle, CardDescription } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -54,10 +55,10 @@ export default function ExchangeRates() {
     setSaving(true);
     try {
       const token = localStorage.getItem('token');
-      await axios.put(`${API}/exchange-rates`, formData, {
+      const saved = await axios.put(`${API}/exchange-rates`, formData, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      toast.success('Döviz kurları güncellendi');
+      toastSaved(saved, 'Döviz kurları güncellendi');
       fetchRates();
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Kurlar güncellenemedi');
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -47,11 +48,11 @@ export default function GasConsumption({ user }) {
       };
 
       if (editingRecord) {
-        await axios.put(`${API}/gas-consumption/${editingRecord.id}`, payload);
-        toast.success('Gaz tüketimi güncellendi');
+        const saved = await axios.put(`${API}/gas-consumption/${editingRecord.id}`, payload);
+        toastSaved(saved, 'Gaz tüketimi güncellendi');
       } else {
-        await axios.post(`${API}/gas-consumption`, payload);
-        toast.success('Gaz tüketimi kaydedildi');
+        const saved = await axios.post(`${API}/gas-consumption`, payload);
+        toastSaved(saved, 'Gaz tüketimi kaydedildi');
       }
       
       setDialogOpen(false);
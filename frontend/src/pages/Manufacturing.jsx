@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { ifMatchHeaders, toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -190,12 +191,14 @@ export default function Manufacturing({ user }) {
 
       if (editingRecord) {
         // Update existing record using PUT
-        await axios.put(`${API}/manufacturing/${editingRecord.id}`, payload);
-        toast.success('Üretim kaydı güncellendi');
+        const saved = await axios.put(`${API}/manufacturing/${editingRecord.id}`, payload, {
+          headers: ifMatchHeaders(editingRecord)
+        });
+        toastSaved(saved, 'Üretim kaydı güncellendi');
       } else {
         // Create new record
-        await axios.post(`${API}/manufacturing`, payload);
-        toast.success('Üretim kaydı eklendi');
+        const saved = await axios.post(`${API}/manufacturing`, payload);
+        toastSaved(saved, 'Üretim kaydı eklendi');
       }
       
       // Kayıtları hemen yenile
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { ifMatchHeaders, toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -79,11 +80,13 @@ export default function MaterialEntries({ user }) {
       };
 
       if (editingEntry) {
-        await axios.put(`${API}/material-entries/${editingEntry.id}`, payload);
-        toast.success('Hammadde girişi güncellendi');
+        const saved = await axios.put(`${API}/material-entries/${editingEntry.id}`, payload, {
+          headers: ifMatchHeaders(editingEntry)
+        });
+        toastSaved(saved, 'Hammadde girişi güncellendi');
       } else {
-        await axios.post(`${API}/material-entries`, payload);
-        toast.success('Hammadde girişi kaydedildi ve stok güncellendi');
+        const saved = await axios.post(`${API}/material-entries`, payload);
+        toastSaved(saved, 'Hammadde girişi kaydedildi ve stok güncellendi');
       }
       
       // Kayıtları hemen yenile
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -53,12 +54,12 @@ export default function Production({ user }) {
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
-      await axios.post(`${API}/production-orders`, {
+      const saved = await axios.post(`${API}/production-orders`, {
         ...formData,
         quantity: parseFloat(formData.quantity),
         planned_date: new Date(formData.planned_date).toISOString()
       });
-      toast.success('Üretim emri oluşturuldu');
+      toastSaved(saved, 'Üretim emri oluşturuldu');
       setDialogOpen(false);
       setFormData({ product_id: '', quantity: '', planned_date: '' });
       fetchOrders();
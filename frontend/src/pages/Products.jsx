@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -40,8 +41,8 @@ export default function Products({ user }) {
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
-      await axios.post(`${API}/products`, formData);
-      toast.success('Ürün eklendi');
+      const saved = await axios.post(`${API}/products`, formData);
+      toastSaved(saved, 'Ürün eklendi');
       setDialogOpen(false);
       setFormData({ name: '', code: '', unit: 'adet' });
       fetchProducts();
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -63,12 +64,13 @@ export default function ProfilePage() {
         headers: { Authorization: `Bearer ${token}` }
       });
 
-      // LocalStorage'daki user bilgisini güncelle
-      const user = JSON.parse(localStorage.getItem('user'));
-      user.username = response.data.username;
-      localStorage.setItem('user', JSON.stringify(user));
-
-      toast.success('Profil güncellendi');
+      // Çevrimdışı kuyruğa alındıysa yanıt kullanıcı bilgisi içermez
+      if (toastSaved(response, 'Profil güncellendi')) {
+        // LocalStorage'daki user bilgisini güncelle
+        const user = JSON.parse(localStorage.getItem('user'));
+        user.username = response.data.username;
+        localStorage.setItem('user', JSON.stringify(user));
+      }
       setFormData({ ...formData, password: '', confirmPassword: '' });
       fetchProfile();
     } catch (error) {
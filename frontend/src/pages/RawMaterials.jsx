@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -128,11 +129,11 @@ export default function RawMaterials({ user }) {
       };
 
       if (editingMaterial) {
-        await axios.put(`${API}/raw-materials/${editingMaterial.id}`, payload);
-        toast.success('Hammadde güncellendi');
+        const saved = await axios.put(`${API}/raw-materials/${editingMaterial.id}`, payload);
+        toastSaved(saved, 'Hammadde güncellendi');
       } else {
-        await axios.post(`${API}/raw-materials`, payload);
-        toast.success('Hammadde eklendi');
+        const saved = await axios.post(`${API}/raw-materials`, payload);
+        toastSaved(saved, 'Hammadde eklendi');
       }
 
       // Kayıtları hemen yenile
@@ -162,12 +163,12 @@ export default function RawMaterials({ user }) {
   const handleStockTransaction = async (e) => {
     e.preventDefault();
     try {
-      await axios.post(`${API}/stock-transactions`, {
+      const saved = await axios.post(`${API}/stock-transactions`, {
         material_id: selectedMaterial.id,
         ...stockData,
         quantity: parseFloat(stockData.quantity)
       });
-      toast.success('Stok hareketi kaydedildi');
+      toastSaved(saved, 'Stok hareketi kaydedildi');
       setStockDialogOpen(false);
       setStockData({ transaction_type: 'in', quantity: '', reference: '', notes: '' });
       fetchMaterials();
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { toastSaved } from '@/lib/api';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '@/components/ui/dialog';
@@ -175,11 +176,11 @@ export default function Shipments({ user }) {
       };
 
       if (editingShipment) {
-        await axios.put(`${API}/shipments/${editingShipment.id}`, payload);
-        toast.success('Sevkiyat kaydı güncellendi');
+        const saved = await axios.put(`${API}/shipments/${editingShipment.id}`, payload);
+        toastSaved(saved, 'Sevkiyat kaydı güncellendi');
       } else {
-        await axios.post(`${API}/shipments`, payload);
-        toast.success('Sevkiyat kaydı oluşturuldu');
+        const saved = await axios.post(`${API}/shipments`, payload);
+        toastSaved(saved, 'Sevkiyat kaydı oluşturuldu');
       }
       
       setDialogOpen(false);
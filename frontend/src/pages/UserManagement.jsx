@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import { toast } from 'sonner';
+import { ifMatchHeaders, toastSaved } from '@/lib/api';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter } from '@/components/ui/dialog';
@@ -50,10 +51,10 @@ export default function UserManagement() {
 
     try {
       const token = localStorage.getItem('token');
-      await axios.post(`${API}/users`, formData, {
+      const saved = await axios.post(`${API}/users`, formData, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      toast.success('Kullanıcı başarıyla eklendi');
+      toastSaved(saved, 'Kullanıcı başarıyla eklendi');
       setShowAddDialog(false);
       setFormData({ username: '', password: '', role: 'viewer' });
       fetchUsers();
@@ -80,10 +81,10 @@ export default function UserManagement() {
         updateData.password = formData.password;
       }
 
-      await axios.put(`${API}/users/${currentUser.id}`, updateData, {
-        headers: { Authorization: `Bearer ${token}` }
+      const saved = await axios.put(`${API}/users/${currentUser.id}`, updateData, {
+        headers: { Authorization: `Bearer ${token}`, ...ifMatchHeaders(currentUser) }
       });
-      toast.success('Kullanıcı güncellendi');
+      toastSaved(saved, 'Kullanıcı güncellendi');
       setShowEditDialog(false);
       setCurrentUser(null);
       setFormData({ username: '', password: '', role: 'viewer' });